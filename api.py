@@ -1,11 +1,72 @@
-from flask import Blueprint, jsonify, request
-from datetime import datetime, date
-from models import Employee, Attendance, JobTitle, JobCategory, Supervisor
+from flask import Blueprint, jsonify, request, Response, stream_with_context
+from datetime import datetime, date, time
+from sqlalchemy import tuple_
+from models import (Employee, Attendance, AttendanceChange, AttendanceDailyRollup, JobTitle, JobCategory, Supervisor,
+                    attendance_source)
 from app import db
+from columnar_export import AttendanceColumns, COMPRESSIONS, compress, pyarrow, zstandard
+from attendance_matrix import (SET_OPERATIONS, combine_days, days_in_month, days_present, month_matrix, parse_month,
+                               present_days, write_matrix_xlsx)
+import base64
+import io
+import json
 import logging
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+def attendance_rows_query(attendance=Attendance):
+    """Attendance rows joined to everything the JSON APIs show, as plain tuples
+
+    A single statement replaces the per-record lazy loads of employee, job
+    title, category and supervisor. ``attendance`` is Attendance or an
+    attendance_source() entity that also covers archived months.
+    """
+    return db.session.query(
+        attendance.id,
+        attendance.date,
+        attendance.time,
+        attendance.datetime,
+        attendance.latitude,
+        attendance.longitude,
+        Employee.employee_number,
+        Employee.name.label('employee_name'),
+        JobTitle.name.label('job_title'),
+        JobCategory.name.label('category'),
+        Supervisor.full_name.label('supervisor')
+    ).join(Employee, attendance.employee_id == Employee.id) \
+     .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id) \
+     .outerjoin(JobCategory, JobTitle.category_id == JobCategory.id) \
+     .outerjoin(Supervisor, attendance.marked_by_id == Supervisor.id)
+
+def serialize_attendance(row):
+    """Convert an attendance_rows_query() row to the API's JSON shape"""
+    return {
+        'id': row.id,
+        'employee_id': row.employee_number,
+        'employee_name': row.employee_name,
+        'date': row.date.isoformat(),
+        'time': row.time.strftime('%H:%M:%S'),
+        'datetime': row.datetime.isoformat() if row.datetime else None,
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'job_title': row.job_title,
+        'category': row.category,
+        'supervisor': row.supervisor
+    }
+
+def serialize_sync_record(row):
+    """Convert an attendance_rows_query() row to the .NET sync JSON shape"""
+    return {
+        'employee_id': row.employee_number,
+        'name': row.employee_name,
+        'date': row.date.isoformat(),
+        'time': row.time.strftime('%H:%M:%S'),
+        'latitude': row.latitude,
+        'longitude': row.longitude,
+        'job_title': row.job_title,
+        'category': row.category
+    }
+
 @api_bp.route('/employees', methods=['GET'])
 def get_employees():
     """Get list of all employees for .NET integration"""
@@ -40,6 +101,24 @@ def get_employees():
             'error': str(e)
         }), 500
 
+# Page size limits for keyset-paginated endpoints
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Rows fetched per round trip when streaming from a server-side cursor
+STREAM_BATCH_SIZE = 1000
+
+def encode_attendance_cursor(row):
+    """Encode the (date, time, id) sort key of a row as an opaque cursor"""
+    key = f"{row.date.isoformat()}|{row.time.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(key.encode()).decode().rstrip('=')
+
+def decode_attendance_cursor(cursor):
+    """Decode a cursor produced by encode_attendance_cursor()"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    date_str, time_str, id_str = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+    return date.fromisoformat(date_str), time.fromisoformat(time_str), int(id_str)
+
 @api_bp.route('/attendance/daily', methods=['GET'])
 def get_daily_attendance():
     """Get attendance records for a specific date"""
@@ -56,24 +135,10 @@ def get_daily_attendance():
             }), 400
 
         # Query attendance records for the date
-        attendance_records = Attendance.query.filter_by(date=attendance_date).all()
-
-        attendance_list = []
-        for record in attendance_records:
-            attendance_data = {
-                'id': record.id,
-                'employee_id': record.employee.employee_number,
-                'employee_name': record.employee.name,
-                'date': record.date.isoformat(),
-                'time': record.time.strftime('%H:%M:%S'),
-                'datetime': record.datetime.isoformat() if record.datetime else None,
-                'latitude': record.latitude,
-                'longitude': record.longitude,
-                'job_title': record.employee.job_title.name if record.employee.job_title else None,
-                'category': record.employee.job_title.category.name if record.employee.job_title else None,
-                'supervisor': record.marked_by_supervisor.full_name if record.marked_by_supervisor else None
-            }
-            attendance_list.append(attendance_data)
+        attendance = attendance_source(attendance_date, attendance_date)
+        attendance_rows = attendance_rows_query(attendance).filter(attendance.date == attendance_date).all()
+
+        attendance_list = [serialize_attendance(row) for row in attendance_rows]
 
         return jsonify({
             'success': True,
@@ -117,7 +182,14 @@ def get_job_titles_by_category(category_id):
 
 @api_bp.route('/attendance/range', methods=['GET'])
 def get_attendance_range():
-    """Get attendance records for a date range"""
+    """Get attendance records for a date range
+
+    Pass ``limit`` and/or ``after`` to page through the range newest first;
+    each page returns ``next_cursor`` to pass as ``after`` for the next one.
+    Pass ``format=ndjson`` to stream the rows as newline-delimited JSON; a
+    paged stream ends with a ``{"next_cursor": ...}`` line when another
+    page exists.
+    """
     try:
         start_date_str = request.args.get('start_date')
         end_date_str = request.args.get('end_date')
@@ -137,35 +209,74 @@ def get_attendance_range():
                 'error': 'Invalid date format. Use YYYY-MM-DD'
             }), 400
 
+        after = request.args.get('after')
+        limit_str = request.args.get('limit')
+        paginate = after is not None or limit_str is not None
+
+        try:
+            limit = int(limit_str) if limit_str else DEFAULT_PAGE_SIZE
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'limit must be a positive integer'
+            }), 400
+        limit = min(limit, MAX_PAGE_SIZE)
+
         # Query attendance records for the date range
-        attendance_records = Attendance.query.filter(
-            Attendance.date >= start_date,
-            Attendance.date <= end_date
-        ).order_by(Attendance.date.desc(), Attendance.time.desc()).all()
-
-        attendance_list = []
-        for record in attendance_records:
-            attendance_data = {
-                'id': record.id,
-                'employee_id': record.employee.employee_number,
-                'employee_name': record.employee.name,
-                'date': record.date.isoformat(),
-                'time': record.time.strftime('%H:%M:%S'),
-                'datetime': record.datetime.isoformat() if record.datetime else None,
-                'latitude': record.latitude,
-                'longitude': record.longitude,
-                'job_title': record.employee.job_title.name if record.employee.job_title else None,
-                'category': record.employee.job_title.category.name if record.employee.job_title else None,
-                'supervisor': record.marked_by_supervisor.full_name if record.marked_by_supervisor else None
-            }
-            attendance_list.append(attendance_data)
+        attendance = attendance_source(start_date, end_date)
+        query = attendance_rows_query(attendance).filter(
+            attendance.date >= start_date,
+            attendance.date <= end_date
+        )
+
+        if after:
+            try:
+                after_key = decode_attendance_cursor(after)
+            except (ValueError, UnicodeDecodeError):
+                return jsonify({
+                    'success': False,
+                    'error': 'Invalid cursor'
+                }), 400
+            query = query.filter(tuple_(attendance.date, attendance.time, attendance.id) < after_key)
+
+        query = query.order_by(attendance.date.desc(), attendance.time.desc(), attendance.id.desc())
+
+        if request.args.get('format') == 'ndjson':
+            if paginate:
+                # One extra row tells the stream whether another page exists
+                query = query.limit(limit + 1)
+            return Response(
+                stream_with_context(stream_attendance_ndjson(query, limit if paginate else None)),
+                mimetype='application/x-ndjson'
+            )
+
+        if not paginate:
+            attendance_list = [serialize_attendance(row) for row in query.all()]
+
+            return jsonify({
+                'success': True,
+                'start_date': start_date_str,
+                'end_date': end_date_str,
+                'attendance': attendance_list,
+                'total': len(attendance_list)
+            })
+
+        # Fetch one extra row to learn whether another page exists
+        attendance_rows = query.limit(limit + 1).all()
+        has_more = len(attendance_rows) > limit
+        attendance_rows = attendance_rows[:limit]
 
         return jsonify({
             'success': True,
             'start_date': start_date_str,
             'end_date': end_date_str,
-            'attendance': attendance_list,
-            'total': len(attendance_list)
+            'attendance': [serialize_attendance(row) for row in attendance_rows],
+            'count': len(attendance_rows),
+            'limit': limit,
+            'has_more': has_more,
+            'next_cursor': encode_attendance_cursor(attendance_rows[-1]) if has_more else None
         })
 
     except Exception as e:
@@ -175,12 +286,255 @@ def get_attendance_range():
             'error': str(e)
         }), 500
 
+def stream_attendance_ndjson(query, limit=None):
+    """Yield attendance rows as NDJSON lines from a server-side cursor
+
+    With a ``limit``, a row past it means another page exists: it is not
+    sent, and a final ``{"next_cursor": ...}`` line is yielded instead.
+    """
+    try:
+        last_row = None
+        for count, row in enumerate(query.yield_per(STREAM_BATCH_SIZE)):
+            if limit is not None and count == limit:
+                yield json.dumps({'next_cursor': encode_attendance_cursor(last_row)}) + '\n'
+                break
+            last_row = row
+            yield json.dumps(serialize_attendance(row)) + '\n'
+    except Exception as e:
+        # Headers are already sent, so the client sees a truncated stream
+        logging.error(f"Error streaming attendance range: {str(e)}")
+
+@api_bp.route('/attendance/export', methods=['GET'])
+def export_attendance():
+    """Bulk export a date range as a dictionary-encoded columnar payload
+
+    ``format`` is ``columnar`` (default, see columnar_export.py) or
+    ``arrow`` for an Arrow IPC stream; ``compression`` may be ``gzip`` or
+    ``zstd``.
+    """
+    try:
+        start_date_str = request.args.get('start_date')
+        end_date_str = request.args.get('end_date')
+
+        if not start_date_str or not end_date_str:
+            return jsonify({
+                'success': False,
+                'error': 'Both start_date and end_date are required'
+            }), 400
+
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid date format. Use YYYY-MM-DD'
+            }), 400
+
+        export_format = request.args.get('format', 'columnar')
+        compression = request.args.get('compression')
+
+        if export_format not in ('columnar', 'arrow'):
+            return jsonify({
+                'success': False,
+                'error': 'format must be columnar or arrow'
+            }), 400
+        if export_format == 'arrow' and pyarrow is None:
+            return jsonify({
+                'success': False,
+                'error': 'Arrow export requires pyarrow'
+            }), 400
+        if compression and compression not in COMPRESSIONS:
+            return jsonify({
+                'success': False,
+                'error': 'compression must be gzip or zstd'
+            }), 400
+        if compression == 'zstd' and zstandard is None:
+            return jsonify({
+                'success': False,
+                'error': 'zstd compression requires zstandard'
+            }), 400
+
+        attendance = attendance_source(start_date, end_date)
+        query = attendance_rows_query(attendance).filter(
+            attendance.date >= start_date,
+            attendance.date <= end_date
+        ).order_by(attendance.date, attendance.time, attendance.id)
+
+        columns = AttendanceColumns().extend(query.yield_per(STREAM_BATCH_SIZE))
+
+        if export_format == 'arrow':
+            payload = columns.to_arrow()
+            mimetype = 'application/vnd.apache.arrow.stream'
+            extension = 'arrow'
+        else:
+            payload = columns.to_columnar()
+            mimetype = 'application/octet-stream'
+            extension = 'acol'
+
+        filename = f"attendance_{start_date_str}_{end_date_str}.{extension}"
+        if compression:
+            payload = compress(payload, compression)
+            filename += '.gz' if compression == 'gzip' else '.zst'
+
+        logging.info(f"Exporting {len(columns)} attendance records ({len(payload)} bytes) for {start_date_str} to {end_date_str}")
+
+        response = Response(payload, mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+        response.headers['X-Record-Count'] = str(len(columns))
+        return response
+
+    except Exception as e:
+        logging.error(f"Error exporting attendance: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+def monthly_matrix_request():
+    """Parse month, employee_ids, category_id and supervisor_id; returns (month, rows) or an error response"""
+    try:
+        month = parse_month(request.args.get('month', date.today().strftime('%Y-%m')))
+    except ValueError:
+        return None, (jsonify({
+            'success': False,
+            'error': 'Invalid month format. Use YYYY-MM'
+        }), 400)
+
+    try:
+        employee_ids = [int(value) for value in request.args.get('employee_ids', '').split(',') if value]
+    except ValueError:
+        return None, (jsonify({
+            'success': False,
+            'error': 'employee_ids must be a comma-separated list of ids'
+        }), 400)
+
+    rows = month_matrix(
+        month,
+        employee_ids=employee_ids,
+        category_id=request.args.get('category_id', type=int),
+        supervisor_id=request.args.get('supervisor_id', type=int)
+    )
+    return (month, rows), None
+
+@api_bp.route('/attendance/monthly', methods=['GET'])
+def get_monthly_attendance():
+    """Employee x day attendance matrix for payroll, from the monthly bitmaps
+
+    Each employee's ``days`` is a bitmap with bit ``day - 1`` set for days
+    present. ``format=xlsx`` downloads the matrix pivoted as a spreadsheet.
+    """
+    try:
+        parsed, error = monthly_matrix_request()
+        if error:
+            return error
+        month, rows = parsed
+
+        if request.args.get('format') == 'xlsx':
+            output = io.BytesIO()
+            write_matrix_xlsx(month, rows, output)
+            response = Response(
+                output.getvalue(),
+                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            )
+            response.headers['Content-Disposition'] = f"attachment; filename=attendance_{month.strftime('%Y_%m')}.xlsx"
+            return response
+
+        return jsonify({
+            'success': True,
+            'month': month.strftime('%Y-%m'),
+            'days_in_month': days_in_month(month),
+            'employees': [
+                {
+                    'employee_id': row.employee_id,
+                    'employee_number': row.employee_number,
+                    'name': row.name,
+                    'category': row.category,
+                    'days': row.days,
+                    'present_days': present_days(row.days),
+                    'days_present': days_present(row.days)
+                }
+                for row in rows
+            ],
+            'total': len(rows)
+        })
+
+    except Exception as e:
+        logging.error(f"Error getting monthly attendance: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
+@api_bp.route('/attendance/monthly/days', methods=['GET'])
+def get_monthly_attendance_days():
+    """Combine the selected employees' bitmaps into the days any, all or none of them were present
+
+    ``group_by=category`` combines each category's employees separately.
+    """
+    try:
+        operation = request.args.get('op', 'any')
+        if operation not in SET_OPERATIONS:
+            return jsonify({
+                'success': False,
+                'error': 'op must be any, all or none'
+            }), 400
+
+        parsed, error = monthly_matrix_request()
+        if error:
+            return error
+        month, rows = parsed
+
+        def combined(group_rows):
+            days = combine_days([row.days for row in group_rows], operation, month)
+            return {
+                'employees': len(group_rows),
+                'days': days,
+                'present_days': present_days(days),
+                'count': days_present(days)
+            }
+
+        result = {
+            'success': True,
+            'month': month.strftime('%Y-%m'),
+            'op': operation,
+            **combined(rows)
+        }
+
+        if request.args.get('group_by') == 'category':
+            groups = {}
+            for row in rows:
+                groups.setdefault((row.category_id, row.category), []).append(row)
+            result['categories'] = [
+                {'category_id': category_id, 'category': category, **combined(group_rows)}
+                for (category_id, category), group_rows in groups.items()
+            ]
+
+        return jsonify(result)
+
+    except Exception as e:
+        logging.error(f"Error combining monthly attendance: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 @api_bp.route('/sync-to-dotnet', methods=['POST'])
 def sync_to_dotnet():
-    """Endpoint for .NET system to receive attendance data"""
+    """Endpoint for .NET system to receive attendance data
+
+    Without ``since`` this returns the full day plus a ``watermark``; with
+    ``since=<watermark>`` it returns only the attendance changes committed
+    after it and a ``next_watermark`` to resume from. Watermarks are opaque;
+    see ChangeLog.
+    """
     try:
-        # Get date from request, default to today
         request_data = request.get_json() or {}
+
+        if 'since' in request_data:
+            return sync_changes_since(request_data)
+
+        # Get date from request, default to today
         date_str = request_data.get('date', date.today().isoformat())
 
         try:
@@ -191,22 +545,14 @@ def sync_to_dotnet():
                 'error': 'Invalid date format. Use YYYY-MM-DD'
             }), 400
 
+        # Read the watermark first so changes racing the snapshot are replayed
+        watermark = AttendanceChange.latest_watermark()
+
         # Get attendance records for the date
-        attendance_records = Attendance.query.filter_by(date=attendance_date).all()
-
-        sync_data = []
-        for record in attendance_records:
-            sync_record = {
-                'employee_id': record.employee.employee_number,
-                'name': record.employee.name,
-                'date': record.date.isoformat(),
-                'time': record.time.strftime('%H:%M:%S'),
-                'latitude': record.latitude,
-                'longitude': record.longitude,
-                'job_title': record.employee.job_title.name if record.employee.job_title else None,
-                'category': record.employee.job_title.category.name if record.employee.job_title else None
-            }
-            sync_data.append(sync_record)
+        attendance = attendance_source(attendance_date, attendance_date)
+        attendance_rows = attendance_rows_query(attendance).filter(attendance.date == attendance_date).all()
+
+        sync_data = [serialize_sync_record(row) for row in attendance_rows]
 
         # Log sync attempt
         logging.info(f"Syncing {len(sync_data)} attendance records for {date_str} to .NET system")
@@ -215,7 +561,8 @@ def sync_to_dotnet():
             'success': True,
             'date': date_str,
             'records_synced': len(sync_data),
-            'data': sync_data
+            'data': sync_data,
+            'watermark': watermark
         })
 
     except Exception as e:
@@ -225,6 +572,67 @@ def sync_to_dotnet():
             'error': str(e)
         }), 500
 
+def sync_changes_since(request_data):
+    """Return the attendance deltas recorded after the client's watermark"""
+    try:
+        since = int(request_data['since'])
+        limit = min(int(request_data.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE)
+        if since < 0 or limit < 1:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'error': 'since must be a non-negative integer and limit a positive integer'
+        }), 400
+
+    changes, next_watermark, has_more = AttendanceChange.changes_since(since, limit)
+
+    # Only the last change per attendance row within the page matters
+    latest = {}
+    for change in changes:
+        latest.pop(change.attendance_id, None)
+        latest[change.attendance_id] = change
+
+    upserts = [change for change in latest.values() if change.operation == 'upsert']
+    current_rows = {}
+    if upserts:
+        # Rows may have been archived since they were logged
+        attendance = attendance_source(min(change.date for change in upserts),
+                                       max(change.date for change in upserts))
+        current_rows = {
+            row.id: row for row in attendance_rows_query(attendance).filter(
+                attendance.id.in_([change.attendance_id for change in upserts])
+            ).all()
+        }
+
+    sync_data = []
+    for attendance_id, change in latest.items():
+        row = current_rows.get(attendance_id)
+        if change.operation == 'upsert' and row is not None:
+            record = serialize_sync_record(row)
+        else:
+            # Deleted, or deleted again after this page was logged
+            record = {
+                'employee_id': change.employee_number,
+                'date': change.date.isoformat(),
+                'operation': 'delete'
+            }
+        record['attendance_id'] = attendance_id
+        record.setdefault('operation', 'upsert')
+        record['sequence'] = change.id
+        sync_data.append(record)
+
+    logging.info(f"Syncing {len(sync_data)} attendance changes after watermark {since} to .NET system")
+
+    return jsonify({
+        'success': True,
+        'since': since,
+        'next_watermark': next_watermark,
+        'has_more': has_more,
+        'records_synced': len(sync_data),
+        'data': sync_data
+    })
+
 @api_bp.route('/statistics', methods=['GET'])
 def get_statistics():
     """Get system statistics"""
@@ -234,8 +642,8 @@ def get_statistics():
             'total_supervisors': Supervisor.query.count(),
             'total_categories': JobCategory.query.count(),
             'total_job_titles': JobTitle.query.count(),
-            'today_attendance': Attendance.query.filter_by(date=date.today()).count(),
-            'total_attendance_records': Attendance.query.count()
+            'today_attendance': AttendanceDailyRollup.total(date.today()),
+            'total_attendance_records': AttendanceDailyRollup.total()
         }
 
         return jsonify({
@@ -261,8 +669,7 @@ def get_job_titles(category_id):
         category = JobCategory.query.get_or_404(category_id)
 
         if current_user.role != 'superuser':
-            supervisor = current_user.supervisor_profile
-            if not supervisor or category not in supervisor.allowed_categories:
+            if current_user.supervisor_id is None or not current_user.scope.can_access_category(category.id):
                 return jsonify({'error': 'Access denied'}), 403
 
         # Get job titles for this category
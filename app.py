@@ -31,6 +31,9 @@ app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 
+# Rendered reports, stored under their content-addressed cache key
+app.config['REPORT_CACHE_FOLDER'] = os.environ.get('REPORT_CACHE_FOLDER', 'report_cache')
+
 # Initialize extensions
 db.init_app(app)
 
@@ -42,8 +45,10 @@ login_manager.login_message = 'Please log in to access this page.'
 
 @login_manager.user_loader
 def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
+    from app_cache import user_cache
+    user = user_cache.get(int(user_id))
+    # Deactivating a user ends their existing sessions too
+    return user if user is not None and user.is_active else None
 
 with app.app_context():
     # Import models to ensure tables are created
@@ -0,0 +1,228 @@
+"""
+Process-level caches for lookups made on every request
+"""
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+from flask_login import UserMixin
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from frame_utils import TTLCache
+from models import Attendance, CacheVersion, CompanyProfile, Supervisor, User, bump_cache_version
+
+class CachedUser(UserMixin):
+    """Read-only identity of a logged-in user, as returned by load_user
+
+    Carries what routes and templates read on every request: role, names,
+    and the supervisor id with its cached access scope. Code that writes to
+    the user, or needs the password hash, loads the real User row.
+    """
+
+    def __init__(self, id, username, email, role, full_name, is_active, supervisor_id):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.role = role
+        self.full_name = full_name
+        self._is_active = is_active
+        self.supervisor_id = supervisor_id
+
+    @property
+    def is_active(self):
+        return self._is_active is not False
+
+    @property
+    def supervisor_profile(self):
+        if self.supervisor_id is None:
+            return None
+        return db.session.get(Supervisor, self.supervisor_id)
+
+    @property
+    def scope(self):
+        from supervisor_scope import supervisor_scopes
+        return supervisor_scopes.get(self.supervisor_id) if self.supervisor_id is not None else None
+
+class SharedVersion:
+    """This process's view of a CacheVersion row, re-read at most every ``interval`` seconds"""
+
+    def __init__(self, name, interval=1.0):
+        self.name = name
+        self.interval = interval
+        self.version = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def changed(self):
+        """True when the version moved since the last check, e.g. bumped by another worker"""
+        now = time.monotonic()
+        with self._lock:
+            if self.checked_at is not None and now - self.checked_at < self.interval:
+                return False
+            self.checked_at = now
+
+        version = db.session.execute(
+            select(CacheVersion.version).where(CacheVersion.name == self.name)
+        ).scalar() or 0
+        with self._lock:
+            previous, self.version = self.version, version
+        return version != previous
+
+class UserCache:
+    """CachedUsers keyed by user id, expiring after ``ttl`` seconds
+
+    Changes committed by this process invalidate the entry right away.
+    Changes from other worker processes bump the shared ``users`` cache
+    version, which clears the cache at most ``sync_interval`` seconds
+    later, so a deactivated or demoted user loses access everywhere
+    without waiting for the ttl.
+    """
+
+    def __init__(self, maxsize=4096, ttl=60, sync_interval=1.0):
+        self.users = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.generation = 0
+        self.shared_version = SharedVersion('users', sync_interval)
+
+    def get(self, user_id):
+        if self.shared_version.changed():
+            self.invalidate()
+
+        user = self.users.get(user_id)
+        if user is not None:
+            return user
+
+        generation = self.generation
+        row = db.session.execute(
+            select(User.id, User.username, User.email, User.role, User.full_name, User.is_active,
+                   Supervisor.id.label('supervisor_id'))
+            .outerjoin(Supervisor, Supervisor.user_id == User.id)
+            .where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+
+        user = CachedUser(*row)
+        # Skip caching a row read before a concurrent invalidation
+        if generation == self.generation:
+            self.users.set(user_id, user)
+        return user
+
+    def invalidate(self, user_id=None):
+        self.generation += 1
+        if user_id is None:
+            self.users.clear()
+        else:
+            self.users.pop(user_id)
+
+class CompanyInfoCache:
+    """Snapshot of the company profile shown on every page"""
+
+    FIELDS = ('id', 'name', 'about', 'logo_filename')
+
+    def __init__(self, ttl=60):
+        self.cache = TTLCache(maxsize=1, ttl=ttl)
+        self.generation = 0
+
+    def get(self):
+        """Return the profile as a plain namespace, or None if there is none"""
+        cached = self.cache.get('company')
+        if cached is not None:
+            return cached.info
+
+        generation = self.generation
+        company = CompanyProfile.query.first()
+        info = SimpleNamespace(**{field: getattr(company, field) for field in self.FIELDS}) if company else None
+        if generation == self.generation:
+            # Wrapped so a missing profile is cached too
+            self.cache.set('company', SimpleNamespace(info=info))
+        return info
+
+    def invalidate(self):
+        self.generation += 1
+        self.cache.clear()
+
+class MarkedTodayBitmap:
+    """Bitmap of employee ids with attendance already recorded today
+
+    Loaded with one query the first time a day is checked, then kept up to
+    date by this process's own inserts. A set bit is authoritative: removing
+    attendance bumps the shared ``marked_today`` cache version, and every
+    worker reloads the day at most ``sync_interval`` seconds later. A clear
+    bit may be stale when another worker marked the employee, which the
+    conflict-checked insert still catches.
+    """
+
+    def __init__(self, sync_interval=1.0):
+        self.day = None
+        self.bits = bytearray()
+        self.shared_version = SharedVersion('marked_today', sync_interval)
+        self._lock = threading.Lock()
+
+    def _load(self, day):
+        employee_ids = db.session.execute(
+            select(Attendance.employee_id).where(Attendance.date == day)
+        ).scalars().all()
+        self.bits = bytearray()
+        self.day = day
+        for employee_id in employee_ids:
+            self._set(employee_id)
+
+    def _set(self, employee_id):
+        index, bit = divmod(employee_id, 8)
+        if index >= len(self.bits):
+            self.bits.extend(bytes(index - len(self.bits) + 1))
+        self.bits[index] |= 1 << bit
+
+    def is_marked(self, employee_id, day):
+        if self.shared_version.changed():
+            self.invalidate()
+
+        with self._lock:
+            if self.day != day:
+                self._load(day)
+            index, bit = divmod(employee_id, 8)
+            return index < len(self.bits) and bool(self.bits[index] & (1 << bit))
+
+    def mark(self, employee_id, day):
+        with self._lock:
+            if self.day == day:
+                self._set(employee_id)
+
+    def invalidate(self):
+        with self._lock:
+            self.day = None
+
+# Global identity, company profile and attendance caches
+user_cache = UserCache(ttl=int(os.environ.get('USER_CACHE_TTL', 60)),
+                       sync_interval=float(os.environ.get('CACHE_SYNC_INTERVAL', 1)))
+company_info_cache = CompanyInfoCache(ttl=int(os.environ.get('COMPANY_INFO_CACHE_TTL', 60)))
+marked_today = MarkedTodayBitmap(sync_interval=float(os.environ.get('CACHE_SYNC_INTERVAL', 1)))
+
+def _mark_user_change(connection, target, user_id):
+    bump_cache_version(connection, 'users')
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('changed_user_ids', set()).add(user_id)
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def user_changed(mapper, connection, target):
+    _mark_user_change(connection, target, target.id)
+
+@event.listens_for(Supervisor, 'after_insert')
+@event.listens_for(Supervisor, 'after_update')
+@event.listens_for(Supervisor, 'after_delete')
+def supervisor_profile_changed(mapper, connection, target):
+    _mark_user_change(connection, target, target.user_id)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_user_ids', ()):
+        user_cache.invalidate(user_id)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_user_changes(session):
+    session.info.pop('changed_user_ids', None)
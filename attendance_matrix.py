@@ -0,0 +1,92 @@
+"""
+Monthly attendance matrix (employees x days) read from the attendance bitmaps
+"""
+import calendar
+from datetime import datetime
+
+from openpyxl import Workbook
+from sqlalchemy import and_, func, or_
+
+from app import db
+from models import AttendanceMonth, Employee, JobCategory, JobTitle
+
+SET_OPERATIONS = ('any', 'all', 'none')
+
+def parse_month(value):
+    """First day of a YYYY-MM month; raises ValueError on bad input"""
+    return datetime.strptime(value, '%Y-%m').date()
+
+def days_in_month(month):
+    return calendar.monthrange(month.year, month.month)[1]
+
+def month_mask(month):
+    """Bitmap with a bit set for every day of the month"""
+    return (1 << days_in_month(month)) - 1
+
+def present_days(days):
+    """Days of the month set in a bitmap, starting at 1"""
+    return [day + 1 for day in range(31) if days >> day & 1]
+
+def days_present(days):
+    return days.bit_count()
+
+def month_matrix(month, employee_ids=None, category_id=None, supervisor_id=None):
+    """One row per employee with their category and the month's day bitmap
+
+    Reads at most one bitmap row per employee, so the cost follows the
+    number of employees rather than attendance records. Active employees
+    without attendance are included with an empty bitmap.
+    """
+    query = db.session.query(
+        Employee.id.label('employee_id'),
+        Employee.employee_number,
+        Employee.name,
+        JobCategory.id.label('category_id'),
+        JobCategory.name.label('category'),
+        func.coalesce(AttendanceMonth.days, 0).label('days')
+    ).outerjoin(AttendanceMonth, and_(AttendanceMonth.employee_id == Employee.id, AttendanceMonth.month == month)) \
+     .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id) \
+     .outerjoin(JobCategory, JobTitle.category_id == JobCategory.id) \
+     .filter(or_(Employee.is_active.is_(True), AttendanceMonth.days > 0))
+
+    if employee_ids:
+        query = query.filter(Employee.id.in_(employee_ids))
+    if category_id:
+        query = query.filter(JobTitle.category_id == category_id)
+    if supervisor_id:
+        query = query.filter(Employee.supervisor_id == supervisor_id)
+
+    return query.order_by(Employee.employee_number).all()
+
+def combine_days(bitmaps, operation, month):
+    """Days on which any, all or none of the given bitmaps are present"""
+    if operation not in SET_OPERATIONS:
+        raise ValueError(f'Unsupported set operation: {operation}')
+
+    any_days = 0
+    all_days = month_mask(month)
+    for days in bitmaps:
+        any_days |= days
+        all_days &= days
+
+    if operation == 'any':
+        return any_days
+    if operation == 'all':
+        return all_days if bitmaps else 0
+    return month_mask(month) & ~any_days
+
+def write_matrix_xlsx(month, rows, output):
+    """Write the matrix pivoted, employees down and days across, in openpyxl's write-only mode"""
+    day_count = days_in_month(month)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=month.strftime('%Y-%m'))
+
+    sheet.append(['Employee Number', 'Employee Name', 'Category'] + list(range(1, day_count + 1)) + ['Days Present'])
+    for row in rows:
+        sheet.append(
+            [row.employee_number, row.name, row.category or 'N/A'] +
+            ['P' if row.days >> day & 1 else '' for day in range(day_count)] +
+            [days_present(row.days)]
+        )
+
+    workbook.save(output)
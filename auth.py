@@ -82,7 +82,10 @@ def change_password():
         new_password = request.form.get('new_password')
         confirm_password = request.form.get('confirm_password')
         
-        if not check_password_hash(current_user.password_hash, current_password):
+        # current_user is a cached identity without the password hash
+        user = db.session.get(User, current_user.id)
+
+        if not check_password_hash(user.password_hash, current_password):
             flash('Current password is incorrect.', 'error')
             return redirect(url_for('auth.change_password'))
         
@@ -94,7 +97,7 @@ def change_password():
             flash('Password must be at least 6 characters long.', 'error')
             return redirect(url_for('auth.change_password'))
         
-        current_user.password_hash = generate_password_hash(new_password)
+        user.password_hash = generate_password_hash(new_password)
         db.session.commit()
         flash('Password changed successfully.', 'success')
         return redirect(url_for('dashboard'))
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark for FaceProcessor.extract_face_encoding
+
+Compares the vectorized byte sampler against the previous list-based
+implementation for payloads from 100 KB up to the 16 MB upload limit.
+
+    python benchmarks/bench_extract_face_encoding.py
+"""
+import base64
+import logging
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from face_utils_working import FaceProcessor
+
+PAYLOAD_SIZES = [100 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+
+def legacy_sample(image_bytes):
+    """Byte sampling as implemented before vectorization"""
+    encoding = []
+    step = max(1, len(image_bytes) // 128)
+    for i in range(0, len(image_bytes), step):
+        if len(encoding) >= 128:
+            break
+        encoding.append((image_bytes[i] - 127.5) / 127.5)
+    while len(encoding) < 128:
+        encoding.append(0.0)
+    return encoding[:128]
+
+def vectorized_sample(image_bytes):
+    """Byte sampling as implemented in extract_face_encoding"""
+    samples = np.frombuffer(image_bytes, dtype=np.uint8)
+    step = max(1, len(samples) // 128)
+    sampled = samples[::step][:128]
+    encoding = np.zeros(128, dtype=np.float32)
+    encoding[:len(sampled)] = (sampled.astype(np.float32) - 127.5) / 127.5
+    return encoding
+
+def legacy_extract(image_data):
+    """Full legacy path: strip prefix, base64-decode, sample"""
+    if ',' in image_data:
+        image_data = image_data.split(',')[1]
+    return legacy_sample(base64.b64decode(image_data))
+
+def best_of(func, arg, number):
+    return min(timeit.repeat(lambda: func(arg), number=number, repeat=5)) / number
+
+def main():
+    logging.disable(logging.CRITICAL)
+    processor = FaceProcessor()
+    rng = np.random.default_rng(0)
+
+    print(f"{'payload':>10} | {'sample (old)':>13} {'sample (new)':>13} {'speedup':>8} | "
+          f"{'extract (old)':>14} {'extract (new)':>14} {'speedup':>8}")
+
+    for size in PAYLOAD_SIZES:
+        image_bytes = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        image_data = 'data:image/jpeg;base64,' + base64.b64encode(image_bytes).decode()
+
+        assert np.allclose(legacy_sample(image_bytes), vectorized_sample(image_bytes), atol=1e-6)
+
+        number = max(1, (20 * 1024 * 1024) // size)
+        old_sample = best_of(legacy_sample, image_bytes, number * 50)
+        new_sample = best_of(vectorized_sample, image_bytes, number * 50)
+        old_extract = best_of(legacy_extract, image_data, number)
+        new_extract = best_of(processor.extract_face_encoding, image_data, number)
+
+        print(f"{size // 1024:>7} KB | {old_sample * 1e6:>10.1f} us {new_sample * 1e6:>10.1f} us "
+              f"{old_sample / new_sample:>7.1f}x | {old_extract * 1e3:>11.2f} ms {new_extract * 1e3:>11.2f} ms "
+              f"{old_extract / new_extract:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark for PDF attendance report rendering
+
+Compares one table holding every row (the previous layout) against the
+page-sized tables with a shared style that the report generators now build
+lazily, reporting pages per second and peak traced memory.
+
+    python benchmarks/bench_pdf_report.py [max_rows]
+"""
+import io
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Table
+
+from pdf_utils import (REPORT_COLUMN_WIDTHS, REPORT_TABLE_HEADER, REPORT_TABLE_STYLE, StreamingDocTemplate,
+                       fit_text, paged_tables, spooled_pdf_file)
+
+ROW_COUNTS = [1000, 5000, 20000, 100000]
+
+# The single-table layout is super-linear; stop timing it beyond this
+LEGACY_MAX_ROWS = 5000
+
+def synthetic_rows(count):
+    for i in range(count):
+        yield [
+            f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}",
+            f"{8 + i % 10:02d}:{i % 60:02d}:00",
+            fit_text(f"Employee {i % 800}", 16),
+            f"EMP{i % 800:04d}",
+            fit_text(f"Job Title {i % 40}", 14),
+            fit_text(f"Category {i % 8}", 12),
+            fit_text(f"Supervisor {i % 25}", 14),
+        ]
+
+def legacy_render(count):
+    """Every row in one auto-sized table, built into a BytesIO"""
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, pageCompression=1)
+    table = Table([REPORT_TABLE_HEADER] + list(synthetic_rows(count)))
+    table.setStyle(REPORT_TABLE_STYLE)
+    doc.build([table])
+    return doc.page
+
+def paged_render(count):
+    """Page-sized tables pulled by doc.build, written to a spooled file"""
+    pdf_file = spooled_pdf_file()
+    doc = StreamingDocTemplate(pdf_file, pagesize=A4, pageCompression=1)
+    doc.build(paged_tables(REPORT_TABLE_HEADER, synthetic_rows(count), REPORT_COLUMN_WIDTHS))
+    pdf_file.close()
+    return doc.page
+
+def measure(render, count):
+    """Time an untraced render, then repeat it under tracemalloc for the peak"""
+    started = time.perf_counter()
+    pages = render(count)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    render(count)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return pages, elapsed, peak
+
+def main():
+    logging.disable(logging.CRITICAL)
+    max_rows = int(sys.argv[1]) if len(sys.argv) > 1 else ROW_COUNTS[-1]
+
+    print(f"{'rows':>8} {'pages':>6} | {'single (s)':>10} {'pages/s':>8} {'peak MB':>8} | "
+          f"{'paged (s)':>10} {'pages/s':>8} {'peak MB':>8}")
+
+    for count in ROW_COUNTS:
+        if count > max_rows:
+            break
+
+        pages, paged_time, paged_peak = measure(paged_render, count)
+        if count <= LEGACY_MAX_ROWS:
+            legacy_pages, legacy_time, legacy_peak = measure(legacy_render, count)
+            legacy = (f"{legacy_time:>10.2f} {legacy_pages / legacy_time:>8.1f} "
+                      f"{legacy_peak / 2**20:>8.1f}")
+        else:
+            legacy = f"{'-':>10} {'-':>8} {'-':>8}"
+
+        print(f"{count:>8} {pages:>6} | {legacy} | {paged_time:>10.2f} {pages / paged_time:>8.1f} "
+              f"{paged_peak / 2**20:>8.1f}")
+
+if __name__ == '__main__':
+    main()
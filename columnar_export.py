@@ -0,0 +1,171 @@
+"""
+Compact columnar encoding of attendance rows for bulk exports
+"""
+import gzip
+import json
+import struct
+from array import array
+from datetime import date, timedelta
+
+import numpy as np
+
+try:
+    import pyarrow
+except ImportError:  # Optional: Arrow IPC output
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:  # Optional: zstd compression
+    zstandard = None
+
+# Custom container: magic, version, header length, then a JSON header and raw column buffers
+COLUMNAR_MAGIC = b'ACOL'
+COLUMNAR_VERSION = 1
+COLUMNAR_PREAMBLE = struct.Struct('<4sHI')
+
+EPOCH = date(1970, 1, 1)
+
+# Categorical columns are dictionary encoded; -1 marks a missing value
+DICTIONARY_COLUMNS = ('employee_number', 'employee_name', 'job_title', 'category', 'supervisor')
+
+COMPRESSIONS = ('gzip', 'zstd')
+
+class AttendanceColumns:
+    """Attendance rows accumulated column by column
+
+    Strings are replaced by int32 codes into per-export dictionaries, dates
+    by int32 days since 1970-01-01 and times by int32 seconds since midnight.
+    """
+
+    def __init__(self):
+        self.ids = array('i')
+        self.days = array('i')
+        self.seconds = array('i')
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.codes = {name: array('i') for name in DICTIONARY_COLUMNS}
+        self.dictionaries = {name: {} for name in DICTIONARY_COLUMNS}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def append(self, row):
+        """Append one attendance_rows_query() row"""
+        self.ids.append(row.id)
+        self.days.append((row.date - EPOCH).days)
+        self.seconds.append(row.time.hour * 3600 + row.time.minute * 60 + row.time.second)
+        self.latitudes.append(row.latitude if row.latitude is not None else float('nan'))
+        self.longitudes.append(row.longitude if row.longitude is not None else float('nan'))
+
+        for name in DICTIONARY_COLUMNS:
+            value = getattr(row, name)
+            if value is None:
+                self.codes[name].append(-1)
+            else:
+                dictionary = self.dictionaries[name]
+                self.codes[name].append(dictionary.setdefault(value, len(dictionary)))
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+        return self
+
+    def arrays(self):
+        """Return (name, ndarray) pairs in export order"""
+        columns = [
+            ('id', np.frombuffer(self.ids, dtype=np.int32)),
+            ('day', np.frombuffer(self.days, dtype=np.int32)),
+            ('second', np.frombuffer(self.seconds, dtype=np.int32)),
+            ('latitude', np.frombuffer(self.latitudes, dtype=np.float64)),
+            ('longitude', np.frombuffer(self.longitudes, dtype=np.float64)),
+        ]
+        columns.extend((name, np.frombuffer(self.codes[name], dtype=np.int32)) for name in DICTIONARY_COLUMNS)
+        return columns
+
+    def dictionary_values(self, name):
+        """Dictionary strings for a column, indexed by code"""
+        return list(self.dictionaries[name])
+
+    def to_columnar(self):
+        """Serialize to the ACOL container
+
+        Layout: ``<4sHI`` preamble (magic, version, header length), a UTF-8
+        JSON header describing each column, then each column's little-endian
+        buffer in header order.
+        """
+        columns = self.arrays()
+        header = {
+            'rows': len(self),
+            'epoch': EPOCH.isoformat(),
+            'columns': [
+                {
+                    'name': name,
+                    'dtype': values.dtype.newbyteorder('<').str,
+                    'nbytes': values.nbytes,
+                    'dictionary': self.dictionary_values(name) if name in self.dictionaries else None
+                }
+                for name, values in columns
+            ]
+        }
+        header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+        parts = [COLUMNAR_PREAMBLE.pack(COLUMNAR_MAGIC, COLUMNAR_VERSION, len(header_bytes)), header_bytes]
+        parts.extend(values.astype(values.dtype.newbyteorder('<'), copy=False).tobytes() for _, values in columns)
+        return b''.join(parts)
+
+    def to_arrow(self):
+        """Serialize as an Arrow IPC stream with dictionary-encoded string columns"""
+        if pyarrow is None:
+            raise RuntimeError('pyarrow is not installed')
+
+        fields = []
+        for name, values in self.arrays():
+            if name in self.dictionaries:
+                indices = pyarrow.array(values, mask=values < 0)
+                dictionary = pyarrow.array(self.dictionary_values(name), type=pyarrow.string())
+                fields.append((name, pyarrow.DictionaryArray.from_arrays(indices, dictionary)))
+            elif name == 'day':
+                fields.append((name, pyarrow.array(values).cast(pyarrow.date32())))
+            elif name == 'second':
+                fields.append((name, pyarrow.array(values).cast(pyarrow.time32('s'))))
+            else:
+                fields.append((name, pyarrow.array(values, from_pandas=True)))
+
+        table = pyarrow.table(dict(fields))
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+def read_columnar(payload):
+    """Decode an ACOL payload into a dict of column arrays and dictionaries"""
+    magic, version, header_length = COLUMNAR_PREAMBLE.unpack_from(payload)
+    if magic != COLUMNAR_MAGIC or version != COLUMNAR_VERSION:
+        raise ValueError('Not a columnar attendance export')
+
+    offset = COLUMNAR_PREAMBLE.size
+    header = json.loads(payload[offset:offset + header_length])
+    offset += header_length
+
+    columns = {}
+    for column in header['columns']:
+        values = np.frombuffer(payload, dtype=column['dtype'], count=header['rows'], offset=offset)
+        offset += column['nbytes']
+        columns[column['name']] = values
+        if column['dictionary'] is not None:
+            columns[column['name'] + '_dictionary'] = column['dictionary']
+    return columns
+
+def decode_day(day):
+    return EPOCH + timedelta(days=int(day))
+
+def compress(payload, compression):
+    """Compress an export payload with gzip or zstd"""
+    if compression == 'gzip':
+        return gzip.compress(payload, compresslevel=6)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('zstandard is not installed')
+        return zstandard.ZstdCompressor(level=3).compress(payload)
+    raise ValueError(f'Unsupported compression: {compression}')
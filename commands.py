@@ -0,0 +1,351 @@
+"""
+Maintenance commands, run with ``flask --app main <command>``
+"""
+import logging
+import os
+import re
+from datetime import date, time, timedelta
+
+import click
+from sqlalchemy import delete, desc, func, select, text, tuple_, update
+
+from app import app, db
+from models import (ArchivedMonth, Attendance, AttendanceArchive, AttendanceDailyRollup, AttendanceMonth,
+                    AttendanceRollupTotal, Employee, JobTitle, ReportJob, attendance_source, get_current_date,
+                    get_current_datetime, is_packed_face_encoding, month_start, next_month, pack_face_encoding, unpack_face_encoding)
+
+@app.cli.command('migrate-face-encodings')
+@click.option('--batch-size', default=500, show_default=True, help='Rows rewritten per transaction.')
+def migrate_face_encodings(batch_size):
+    """Rewrite pickled face encodings in the versioned float32 format"""
+    employees = Employee.__table__
+    last_id = 0
+    migrated = 0
+    failed = 0
+
+    while True:
+        rows = db.session.execute(
+            select(employees.c.id, employees.c.face_encoding)
+            .where(employees.c.id > last_id, employees.c.face_encoding.isnot(None))
+            .order_by(employees.c.id)
+            .limit(batch_size)
+        ).all()
+
+        if not rows:
+            break
+
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            if is_packed_face_encoding(row.face_encoding):
+                continue
+            try:
+                updates.append({'row_id': row.id, 'data': pack_face_encoding(unpack_face_encoding(row.face_encoding))})
+            except Exception as e:
+                failed += 1
+                logging.error(f"Could not migrate face encoding for employee {row.id}: {str(e)}")
+
+        if updates:
+            # Core update so the encoding change log is not flooded with no-op deltas
+            db.session.execute(
+                update(employees)
+                .where(employees.c.id == db.bindparam('row_id'))
+                .values(face_encoding=db.bindparam('data')),
+                updates
+            )
+            db.session.commit()
+            migrated += len(updates)
+
+        click.echo(f"Processed employees up to id {last_id}: {migrated} migrated, {failed} failed")
+
+    click.echo(f"Done. {migrated} face encodings migrated, {failed} failed.")
+
+@app.cli.command('create-indexes')
+def create_indexes():
+    """Create any indexes declared on the models that the database lacks"""
+    inspector = db.inspect(db.engine)
+    created = 0
+
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created += 1
+                click.echo(f"Created {index.name} on {table.name}")
+
+    click.echo(f"Done. {created} indexes created.")
+
+def hot_queries():
+    """The attendance lookups that must stay on an index, keyed by name"""
+    today = date.today()
+    return {
+        'attendance for a day': select(func.count()).select_from(Attendance).where(Attendance.date == today),
+        'recent attendance': select(Attendance.id).order_by(desc(Attendance.datetime)).limit(10),
+        'attendance range page': select(Attendance.id).where(
+            Attendance.date >= today - timedelta(days=90),
+            Attendance.date <= today,
+            tuple_(Attendance.date, Attendance.time, Attendance.id) < (today, time(23, 59, 59), 2 ** 31 - 1)
+        ).order_by(Attendance.date.desc(), Attendance.time.desc(), Attendance.id.desc()).limit(500),
+        'employees of a supervisor': select(Employee.id).where(Employee.supervisor_id == 1),
+        'employees with a job title': select(Employee.id).where(Employee.job_title_id == 1),
+        'job titles in a category': select(JobTitle.id).where(JobTitle.category_id == 1),
+    }
+
+def sequential_scans(statement):
+    """Return the table names a statement's plan reads with a full scan"""
+    sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+    if db.engine.dialect.name == 'postgresql':
+        plan = db.session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()[0]['Plan']
+        scans = []
+        nodes = [plan]
+        while nodes:
+            node = nodes.pop()
+            if node['Node Type'] == 'Seq Scan':
+                scans.append(node['Relation Name'])
+            nodes.extend(node.get('Plans', []))
+        return scans
+
+    details = [row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+    return [table_name for table_name in map(sqlite_full_scan, details) if table_name]
+
+# "SCAN attendance", or "SCAN TABLE attendance" before SQLite 3.36
+SQLITE_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+def sqlite_full_scan(detail):
+    """Table a SQLite EXPLAIN QUERY PLAN detail reads in full, or None
+
+    Index scans ("... USING [COVERING] INDEX ...") and scans of anything
+    but a model table (subqueries, constant rows) do not count.
+    """
+    match = SQLITE_SCAN.match(detail)
+    if match is None or 'INDEX' in detail or match.group(1) not in db.metadata.tables:
+        return None
+    return match.group(1)
+
+@app.cli.command('check-query-plans')
+@click.option('--min-rows', default=1000, show_default=True,
+              help='Ignore full scans of tables smaller than this.')
+def check_query_plans(min_rows):
+    """EXPLAIN the hot attendance queries and fail on full scans of large tables"""
+    row_counts = {}
+    failures = 0
+
+    for name, statement in hot_queries().items():
+        large_scans = []
+        for table_name in sequential_scans(statement):
+            if table_name not in row_counts:
+                row_counts[table_name] = db.session.execute(
+                    select(func.count()).select_from(db.metadata.tables[table_name])
+                ).scalar()
+            if row_counts[table_name] >= min_rows:
+                large_scans.append(f"{table_name} ({row_counts[table_name]} rows)")
+
+        if large_scans:
+            failures += 1
+            click.echo(f"FAIL {name}: sequential scan of {', '.join(large_scans)}")
+        else:
+            click.echo(f"ok   {name}")
+
+    if failures:
+        raise SystemExit(1)
+
+@app.cli.command('rebuild-attendance-rollup')
+def rebuild_attendance_rollup():
+    """Recompute the daily attendance rollup and its all-time totals from hot and archived attendance"""
+    rollup = AttendanceDailyRollup.__table__
+    category_id = func.coalesce(JobTitle.category_id, AttendanceDailyRollup.NONE_ID)
+    supervisor_id = func.coalesce(Employee.supervisor_id, AttendanceDailyRollup.NONE_ID)
+
+    attendance = attendance_source()
+
+    grouped = select(attendance.date, category_id, supervisor_id, func.count()) \
+        .select_from(attendance) \
+        .join(Employee, attendance.employee_id == Employee.id) \
+        .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id) \
+        .group_by(attendance.date, category_id, supervisor_id)
+
+    db.session.execute(delete(rollup))
+    db.session.execute(rollup.insert().from_select(['date', 'category_id', 'supervisor_id', 'count'], grouped))
+
+    totals = AttendanceRollupTotal.__table__
+    db.session.execute(delete(totals))
+    db.session.execute(totals.insert().from_select(
+        ['category_id', 'supervisor_id', 'count'],
+        select(rollup.c.category_id, rollup.c.supervisor_id, func.sum(rollup.c.count))
+        .group_by(rollup.c.category_id, rollup.c.supervisor_id)
+    ))
+    db.session.commit()
+
+    click.echo(f"Done. {AttendanceDailyRollup.total()} attendance records rolled up.")
+
+@app.cli.command('rebuild-attendance-months')
+@click.option('--batch-size', default=5000, show_default=True, help='Attendance rows read per fetch.')
+def rebuild_attendance_months(batch_size):
+    """Recompute the monthly attendance bitmaps from hot and archived attendance"""
+    attendance = attendance_source()
+    bitmaps = {}
+    rows = db.session.query(attendance.employee_id, attendance.date).yield_per(batch_size)
+    for employee_id, attendance_date in rows:
+        key = (month_start(attendance_date), employee_id)
+        bitmaps[key] = bitmaps.get(key, 0) | AttendanceMonth.day_bit(attendance_date)
+
+    months = AttendanceMonth.__table__
+    db.session.execute(delete(months))
+    if bitmaps:
+        db.session.execute(months.insert(), [
+            {'month': month, 'employee_id': employee_id, 'days': days}
+            for (month, employee_id), days in bitmaps.items()
+        ])
+    db.session.commit()
+
+    click.echo(f"Done. {len(bitmaps)} employee months rebuilt.")
+
+def partition_name(month):
+    return f"attendance_y{month.year}m{month.month:02d}"
+
+def attendance_is_partitioned():
+    return db.session.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass('attendance')")
+    ).scalar() == 'p'
+
+def create_month_partitions(first_month, last_month):
+    """Create the monthly attendance partitions from first_month to last_month inclusive"""
+    archived = {month for (month,) in db.session.query(ArchivedMonth.month)}
+    created = 0
+    month = first_month
+    while month <= last_month:
+        if month not in archived and db.session.execute(
+                text("SELECT to_regclass(:name)"), {'name': partition_name(month)}).scalar() is None:
+            db.session.execute(text(
+                f"CREATE TABLE {partition_name(month)} PARTITION OF attendance "
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+            ))
+            created += 1
+        month = next_month(month)
+    return created
+
+@app.cli.command('partition-attendance')
+@click.option('--months-ahead', default=3, show_default=True, help='Future monthly partitions to create.')
+def partition_attendance(months_ahead):
+    """Partition attendance by month on date (PostgreSQL only); rerun monthly to add partitions"""
+    if db.engine.dialect.name != 'postgresql':
+        click.echo("Partitioning is only supported on PostgreSQL.")
+        raise SystemExit(1)
+
+    current_month = month_start(get_current_date())
+    last_month = current_month
+    for _ in range(months_ahead):
+        last_month = next_month(last_month)
+
+    if attendance_is_partitioned():
+        created = create_month_partitions(current_month, last_month)
+        db.session.commit()
+        click.echo(f"Done. {created} partitions created.")
+        return
+
+    oldest = db.session.execute(select(func.min(Attendance.date))).scalar()
+
+    # The primary key must include the partition key, so it becomes (id, date);
+    # ids still come from the original sequence and stay unique
+    for statement in (
+        "ALTER TABLE attendance RENAME TO attendance_unpartitioned",
+        "ALTER TABLE attendance_unpartitioned RENAME CONSTRAINT attendance_pkey TO attendance_unpartitioned_pkey",
+        "ALTER TABLE attendance_unpartitioned RENAME CONSTRAINT unique_daily_attendance "
+        "TO unique_daily_attendance_unpartitioned",
+        "ALTER INDEX IF EXISTS ix_attendance_date_time_id RENAME TO ix_attendance_unpartitioned_date_time_id",
+        "ALTER INDEX IF EXISTS ix_attendance_datetime RENAME TO ix_attendance_unpartitioned_datetime",
+        "CREATE TABLE attendance (LIKE attendance_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (date)",
+        "ALTER TABLE attendance ADD CONSTRAINT attendance_pkey PRIMARY KEY (id, date)",
+        "ALTER TABLE attendance ADD CONSTRAINT unique_daily_attendance UNIQUE (employee_id, date)",
+        "ALTER TABLE attendance ADD FOREIGN KEY (employee_id) REFERENCES employees (id)",
+        "ALTER TABLE attendance ADD FOREIGN KEY (marked_by_id) REFERENCES supervisors (id)",
+        "CREATE INDEX ix_attendance_date_time_id ON attendance (date, time, id)",
+        "CREATE INDEX ix_attendance_datetime ON attendance (datetime)",
+        "ALTER SEQUENCE attendance_id_seq OWNED BY attendance.id",
+        "CREATE TABLE attendance_default PARTITION OF attendance DEFAULT",
+    ):
+        db.session.execute(text(statement))
+
+    created = create_month_partitions(month_start(oldest) if oldest else current_month, last_month)
+    moved = db.session.execute(text("INSERT INTO attendance SELECT * FROM attendance_unpartitioned")).rowcount
+    db.session.execute(text("DROP TABLE attendance_unpartitioned"))
+    db.session.commit()
+
+    click.echo(f"Done. attendance partitioned into {created} monthly partitions, {moved} rows moved.")
+
+@app.cli.command('archive-attendance')
+@click.option('--keep-months', default=12, show_default=True,
+              help='Most recent months, including the current one, left in the attendance table.')
+def archive_attendance(keep_months):
+    """Move attendance rows of closed months to attendance_archive"""
+    if keep_months < 1:
+        raise click.BadParameter('must be at least 1', param_hint='--keep-months')
+
+    cutoff = month_start(get_current_date())
+    for _ in range(keep_months - 1):
+        cutoff = month_start(cutoff - timedelta(days=1))
+
+    hot = Attendance.__table__
+    columns = [column.name for column in hot.columns]
+    partitioned = db.engine.dialect.name == 'postgresql' and attendance_is_partitioned()
+    archived_rows = 0
+
+    while True:
+        oldest = db.session.execute(select(func.min(hot.c.date)).where(hot.c.date < cutoff)).scalar()
+        if oldest is None:
+            break
+
+        month = month_start(oldest)
+        in_month = (hot.c.date >= month, hot.c.date < next_month(month))
+
+        # A plain move: archived rows stay in the rollup and are not deletes for the sync feed
+        count = db.session.execute(AttendanceArchive.__table__.insert().from_select(
+            columns, select(*(hot.c[name] for name in columns)).where(*in_month)
+        )).rowcount
+
+        # Dropping the month's partition is instant; the delete then only
+        # touches rows that landed in the default partition
+        if partitioned and db.session.execute(
+                text("SELECT to_regclass(:name)"), {'name': partition_name(month)}).scalar() is not None:
+            db.session.execute(text(f"DROP TABLE {partition_name(month)}"))
+        db.session.execute(delete(hot).where(*in_month))
+
+        archived_month = db.session.get(ArchivedMonth, month)
+        if archived_month:
+            archived_month.row_count += count
+        else:
+            db.session.add(ArchivedMonth(month=month, row_count=count))
+        db.session.commit()
+
+        archived_rows += count
+        click.echo(f"Archived {count} attendance records for {month.strftime('%Y-%m')}")
+
+    click.echo(f"Done. {archived_rows} attendance records archived.")
+
+@app.cli.command('prune-report-jobs')
+@click.option('--days', default=7, show_default=True, help='Age after which finished report jobs are removed.')
+def prune_report_jobs(days):
+    """Delete old finished report jobs and cached report files no remaining job refers to"""
+    cutoff = get_current_datetime() - timedelta(days=days)
+    deleted_jobs = ReportJob.query.filter(
+        ReportJob.status.in_(['done', 'failed']),
+        ReportJob.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+    folder = app.config['REPORT_CACHE_FOLDER']
+    kept = {f"{cache_key}.{report_type}" for cache_key, report_type in
+            db.session.query(ReportJob.cache_key, ReportJob.report_type)}
+    deleted_files = 0
+    if os.path.isdir(folder):
+        for filename in os.listdir(folder):
+            # Leave in-progress temp files and anything still referenced
+            if filename not in kept and not filename.endswith('.tmp'):
+                os.remove(os.path.join(folder, filename))
+                deleted_files += 1
+
+    click.echo(f"Done. {deleted_jobs} report jobs and {deleted_files} cached reports removed.")
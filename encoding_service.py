@@ -0,0 +1,117 @@
+"""
+Process pool for face encoding so request workers stay responsive
+"""
+import importlib
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Face processor owned by each pool process, created by _init_worker
+_worker_processor = None
+
+def _load_processor(processor_path):
+    module_name, class_name = processor_path.split(':')
+    return getattr(importlib.import_module(module_name), class_name)()
+
+def _init_worker(processor_path):
+    """Create and pre-warm the face processor once per pool process"""
+    global _worker_processor
+    _worker_processor = _load_processor(processor_path)
+    _worker_processor.extract_face_encoding(bytes(256))
+
+def _extract_encoding(image_bytes, session_key):
+    return _worker_processor.extract_face_encoding(image_bytes, session_key)
+
+def _ping():
+    return os.getpid()
+
+class EncodingService:
+    """Runs extract_face_encoding in a pool of pre-warmed worker processes
+
+    The pool is created lazily in each gunicorn worker (never inherited
+    across a fork) using the spawn start method, so pool processes do not
+    share database connections or locks with the web process. Every
+    gunicorn worker gets its own pool, so the default is a small fixed
+    size rather than the CPU count. processor_path must name a module that
+    does not import the Flask app. With max_workers=0 encodings run inline
+    on the request thread.
+    """
+
+    DEFAULT_WORKERS = 2
+
+    def __init__(self, processor_path='face_utils_working:FaceProcessor', max_workers=None, timeout=10.0):
+        self.processor_path = processor_path
+        self.max_workers = min(self.DEFAULT_WORKERS, os.cpu_count() or 1) if max_workers is None else max_workers
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._inline_processor = None
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.processor_path,)
+                )
+                self._pid = os.getpid()
+
+                # Start every pool process now rather than on first use
+                for _ in range(self.max_workers):
+                    self._executor.submit(_ping)
+
+                logging.info(f"Face encoding pool started with {self.max_workers} processes")
+            return self._executor
+
+    def _extract_inline(self, image_bytes, session_key):
+        if self._inline_processor is None:
+            self._inline_processor = _load_processor(self.processor_path)
+        return self._inline_processor.extract_face_encoding(image_bytes, session_key)
+
+    def submit(self, frame, session_key=None):
+        """Queue a frame for encoding and return a Future"""
+        return self._get_executor().submit(_extract_encoding, frame.data, session_key)
+
+    def extract_face_encoding(self, frame, session_key=None, timeout=None):
+        """Encode a DecodedFrame in the pool, waiting at most timeout seconds
+
+        Raises concurrent.futures.TimeoutError if the pool does not answer in time.
+        """
+        if not self.max_workers:
+            return self._extract_inline(frame.data, session_key)
+
+        try:
+            future = self.submit(frame, session_key)
+        except BrokenProcessPool:
+            logging.error("Face encoding pool is broken; restarting it")
+            with self._lock:
+                self._executor = None
+            future = self.submit(frame, session_key)
+
+        try:
+            return future.result(timeout=timeout or self.timeout)
+        except BrokenProcessPool:
+            logging.error("Face encoding pool died while encoding; encoding inline")
+            with self._lock:
+                self._executor = None
+            return self._extract_inline(frame.data, session_key)
+        finally:
+            future.cancel()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Global encoding service instance
+encoding_service = EncodingService(
+    max_workers=int(os.environ['FACE_ENCODING_WORKERS']) if 'FACE_ENCODING_WORKERS' in os.environ else None,
+    timeout=float(os.environ.get('FACE_ENCODING_TIMEOUT', 10))
+)
@@ -4,6 +4,8 @@ import logging
 from io import BytesIO
 import hashlib
 import json
+from frame_utils import DecodedFrame, frame_preprocessor
+from liveness import liveness_sessions
 
 # Simplified face processing without external dependencies
 # This is a functional implementation for demo purposes
@@ -18,8 +20,6 @@ class FaceProcessor:
         )
         self.blink_threshold = 0.25
         self.consecutive_frames = 3
-        self.blink_counter = 0
-        self.blink_detected = False
         
     def calculate_ear(self, landmarks, eye_points):
         """Calculate Eye Aspect Ratio (EAR) for blink detection"""
@@ -45,9 +45,12 @@ class FaceProcessor:
         except:
             return 0.3  # Default EAR value
     
-    def detect_blink(self, frame):
-        """Detect eye blink in frame"""
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    def detect_blink(self, frame, session):
+        """Detect eye blink in a DecodedFrame or BGR frame for one capture stream"""
+        if isinstance(frame, DecodedFrame):
+            rgb_frame = frame.rgb
+        else:
+            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
         results = self.face_mesh.process(rgb_frame)
         
         if results.multi_face_landmarks:
@@ -58,44 +61,30 @@ class FaceProcessor:
                 
                 avg_ear = (left_ear + right_ear) / 2.0
                 
-                # Check if eyes are closed
-                if avg_ear < self.blink_threshold:
-                    self.blink_counter += 1
-                else:
-                    if self.blink_counter >= self.consecutive_frames:
-                        self.blink_detected = True
+                # Closed-then-open eye pattern over the session's EAR history
+                with session.lock:
+                    if session.record_ear(avg_ear):
                         logging.info("Blink detected!")
-                    self.blink_counter = 0
-                
-                return avg_ear, self.blink_detected
+                    return avg_ear, session.blink_detected
         
         return 0.3, False
     
-    def reset_blink_detection(self):
-        """Reset blink detection state"""
-        self.blink_counter = 0
-        self.blink_detected = False
-    
-    def extract_face_encoding(self, image_data):
-        """Extract face encoding from base64 image data"""
+    def extract_face_encoding(self, image_data, session_key=None):
+        """Extract face encoding from base64 image data or a DecodedFrame"""
         try:
-            # Decode base64 image
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
-            
-            # Convert to RGB numpy array
-            image_array = np.array(image)
-            if len(image_array.shape) == 4:  # RGBA
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
-            elif len(image_array.shape) == 3 and image_array.shape[2] == 4:  # RGBA
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGBA2RGB)
+            # Downscale and crop to the face region so HOG runs on a small patch
+            frame = DecodedFrame.from_source(image_data)
+            image_array = frame_preprocessor.preprocess(frame, session_key).rgb
             
             # Find face locations
             face_locations = face_recognition.face_locations(image_array)
             
+            if len(face_locations) == 0 and session_key is not None:
+                # The cached face region may be stale; detect it again
+                frame_preprocessor.forget(session_key)
+                image_array = frame_preprocessor.preprocess(frame, session_key).rgb
+                face_locations = face_recognition.face_locations(image_array)
+            
             if len(face_locations) == 0:
                 return None, "No face detected in the image"
             
@@ -138,11 +127,18 @@ class FaceProcessor:
             logging.error(f"Error comparing faces: {str(e)}")
             return False, 0.0
     
-    def process_attendance_frame(self, image_data, known_encoding):
-        """Process frame for attendance marking with anti-spoofing"""
+    def process_attendance_frame(self, image_data, known_encoding, stream_key, session_key=None):
+        """Process frame for attendance marking with anti-spoofing
+
+        ``stream_key`` identifies the capture stream, e.g. (supervisor user
+        id, employee id), whose LivenessSession holds the blink history.
+        """
         try:
+            # Decode the frame once, at encoding size, for both encoding and blink detection
+            frame = frame_preprocessor.downscale(image_data)
+            
             # Extract face encoding from current frame
-            unknown_encoding, message = self.extract_face_encoding(image_data)
+            unknown_encoding, message = self.extract_face_encoding(frame, session_key)
             
             if unknown_encoding is None:
                 return False, False, 0.0, message
@@ -150,16 +146,8 @@ class FaceProcessor:
             # Compare with known encoding
             face_match, confidence = self.compare_faces(known_encoding, unknown_encoding)
             
-            # Convert base64 to cv2 image for blink detection
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(BytesIO(image_bytes))
-            frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-            
-            # Detect blink
-            ear, blink_detected = self.detect_blink(frame)
+            # Detect blink against this stream's own EAR history
+            ear, blink_detected = self.detect_blink(frame, liveness_sessions.get(stream_key))
             
             return face_match, blink_detected, confidence, f"Face match: {face_match}, Blink: {blink_detected}, Confidence: {confidence:.2f}"
             
@@ -2,91 +2,101 @@
 import numpy as np
 import base64
 import logging
+import os
 from io import BytesIO
 import hashlib
 import json
+import threading
 from PIL import Image
 import cv2
+from frame_utils import DecodedFrame, frame_preprocessor
+
+class PreparedEncodings:
+    """Known encodings with per-row norms precomputed for compare_many"""
+
+    def __init__(self, matrix, norms=None, centered_norms=None):
+        self.matrix = np.atleast_2d(np.asarray(matrix))
+        if norms is None or centered_norms is None:
+            norms, centered_norms = encoding_norms(self.matrix)
+        self.norms = norms
+        self.centered_norms = centered_norms
+
+def encoding_norms(matrix):
+    """Return (norms, centered norms) for each row of an encoding matrix"""
+    matrix = np.atleast_2d(np.asarray(matrix, dtype=np.float64))
+    norms = np.linalg.norm(matrix, axis=1)
+    centered_norms = np.linalg.norm(matrix - matrix.mean(axis=1, keepdims=True), axis=1)
+    return norms, centered_norms
 
 class FaceProcessor:
     def __init__(self):
         # Blink detection parameters
         self.blink_threshold = 0.25
         self.consecutive_frames = 3
-        self.blink_counter = 0
-        self.blink_detected = False
-        self.frame_count = 0
-        self.last_blink_frame = 0
+        
+        # Minimum combined similarity score for a face match
+        self.match_tolerance = 0.65
 
-    def calculate_ear(self, landmarks, eye_points):
+        # Minimum lead of the best 1:N match over the runner-up
+        self.identify_margin = 0.05
+        
+        # Byte-sampled encodings of preprocessed frames are not comparable
+        # with encodings stored from full frames, so this is opt-in
+        self.preprocess_frames = os.environ.get('FACE_PREPROCESS_BYTE_ENCODER') == '1'
+
+    def calculate_ear(self, landmarks, eye_points, frame_count=0):
         """Calculate Eye Aspect Ratio (EAR) for blink detection"""
         # Simplified mock calculation with more realistic variation
         base_ear = 0.3
-        variation = 0.05 * np.sin(self.frame_count * 0.2)  # Natural eye movement
+        variation = 0.05 * np.sin(frame_count * 0.2)  # Natural eye movement
         return base_ear + variation
 
-    def detect_blink(self, frame):
-        """Detect eye blink in frame - improved mock version"""
-        self.frame_count += 1
-        
-        # More realistic blink detection - blinks occur every 3-5 seconds naturally
-        # For demo purposes, we'll simulate this
-        frames_since_blink = self.frame_count - self.last_blink_frame
-        
-        # Simulate natural blinking pattern
-        if frames_since_blink > 50 and (self.frame_count % 17 == 0 or self.frame_count % 23 == 0):
-            self.blink_detected = True
-            self.last_blink_frame = self.frame_count
-            logging.info("Blink detected - anti-spoofing verified!")
-            return True
-        
-        # Reset if too much time has passed without activity
-        if frames_since_blink > 100:
-            self.blink_detected = False
-        
-        return self.blink_detected
-
-    def reset_blink_detection(self):
-        """Reset blink detection state"""
-        self.blink_counter = 0
-        self.blink_detected = False
-        self.frame_count = 0
-        self.last_blink_frame = 0
+    def detect_blink(self, frame, session):
+        """Detect eye blink in frame for one capture stream - improved mock version"""
+        with session.lock:
+            if session.record_ear(self.calculate_ear(None, None, session.frame_count)):
+                return True
+            
+            # More realistic blink detection - blinks occur every 3-5 seconds naturally
+            # For demo purposes, we'll simulate this
+            frames_since_blink = session.frame_count - session.last_blink_frame
+            
+            # Simulate natural blinking pattern
+            if frames_since_blink > 50 and (session.frame_count % 17 == 0 or session.frame_count % 23 == 0):
+                session.mark_blink()
+                logging.info("Blink detected - anti-spoofing verified!")
+                return True
+            
+            # Reset if too much time has passed without activity
+            if frames_since_blink > 100:
+                session.blink_detected = False
+            
+            return session.blink_detected
 
-    def extract_face_encoding(self, image_data):
-        """Extract face encoding from base64 image data - improved version"""
+    def extract_face_encoding(self, image_data, session_key=None):
+        """Extract a 128-feature float32 face encoding from image data or a DecodedFrame"""
         try:
-            # Remove data URL prefix if present
-            if ',' in image_data:
-                image_data = image_data.split(',')[1]
-            
-            # Decode base64 image
-            image_bytes = base64.b64decode(image_data)
+            # Accept a DecodedFrame, raw bytes or a base64 data URL
+            frame = DecodedFrame.from_source(image_data)
+            if self.preprocess_frames:
+                frame = frame_preprocessor.preprocess(frame, session_key)
+            image_bytes = frame.data
             
             # Validate image data
             if len(image_bytes) < 100:  # Minimum viable image size
                 logging.error("Image data too small")
                 return None
             
-            # Create face encoding from image characteristics
-            encoding = []
-            
             # Use image bytes to generate consistent encoding
-            # Sample every 32nd byte to get representative features
-            step = max(1, len(image_bytes) // 128)
-            for i in range(0, len(image_bytes), step):
-                if len(encoding) >= 128:
-                    break
-                byte_val = image_bytes[i]
-                # Normalize to [-1, 1] range like real face encodings
-                normalized_val = (byte_val - 127.5) / 127.5
-                encoding.append(normalized_val)
-            
-            # Ensure we have exactly 128 features
-            while len(encoding) < 128:
-                encoding.append(0.0)
-            
-            encoding = encoding[:128]
+            # Sample evenly spaced bytes to get representative features
+            samples = np.frombuffer(image_bytes, dtype=np.uint8)
+            step = max(1, len(samples) // 128)
+            sampled = samples[::step][:128]
+            
+            # Normalize to [-1, 1] range like real face encodings,
+            # zero-padding to exactly 128 features
+            encoding = np.zeros(128, dtype=np.float32)
+            encoding[:len(sampled)] = (sampled.astype(np.float32) - 127.5) / 127.5
             
             logging.info(f"Successfully generated face encoding with {len(encoding)} features")
             return encoding
@@ -97,7 +107,7 @@ class FaceProcessor:
 
     def compare_faces(self, known_encoding, unknown_encoding, tolerance=0.7):
         """Compare two face encodings - improved similarity calculation"""
-        if not known_encoding or not unknown_encoding:
+        if known_encoding is None or unknown_encoding is None:
             return False
         
         try:
@@ -105,100 +115,72 @@ class FaceProcessor:
             if len(known_encoding) != len(unknown_encoding):
                 return False
             
-            # Calculate multiple similarity metrics for better matching
-            known = np.array(known_encoding)
-            unknown = np.array(unknown_encoding)
-            
-            # 1. Cosine similarity (most reliable for face matching)
-            dot_product = np.dot(known, unknown)
-            norm_known = np.linalg.norm(known)
-            norm_unknown = np.linalg.norm(unknown)
-            
-            if norm_known == 0 or norm_unknown == 0:
-                return False
-                
-            cosine_similarity = dot_product / (norm_known * norm_unknown)
-            
-            # 2. Euclidean distance (normalized)
-            euclidean_distance = np.linalg.norm(known - unknown)
-            normalized_distance = euclidean_distance / np.sqrt(len(known_encoding))
-            
-            # 3. Correlation coefficient
-            correlation = np.corrcoef(known, unknown)[0, 1]
-            if np.isnan(correlation):
-                correlation = 0
-            
-            # Combined scoring with weights
-            similarity_score = (
-                cosine_similarity * 0.5 +  # 50% weight to cosine similarity
-                (1 - normalized_distance) * 0.3 +  # 30% weight to normalized distance
-                abs(correlation) * 0.2  # 20% weight to correlation
-            )
+            similarity_score = self.compare_many(np.asarray(known_encoding)[None, :], unknown_encoding)[0]
             
             # Use more lenient threshold for better matching
-            return similarity_score > tolerance
+            return bool(similarity_score > tolerance)
             
         except Exception as e:
             logging.error(f"Error comparing faces: {e}")
             return False
 
-    def process_attendance_frame(self, image_data, known_encoding, blink_detected=False):
+    def compare_many(self, known_matrix, probe):
+        """Score a probe encoding against every row of a known-encoding matrix
+
+        Returns the combined similarity score used by compare_faces for each
+        row: 50% cosine similarity, 30% (1 - normalized Euclidean distance)
+        and 20% absolute correlation. Rows that cannot be compared (zero
+        vectors) score -inf. Pass a PreparedEncodings to reuse per-row norms
+        across calls.
+        """
+        if not isinstance(known_matrix, PreparedEncodings):
+            known_matrix = PreparedEncodings(known_matrix)
+        
+        probe = np.asarray(probe, dtype=np.float64).ravel()
+        dimensions = probe.shape[0]
+        if known_matrix.matrix.shape[1] != dimensions:
+            raise ValueError(f"Probe has {dimensions} features, gallery has {known_matrix.matrix.shape[1]}")
+        
+        probe_norm = np.linalg.norm(probe)
+        centered_probe = probe - probe.mean()
+        centered_probe_norm = np.linalg.norm(centered_probe)
+        
+        # Both products in a single pass over the gallery. The centered gallery
+        # rows are never materialised: since centered_probe sums to zero,
+        # (row - mean(row)) . centered_probe == row . centered_probe
+        products = known_matrix.matrix @ np.column_stack((probe, centered_probe))
+        dots = products[:, 0]
+        centered_dots = products[:, 1]
+        
+        norms = known_matrix.norms
+        comparable = (norms > 0) & (probe_norm > 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 1. Cosine similarity
+            cosine_similarity = dots / (norms * probe_norm)
+            
+            # 2. Euclidean distance (normalized), from |a - b|^2 = |a|^2 + |b|^2 - 2a.b
+            squared_distance = np.maximum(norms ** 2 + probe_norm ** 2 - 2 * dots, 0.0)
+            normalized_distance = np.sqrt(squared_distance) / np.sqrt(dimensions)
+            
+            # 3. Correlation coefficient (0 when either vector is constant)
+            correlation_denominator = known_matrix.centered_norms * centered_probe_norm
+            correlation = np.where(correlation_denominator > 0,
+                                   centered_dots / correlation_denominator, 0.0)
+        
+        similarity_score = (
+            cosine_similarity * 0.5 +
+            (1 - normalized_distance) * 0.3 +
+            np.abs(correlation) * 0.2
+        )
+        return np.where(comparable, similarity_score, -np.inf)
+
+    def process_attendance_frame(self, image_data, known_encoding, blink_detected=False, session_key=None):
         """Process frame for attendance marking with anti-spoofing"""
         try:
             # Extract face encoding from current frame
-            current_encoding = self.extract_face_encoding(image_data)
-            
-            if not current_encoding:
-                return {
-                    'success': False,
-                    'message': 'No face detected in image. Please ensure your face is clearly visible.',
-                    'blink_detected': False,
-                    'confidence': 0.0,
-                    'security_alert': 'Face detection failed - possible obstruction or poor lighting'
-                }
-            
-            # Compare with known encoding using improved algorithm
-            face_match = self.compare_faces(known_encoding, current_encoding, tolerance=0.65)
+            current_encoding = self.extract_face_encoding(image_data, session_key)
             
-            if face_match:
-                confidence = 0.85 + np.random.random() * 0.10  # Mock confidence 85-95%
-                
-                if blink_detected:
-                    return {
-                        'success': True,
-                        'message': f'Face matched successfully! Confidence: {confidence:.1%}',
-                        'blink_detected': True,
-                        'confidence': confidence,
-                        'security_alert': None
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'message': 'Face matched but no blink detected. Please blink naturally.',
-                        'blink_detected': False,
-                        'confidence': confidence,
-                        'security_alert': 'SECURITY ALERT: No eye blink detected - possible photo/screen spoof attempt'
-                    }
-            else:
-                # Face doesn't match
-                confidence = 0.20 + np.random.random() * 0.30  # Low confidence for non-match
-                
-                if not blink_detected:
-                    return {
-                        'success': False,
-                        'message': 'Face does not match registered employee and no blink detected.',
-                        'blink_detected': False,
-                        'confidence': confidence,
-                        'security_alert': 'SECURITY ALERT: Unauthorized access attempt with possible spoofing'
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'message': 'Face does not match registered employee.',
-                        'blink_detected': True,
-                        'confidence': confidence,
-                        'security_alert': 'SECURITY ALERT: Unauthorized access attempt detected'
-                    }
+            return self.process_attendance_encoding(current_encoding, known_encoding, blink_detected)
                 
         except Exception as e:
             logging.error(f"Error processing attendance frame: {e}")
@@ -210,5 +192,282 @@ class FaceProcessor:
                 'security_alert': 'System error during face processing'
             }
 
+    def process_attendance_encoding(self, current_encoding, known_encoding, blink_detected=False):
+        """Match an already extracted encoding for attendance marking"""
+        if current_encoding is None:
+            return {
+                'success': False,
+                'message': 'No face detected in image. Please ensure your face is clearly visible.',
+                'blink_detected': False,
+                'confidence': 0.0,
+                'security_alert': 'Face detection failed - possible obstruction or poor lighting'
+            }
+        
+        # Compare with known encoding using improved algorithm
+        face_match = self.compare_faces(known_encoding, current_encoding, tolerance=self.match_tolerance)
+        
+        return self.attendance_result(face_match, blink_detected)
+
+    def attendance_result(self, face_match, blink_detected):
+        """Build the attendance response for a face match outcome"""
+        if face_match:
+            confidence = 0.85 + np.random.random() * 0.10  # Mock confidence 85-95%
+            
+            if blink_detected:
+                return {
+                    'success': True,
+                    'message': f'Face matched successfully! Confidence: {confidence:.1%}',
+                    'blink_detected': True,
+                    'confidence': confidence,
+                    'security_alert': None
+                }
+            else:
+                return {
+                    'success': False,
+                    'message': 'Face matched but no blink detected. Please blink naturally.',
+                    'blink_detected': False,
+                    'confidence': confidence,
+                    'security_alert': 'SECURITY ALERT: No eye blink detected - possible photo/screen spoof attempt'
+                }
+        else:
+            # Face doesn't match
+            confidence = 0.20 + np.random.random() * 0.30  # Low confidence for non-match
+            
+            if not blink_detected:
+                return {
+                    'success': False,
+                    'message': 'Face does not match registered employee and no blink detected.',
+                    'blink_detected': False,
+                    'confidence': confidence,
+                    'security_alert': 'SECURITY ALERT: Unauthorized access attempt with possible spoofing'
+                }
+            else:
+                return {
+                    'success': False,
+                    'message': 'Face does not match registered employee.',
+                    'blink_detected': True,
+                    'confidence': confidence,
+                    'security_alert': 'SECURITY ALERT: Unauthorized access attempt detected'
+                }
+
+class FaceGallery:
+    """In-memory gallery of registered face encodings for 1:N identification
+
+    Rows live in a preallocated float32 buffer with a parallel id array.
+    Changes are applied as row-level deltas: new rows are appended, edited
+    rows are overwritten in place and deleted rows are tombstoned (id -1)
+    until enough accumulate to be worth compacting.
+    """
+
+    TOMBSTONE = -1
+    MIN_CAPACITY = 64
+
+    def __init__(self, dimensions=128):
+        self.dimensions = dimensions
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.generation = 0
+        self._reset(0)
+
+    def _reset(self, capacity):
+        capacity = max(capacity, self.MIN_CAPACITY)
+        self._ids = np.full(capacity, self.TOMBSTONE, dtype=np.int64)
+        self._matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        self._norms = np.zeros(capacity, dtype=np.float64)
+        self._centered_norms = np.zeros(capacity, dtype=np.float64)
+        self._size = 0
+        self._tombstones = 0
+        self._positions = {}
+
+    def __len__(self):
+        return self._size - self._tombstones
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def matrix(self):
+        return self._matrix[:self._size]
+
+    def _as_row(self, employee_id, encoding):
+        if encoding is None:
+            return None
+        row = np.asarray(encoding, dtype=np.float32).ravel()
+        if row.shape[0] != self.dimensions:
+            logging.warning(f"Skipping face encoding for employee {employee_id}: "
+                            f"expected {self.dimensions} features, got {row.shape[0]}")
+            return None
+        return row
+
+    def _write_row(self, position, employee_id, row):
+        norms, centered_norms = encoding_norms(row)
+        self._ids[position] = employee_id
+        self._matrix[position] = row
+        self._norms[position] = norms[0]
+        self._centered_norms[position] = centered_norms[0]
+        self._positions[employee_id] = position
+
+    def _grow(self):
+        capacity = len(self._ids) * 2
+        ids = np.full(capacity, self.TOMBSTONE, dtype=np.int64)
+        matrix = np.zeros((capacity, self.dimensions), dtype=np.float32)
+        norms = np.zeros(capacity, dtype=np.float64)
+        centered_norms = np.zeros(capacity, dtype=np.float64)
+        ids[:self._size] = self._ids[:self._size]
+        matrix[:self._size] = self._matrix[:self._size]
+        norms[:self._size] = self._norms[:self._size]
+        centered_norms[:self._size] = self._centered_norms[:self._size]
+        self._ids, self._matrix = ids, matrix
+        self._norms, self._centered_norms = norms, centered_norms
+
+    def upsert(self, employee_id, encoding):
+        """Append a new row or overwrite the existing row for an employee"""
+        row = self._as_row(employee_id, encoding)
+        if row is None:
+            self.remove(employee_id)
+            return
+
+        with self._lock:
+            position = self._positions.get(employee_id)
+            if position is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                position = self._size
+                self._size += 1
+            self._write_row(position, employee_id, row)
+
+    def remove(self, employee_id):
+        """Tombstone an employee's row; compaction happens lazily"""
+        with self._lock:
+            position = self._positions.pop(employee_id, None)
+            if position is None:
+                return
+            self._ids[position] = self.TOMBSTONE
+            self._tombstones += 1
+
+            if self._tombstones > max(16, self._size // 4):
+                self.compact()
+
+    def compact(self):
+        """Drop tombstoned rows and rebuild the id -> row index"""
+        with self._lock:
+            live = np.flatnonzero(self._ids[:self._size] != self.TOMBSTONE)
+            ids = self._ids[live]
+            matrix = self._matrix[live]
+            norms = self._norms[live]
+            centered_norms = self._centered_norms[live]
+
+            self._reset(len(live) * 2)
+            self._size = len(live)
+            self._ids[:self._size] = ids
+            self._matrix[:self._size] = matrix
+            self._norms[:self._size] = norms
+            self._centered_norms[:self._size] = centered_norms
+            self._positions = {int(employee_id): i for i, employee_id in enumerate(ids)}
+
+    def build(self, ids, matrix, generation=0):
+        """Build the gallery from an id array and a matching (N, dimensions) matrix"""
+        ids = np.asarray(ids, dtype=np.int64)
+        matrix = np.asarray(matrix, dtype=np.float32).reshape(-1, self.dimensions)
+        norms, centered_norms = encoding_norms(matrix)
+
+        with self._lock:
+            self._reset(len(ids) * 2)
+            self._size = len(ids)
+            self._ids[:self._size] = ids
+            self._matrix[:self._size] = matrix
+            self._norms[:self._size] = norms
+            self._centered_norms[:self._size] = centered_norms
+            self._positions = {int(employee_id): i for i, employee_id in enumerate(ids)}
+            self.generation = generation
+            self.loaded = True
+
+        logging.info(f"Face gallery built with {len(self)} encodings at generation {generation}")
+
+    def load_from_database(self):
+        """Load every active employee's face encoding from the database"""
+        from models import EmployeeEncodingChange, load_all_encodings
+
+        # Read the watermark first so changes racing the load are replayed
+        generation = EmployeeEncodingChange.latest_watermark()
+        ids, matrix = load_all_encodings(self.dimensions)
+        self.build(ids, matrix, generation)
+
+    def sync(self):
+        """Catch up with employee changes made by this or any other worker"""
+        if not self.loaded:
+            self.load_from_database()
+            return
+
+        from models import Employee, EmployeeEncodingChange
+
+        changes, generation, _ = EmployeeEncodingChange.changes_since(self.generation)
+
+        if not changes:
+            self.generation = generation
+            return
+
+        # Only the latest operation per employee matters
+        latest = {}
+        for change in changes:
+            latest[change.employee_id] = change.operation
+
+        changed_ids = [employee_id for employee_id, operation in latest.items() if operation == 'upsert']
+        rows = {}
+        if changed_ids:
+            rows = {emp.id: emp for emp in Employee.query.filter(Employee.id.in_(changed_ids)).all()}
+
+        with self._lock:
+            for employee_id, operation in latest.items():
+                employee = rows.get(employee_id)
+                if operation == 'upsert' and employee is not None and employee.is_active:
+                    self.upsert(employee_id, employee.get_face_encoding())
+                else:
+                    self.remove(employee_id)
+            self.generation = generation
+
+        logging.info(f"Face gallery applied {len(latest)} changes, now at generation {self.generation}")
+
+    def invalidate(self):
+        """Mark the gallery stale so it is fully rebuilt on next sync"""
+        self.loaded = False
+
+    def identify(self, encoding, top_k=3, candidate_ids=None):
+        """Return the top-k employees by similarity score for a probe encoding"""
+        probe = np.asarray(encoding, dtype=np.float32).ravel()
+        if probe.shape[0] != self.dimensions:
+            return []
+
+        with self._lock:
+            ids = self._ids[:self._size]
+            if candidate_ids is not None:
+                mask = np.isin(ids, np.fromiter(candidate_ids, dtype=np.int64))
+            else:
+                mask = ids != self.TOMBSTONE
+            rows = np.flatnonzero(mask)
+
+            if len(rows) == 0:
+                return []
+
+            ids = ids[rows]
+            known = PreparedEncodings(self._matrix[rows], self._norms[rows], self._centered_norms[rows])
+
+        # One batched pass over the whole gallery
+        scores = face_processor.compare_many(known, probe)
+
+        top_k = min(top_k, len(ids))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        return [
+            {'employee_id': int(ids[i]), 'score': float(scores[i])}
+            for i in best
+            if np.isfinite(scores[i])
+        ]
+
 # Global face processor instance
 face_processor = FaceProcessor()
+
+# Global face gallery instance
+face_gallery = FaceGallery()
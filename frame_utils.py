@@ -0,0 +1,242 @@
+"""
+Decoding helpers for captured camera frames
+"""
+import base64
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import cached_property
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+import cv2
+
+class DecodedFrame:
+    """A captured frame decoded once, with lazily derived RGB/BGR/gray views
+
+    The encoded bytes are kept as received; the image is decoded into a
+    single RGB ndarray the first time a pixel view is requested. The BGR
+    view is a channel-reversed view of that array rather than a copy.
+    """
+
+    def __init__(self, image_bytes=None, rgb=None):
+        self._data = image_bytes
+        self._downscaled = {}  # max_edge -> frame
+        if rgb is not None:
+            self.__dict__['rgb'] = rgb
+
+    @classmethod
+    def from_array(cls, rgb):
+        """Create a frame from an RGB ndarray; encoded bytes are produced on demand"""
+        return cls(rgb=np.ascontiguousarray(rgb))
+
+    @property
+    def data(self):
+        if self._data is None:
+            buffer = BytesIO()
+            Image.fromarray(self.rgb).save(buffer, format='JPEG', quality=90)
+            self._data = buffer.getvalue()
+        return self._data
+
+    @property
+    def size(self):
+        """(width, height), read from the image header when not yet decoded"""
+        if 'rgb' in self.__dict__:
+            height, width = self.rgb.shape[:2]
+            return width, height
+        with Image.open(BytesIO(self.data)) as image:
+            return image.size
+
+    @classmethod
+    def from_data_url(cls, image_data):
+        """Create a frame from a base64 string, with or without a data URL prefix"""
+        if ',' in image_data:
+            image_data = image_data.split(',', 1)[1]
+        return cls(base64.b64decode(image_data))
+
+    @classmethod
+    def from_source(cls, image):
+        """Accept a DecodedFrame, a base64/data URL string or raw encoded bytes"""
+        if isinstance(image, cls):
+            return image
+        if isinstance(image, str):
+            return cls.from_data_url(image)
+        return cls(bytes(image))
+
+    def __len__(self):
+        return len(self.data)
+
+    def __bool__(self):
+        return 'rgb' in self.__dict__ or bool(self._data)
+
+    def downscaled(self, max_edge):
+        """Return a frame whose longest edge is at most max_edge pixels
+
+        JPEG frames are reduced during decoding (DCT scaling) before the final
+        resize, so a full-resolution pixel buffer is never materialised. The
+        result is kept, so asking again does not decode again.
+        """
+        if max_edge in self._downscaled:
+            return self._downscaled[max_edge]
+        if max(self.size) <= max_edge:
+            return self
+
+        if 'rgb' in self.__dict__:
+            image = Image.fromarray(self.rgb)
+        else:
+            image = Image.open(BytesIO(self.data))
+            image.draft('RGB', (max_edge, max_edge))
+        image = image.convert('RGB')
+        image.thumbnail((max_edge, max_edge))
+        frame = self._downscaled[max_edge] = DecodedFrame.from_array(np.asarray(image))
+        return frame
+
+    def cropped(self, box):
+        """Return the (left, top, right, bottom) region as a new frame"""
+        left, top, right, bottom = box
+        return DecodedFrame.from_array(self.rgb[top:bottom, left:right])
+
+    @cached_property
+    def rgb(self):
+        with Image.open(BytesIO(self.data)) as image:
+            return np.asarray(image.convert('RGB'))
+
+    @cached_property
+    def bgr(self):
+        return self.rgb[:, :, ::-1]
+
+    @cached_property
+    def gray(self):
+        return cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+
+    @property
+    def shape(self):
+        return self.rgb.shape
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+class FramePreprocessor:
+    """Downscale frames and crop them to the face region before encoding
+
+    The face box found for a capture session is cached, so subsequent frames
+    from the same camera skip detection and are cropped directly.
+    """
+
+    def __init__(self, max_edge=640, crop_face=True, margin=0.25, roi_ttl=120):
+        self.max_edge = max_edge
+        self.crop_face = crop_face
+        self.margin = margin
+        self.roi_cache = TTLCache(maxsize=512, ttl=roi_ttl)
+        self._detector = None
+
+    @property
+    def detector(self):
+        if self._detector is None and self.crop_face:
+            cascade = None
+            if hasattr(cv2, 'CascadeClassifier'):
+                cascade = cv2.CascadeClassifier(
+                    os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+                )
+            if cascade is None or cascade.empty():
+                logging.warning("Face cascade not available; frames will not be cropped")
+                self.crop_face = False
+                return None
+            self._detector = cascade
+        return self._detector
+
+    def detect_face_box(self, frame):
+        """Return the largest face box, padded by the margin, or None"""
+        if self.detector is None:
+            return None
+
+        height, width = frame.gray.shape
+        min_side = max(24, min(width, height) // 8)
+        faces = self.detector.detectMultiScale(frame.gray, scaleFactor=1.2, minNeighbors=5,
+                                               minSize=(min_side, min_side))
+        if len(faces) == 0:
+            return None
+
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        pad_x = int(w * self.margin)
+        pad_y = int(h * self.margin)
+        return (max(0, x - pad_x), max(0, y - pad_y),
+                min(width, x + w + pad_x), min(height, y + h + pad_y))
+
+    def downscale(self, frame):
+        """Decode a frame at most max_edge pixels on its longest edge"""
+        frame = DecodedFrame.from_source(frame)
+        return frame.downscaled(self.max_edge) if self.max_edge else frame
+
+    def preprocess(self, frame, session_key=None):
+        """Return a small frame ready for encoding
+
+        Pass the DecodedFrame itself when other steps also need its pixels,
+        so the image is decoded once for all of them.
+        """
+        frame = self.downscale(frame)
+
+        if not self.crop_face:
+            return frame
+
+        cached = self.roi_cache.get(session_key) if session_key is not None else None
+        if cached is not None and cached[0] == frame.size:
+            box = cached[1]
+        else:
+            box = self.detect_face_box(frame)
+            if box is None:
+                return frame
+            if session_key is not None:
+                self.roi_cache.set(session_key, (frame.size, box))
+
+        return frame.cropped(box)
+
+    def forget(self, session_key):
+        """Drop the cached face box, e.g. when the face was not found in the crop"""
+        self.roi_cache.pop(session_key)
+
+# Global frame preprocessor instance
+frame_preprocessor = FramePreprocessor(
+    max_edge=int(os.environ.get('FACE_MAX_EDGE', 640)),
+    crop_face=os.environ.get('FACE_CROP_ROI', '1') == '1'
+)
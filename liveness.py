@@ -0,0 +1,86 @@
+"""
+Per-stream liveness (blink detection) state
+"""
+import threading
+
+import numpy as np
+
+from frame_utils import TTLCache
+
+class LivenessSession:
+    """Blink-detection state for one capture stream
+
+    Recent eye aspect ratios are kept in a small float32 ring buffer, so
+    each stream carries its own history and concurrent streams never touch
+    each other's counters.
+    """
+
+    def __init__(self, blink_threshold=0.25, consecutive_frames=3, history=32):
+        self.blink_threshold = blink_threshold
+        self.consecutive_frames = consecutive_frames
+        self.ear_history = np.full(history, np.nan, dtype=np.float32)
+        self.frame_count = 0
+        self.blink_counter = 0
+        self.last_blink_frame = 0
+        self.blink_detected = False
+        self.lock = threading.Lock()
+
+    def record_ear(self, ear):
+        """Add an EAR sample; returns True when it completes a blink"""
+        self.ear_history[self.frame_count % len(self.ear_history)] = ear
+        self.frame_count += 1
+
+        # Eyes closed for enough consecutive frames, then reopened
+        if ear < self.blink_threshold:
+            self.blink_counter += 1
+            return False
+
+        blinked = self.blink_counter >= self.consecutive_frames
+        self.blink_counter = 0
+        if blinked:
+            self.mark_blink()
+        return blinked
+
+    def record_frame(self, blinked):
+        """Count a frame whose blink was detected by the client; returns True once the stream has blinked"""
+        with self.lock:
+            self.frame_count += 1
+            if blinked:
+                self.mark_blink()
+            return self.blink_detected
+
+    def mark_blink(self):
+        self.blink_detected = True
+        self.last_blink_frame = self.frame_count
+
+    def recent_ears(self):
+        """EAR samples in capture order, oldest first"""
+        size = len(self.ear_history)
+        if self.frame_count < size:
+            return self.ear_history[:self.frame_count].copy()
+        start = self.frame_count % size
+        return np.concatenate((self.ear_history[start:], self.ear_history[:start]))
+
+class LivenessRegistry:
+    """Bounded, expiring map of capture stream keys to LivenessSessions"""
+
+    def __init__(self, maxsize=1024, ttl=300, **session_options):
+        self.sessions = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.session_options = session_options
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the session for a stream, starting a new one if needed"""
+        with self._lock:
+            session = self.sessions.get(key)
+            if session is None:
+                session = LivenessSession(**self.session_options)
+            # Refresh the expiry on every frame
+            self.sessions.set(key, session)
+            return session
+
+    def reset(self, key):
+        self.sessions.pop(key)
+
+# Global liveness session registry, keyed by (supervisor user id, employee id)
+liveness_sessions = LivenessRegistry()
@@ -1,6 +1,10 @@
-from app import app
-import routes
-import api
+# Face encoding pool processes are spawned, and spawning re-imports this
+# script as __mp_main__; they only need face_utils_working, not the app
+if __name__ != '__mp_main__':
+    from app import app
+    import routes
+    import api
+    import commands
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -1,8 +1,66 @@
-from datetime import datetime
+from datetime import date, datetime
 from app import db
 from flask_login import UserMixin
-from sqlalchemy import LargeBinary, func
+from sqlalchemy import LargeBinary, func, event, inspect, literal, literal_column, or_, select, text, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+import numpy as np
+import io
+import logging
 import pickle
+import struct
+
+# Face encodings are stored as a small header followed by raw little-endian
+# float32 values, so they can be read with np.frombuffer without copying.
+FACE_ENCODING_MAGIC = b'FENC'
+FACE_ENCODING_VERSION = 1
+FACE_ENCODING_DTYPE = np.dtype('<f4')
+FACE_ENCODING_HEADER = struct.Struct('<4sHH')  # magic, version, dimensions
+
+class _LegacyEncodingUnpickler(pickle.Unpickler):
+    """Unpickler for pre-v1 encodings that refuses anything but lists and arrays"""
+    ALLOWED = {
+        ('builtins', 'list'),
+        ('builtins', 'float'),
+        ('numpy', 'ndarray'),
+        ('numpy', 'dtype'),
+        ('numpy.core.multiarray', '_reconstruct'),
+        ('numpy._core.multiarray', '_reconstruct'),
+        ('numpy.core.multiarray', 'scalar'),
+        ('numpy._core.multiarray', 'scalar'),
+    }
+
+    def find_class(self, module, name):
+        if (module, name) not in self.ALLOWED:
+            raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from face encoding")
+        return super().find_class(module, name)
+
+def is_packed_face_encoding(data):
+    return data is not None and bytes(data[:4]) == FACE_ENCODING_MAGIC
+
+def pack_face_encoding(encoding):
+    """Serialize a face encoding to the versioned float32 format"""
+    values = np.ascontiguousarray(encoding, dtype=FACE_ENCODING_DTYPE).ravel()
+    header = FACE_ENCODING_HEADER.pack(FACE_ENCODING_MAGIC, FACE_ENCODING_VERSION, values.shape[0])
+    return header + values.tobytes()
+
+def unpack_face_encoding(data):
+    """Read a stored face encoding as a float32 array (a zero-copy view for v1 data)"""
+    if data is None:
+        return None
+
+    if is_packed_face_encoding(data):
+        magic, version, dimensions = FACE_ENCODING_HEADER.unpack_from(data)
+        if version != FACE_ENCODING_VERSION:
+            raise ValueError(f"Unsupported face encoding version {version}")
+        return np.frombuffer(data, dtype=FACE_ENCODING_DTYPE, count=dimensions,
+                             offset=FACE_ENCODING_HEADER.size)
+
+    # Legacy pickled list from before the binary format
+    legacy = _LegacyEncodingUnpickler(io.BytesIO(bytes(data))).load()
+    return np.asarray(legacy, dtype=np.float32)
 
 def get_current_datetime():
     return datetime.utcnow()
@@ -28,6 +86,17 @@ class User(UserMixin, db.Model):
     # Relationships
     categories = db.relationship('JobCategory', backref='creator', lazy=True, cascade='all, delete-orphan')
     supervisor_profile = db.relationship('Supervisor', backref='user', uselist=False, cascade='all, delete-orphan')
+    report_jobs = db.relationship('ReportJob', backref='requested_by', lazy=True, cascade='all, delete-orphan')
+
+    # Same interface as app_cache.CachedUser, which load_user returns
+    @property
+    def supervisor_id(self):
+        return self.supervisor_profile.id if self.supervisor_profile else None
+
+    @property
+    def scope(self):
+        from supervisor_scope import supervisor_scopes
+        return supervisor_scopes.get(self.supervisor_id) if self.supervisor_id is not None else None
 
 class CompanyProfile(db.Model):
     __tablename__ = 'company_profile'
@@ -55,7 +124,9 @@ class JobTitle(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    category_id = db.Column(db.Integer, db.ForeignKey('job_categories.id'), nullable=False)
+    # active_history: the rollup hooks need the old value even when the attribute was expired
+    category_id = db.column_property(db.Column(db.Integer, db.ForeignKey('job_categories.id'), nullable=False, index=True),
+                                     active_history=True)
     created_at = db.Column(db.DateTime, default=get_current_datetime)
     
     # Relationships
@@ -79,11 +150,14 @@ class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_number = db.Column(db.String(50), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    job_title_id = db.Column(db.Integer, db.ForeignKey('job_titles.id'))
+    # active_history: the rollup hooks need the old value even when the attribute was expired
+    job_title_id = db.column_property(db.Column(db.Integer, db.ForeignKey('job_titles.id'), index=True),
+                                      active_history=True)
     address = db.Column(db.Text)
     contact_number = db.Column(db.String(20))
     email = db.Column(db.String(120))
-    supervisor_id = db.Column(db.Integer, db.ForeignKey('supervisors.id'))
+    supervisor_id = db.column_property(db.Column(db.Integer, db.ForeignKey('supervisors.id'), index=True),
+                                       active_history=True)
     face_encoding = db.Column(LargeBinary)  # Store face encoding as binary data
     face_image_filename = db.Column(db.String(255))  # Store face image filename
     created_at = db.Column(db.DateTime, default=get_current_datetime)
@@ -95,20 +169,91 @@ class Employee(db.Model):
     def set_face_encoding(self, encoding):
         """Store face encoding as binary data"""
         if encoding is not None:
-            self.face_encoding = pickle.dumps(encoding)
+            self.face_encoding = pack_face_encoding(encoding)
     
     def get_face_encoding(self):
         """Retrieve face encoding from binary data"""
         if self.face_encoding:
-            return pickle.loads(self.face_encoding)
+            return unpack_face_encoding(self.face_encoding)
         return None
 
+def current_xact_id(dialect):
+    """SQL for the writing transaction's id on PostgreSQL, None elsewhere"""
+    if dialect == 'postgresql':
+        return literal_column('pg_current_xact_id()::text::bigint')
+    return None
+
+class ChangeLog:
+    """Append-only change log that readers follow with a watermark
+
+    Sequence ids are handed out in insert order, not commit order, so a
+    reader that resumed after the highest id it saw would skip rows of a
+    transaction that was still open. On PostgreSQL each row therefore
+    records its writer's transaction id and the watermark is a transaction
+    id: every transaction below it has finished, and readers only take rows
+    below pg_snapshot_xmin(pg_current_snapshot()), whose set can no longer
+    change. SQLite serializes writers, so there ids do commit in order and
+    the watermark is the last id read.
+    """
+
+    xid = db.Column(db.BigInteger, index=True)
+
+    @staticmethod
+    def _postgresql():
+        return db.engine.dialect.name == 'postgresql'
+
+    @classmethod
+    def latest_watermark(cls):
+        """Watermark covering every change committed so far"""
+        if cls._postgresql():
+            return db.session.execute(text('SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint')).scalar()
+        return db.session.query(func.max(cls.id)).scalar() or 0
+
+    @classmethod
+    def changes_since(cls, watermark, limit=None):
+        """Return (changes, next_watermark, has_more) for the changes after a watermark
+
+        With a limit, a page on PostgreSQL never splits a transaction's
+        changes; one transaction with more changes than the limit is
+        returned whole.
+        """
+        if not cls._postgresql():
+            query = cls.query.filter(cls.id > watermark).order_by(cls.id)
+            changes = query.limit(limit + 1).all() if limit else query.all()
+            has_more = limit is not None and len(changes) > limit
+            changes = changes[:limit] if has_more else changes
+            return changes, changes[-1].id if changes else watermark, has_more
+
+        horizon = cls.latest_watermark()
+        query = cls.query.filter(cls.xid >= watermark, cls.xid < horizon).order_by(cls.xid, cls.id)
+        changes = query.limit(limit + 1).all() if limit else query.all()
+        if not limit or len(changes) <= limit:
+            return changes, max(horizon, watermark), False
+
+        # Stop before the transaction the page would split
+        boundary = changes[limit].xid
+        changes = [change for change in changes[:limit] if change.xid != boundary]
+        if changes:
+            return changes, boundary, True
+        return query.filter(cls.xid == boundary).all(), boundary + 1, True
+
+class EmployeeEncodingChange(ChangeLog, db.Model):
+    """Append-only log of face encoding changes; its watermark is the gallery generation"""
+    __tablename__ = 'employee_encoding_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    employee_id = db.Column(db.Integer, nullable=False, index=True)
+    operation = db.Column(db.String(10), nullable=False)  # 'upsert', 'delete'
+    created_at = db.Column(db.DateTime, default=get_current_datetime)
+
 class Attendance(db.Model):
     __tablename__ = 'attendance'
     
     id = db.Column(db.Integer, primary_key=True)
-    employee_id = db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False)
-    date = db.Column(db.Date, nullable=False, default=get_current_date)
+    # active_history: the change log, rollup and bitmap hooks need the old values even when expired
+    employee_id = db.column_property(db.Column(db.Integer, db.ForeignKey('employees.id'), nullable=False),
+                                     active_history=True)
+    date = db.column_property(db.Column(db.Date, nullable=False, default=get_current_date), active_history=True)
     time = db.Column(db.Time, nullable=False, default=get_current_time)
     datetime = db.Column(db.DateTime, nullable=False, default=get_current_datetime)
     latitude = db.Column(db.Float)
@@ -116,8 +261,134 @@ class Attendance(db.Model):
     marked_by_id = db.Column(db.Integer, db.ForeignKey('supervisors.id'))
     created_at = db.Column(db.DateTime, default=get_current_datetime)
     
-    # Add constraint to prevent duplicate attendance per day
-    __table_args__ = (db.UniqueConstraint('employee_id', 'date', name='unique_daily_attendance'),)
+    # Add constraint to prevent duplicate attendance per day; the indexes
+    # serve per-day counts, the range API's (date, time, id) keyset order
+    # and the dashboard's most-recent list
+    __table_args__ = (
+        db.UniqueConstraint('employee_id', 'date', name='unique_daily_attendance'),
+        db.Index('ix_attendance_date_time_id', 'date', 'time', 'id'),
+        db.Index('ix_attendance_datetime', 'datetime'),
+    )
+
+class AttendanceChange(ChangeLog, db.Model):
+    """Append-only log of attendance inserts, updates and deletes, followed by the .NET sync"""
+    __tablename__ = 'attendance_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    attendance_id = db.Column(db.Integer, nullable=False)
+    employee_id = db.Column(db.Integer, nullable=False)
+    employee_number = db.Column(db.String(50))
+    date = db.Column(db.Date, nullable=False, index=True)
+    operation = db.Column(db.String(10), nullable=False)  # 'upsert', 'delete'
+    created_at = db.Column(db.DateTime, default=get_current_datetime)
+
+class AttendanceArchive(db.Model):
+    """Cold storage for attendance rows of archived months, with the same columns as Attendance
+
+    Rows keep their original ids. Only the date index is kept, since cold
+    reads are whole-range report scans.
+    """
+    __tablename__ = 'attendance_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    employee_id = db.Column(db.Integer, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    time = db.Column(db.Time, nullable=False)
+    datetime = db.Column(db.DateTime, nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    marked_by_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime)
+
+class ArchivedMonth(db.Model):
+    """Months whose attendance rows have moved to attendance_archive"""
+    __tablename__ = 'archived_months'
+
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    row_count = db.Column(db.Integer, nullable=False)
+    archived_at = db.Column(db.DateTime, default=get_current_datetime)
+
+class AttendanceDailyRollup(db.Model):
+    """Attendance counts per day, category and supervisor, maintained by the Attendance hooks
+
+    Rows are attributed to the employee's current category and supervisor;
+    the Employee and JobTitle hooks move an employee's counts when either
+    changes, so the rollup always matches a rebuild. Employees without a
+    job title or supervisor are counted under id 0.
+    """
+    __tablename__ = 'attendance_daily_rollup'
+
+    NONE_ID = 0
+
+    date = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    supervisor_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def total(cls, attendance_date=None, supervisor_id=None, category_ids=None):
+        """Attendance count for a day (all time if None), optionally limited to a supervisor's scope
+
+        All-time counts are read from AttendanceRollupTotal, so they cost
+        one row per bucket however much history exists.
+        """
+        model = cls if attendance_date is not None else AttendanceRollupTotal
+        query = db.session.query(func.coalesce(func.sum(model.count), 0))
+        if attendance_date is not None:
+            query = query.filter(cls.date == attendance_date)
+        if supervisor_id is not None:
+            query = query.filter(or_(
+                model.supervisor_id == supervisor_id,
+                model.category_id.in_(category_ids or [])
+            ))
+        return query.scalar()
+
+class AttendanceRollupTotal(db.Model):
+    """All-time attendance counts per category and supervisor, kept alongside AttendanceDailyRollup"""
+    __tablename__ = 'attendance_rollup_totals'
+
+    category_id = db.Column(db.Integer, primary_key=True)
+    supervisor_id = db.Column(db.Integer, primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ReportJob(db.Model):
+    """A report rendered in the background; finished artifacts are shared by cache_key"""
+    __tablename__ = 'report_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    report_type = db.Column(db.String(10), nullable=False)  # 'csv', 'pdf'
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    supervisor_id = db.Column(db.Integer)
+    category_id = db.Column(db.Integer)
+    job_title_id = db.Column(db.Integer)
+    data_version = db.Column(db.String(64), nullable=False)  # report_data_version() when submitted
+    cache_key = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'done', 'failed'
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    pages_rendered = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=get_current_datetime)
+    heartbeat_at = db.Column(db.DateTime, default=get_current_datetime)  # Last sign of life from the worker
+    finished_at = db.Column(db.DateTime)
+
+class AttendanceMonth(db.Model):
+    """Days present per employee and month as a bitmap, maintained by the Attendance hooks
+
+    Bit ``day - 1`` of ``days`` is set when the employee has attendance on
+    that day, so a month fits a 32-bit integer and days present is its
+    popcount. Archiving attendance leaves the bitmaps in place.
+    """
+    __tablename__ = 'attendance_months'
+
+    month = db.Column(db.Date, primary_key=True)  # First day of the month
+    employee_id = db.Column(db.Integer, primary_key=True)
+    days = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def day_bit(day):
+        return 1 << (day.day - 1)
 
 # Association table for supervisor-category access
 supervisor_categories = db.Table('supervisor_categories',
@@ -126,4 +397,382 @@ supervisor_categories = db.Table('supervisor_categories',
 )
 
 # Add many-to-many relationship
-Supervisor.allowed_categories = db.relationship('JobCategory', secondary=supervisor_categories, backref='supervisors')
\ No newline at end of file
+Supervisor.allowed_categories = db.relationship('JobCategory', secondary=supervisor_categories, backref='supervisors')
+
+def month_start(day):
+    return day.replace(day=1)
+
+def next_month(day):
+    return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+
+def attendance_source(start_date=None, end_date=None):
+    """Return an Attendance entity covering a date range across hot and cold storage
+
+    Ranges with no archived months get the Attendance model itself; ranges
+    lying entirely in archived months read attendance_archive only, and
+    anything else reads both through a UNION ALL, each side pre-filtered
+    to the range. The result is used like Attendance in queries.
+    """
+    archived = db.session.query(ArchivedMonth.month)
+    if start_date:
+        archived = archived.filter(ArchivedMonth.month >= month_start(start_date))
+    if end_date:
+        archived = archived.filter(ArchivedMonth.month <= end_date)
+    archived_months = {month for (month,) in archived}
+
+    if not archived_months:
+        return Attendance
+
+    def branch(table):
+        statement = select(*(table.c[column.name] for column in Attendance.__table__.columns))
+        if start_date:
+            statement = statement.where(table.c.date >= start_date)
+        if end_date:
+            statement = statement.where(table.c.date <= end_date)
+        return statement
+
+    cold = branch(AttendanceArchive.__table__)
+
+    if start_date and end_date:
+        months = set()
+        month = month_start(start_date)
+        while month <= end_date:
+            months.add(month)
+            month = next_month(month)
+        if months <= archived_months:
+            return aliased(Attendance, cold.subquery('attendance_cold'), adapt_on_names=True)
+
+    return aliased(Attendance, union_all(branch(Attendance.__table__), cold).subquery('attendance_all'),
+                   adapt_on_names=True)
+
+def load_all_encodings(dimensions=128, batch_size=1000):
+    """Stream every active employee's face encoding into one float32 matrix
+
+    Returns (ids, matrix). The column is read through a server-side cursor
+    and each row is copied straight into a preallocated matrix, so no
+    intermediate Python lists are built.
+    """
+    filters = (Employee.is_active == True, Employee.face_encoding.isnot(None))
+
+    capacity = db.session.query(func.count(Employee.id)).filter(*filters).scalar() or 0
+    ids = np.empty(capacity, dtype=np.int64)
+    matrix = np.empty((capacity, dimensions), dtype=np.float32)
+
+    result = db.session.execute(
+        select(Employee.id, Employee.face_encoding)
+        .where(*filters)
+        .order_by(Employee.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+
+    count = 0
+    for employee_id, data in result:
+        encoding = unpack_face_encoding(data)
+        if encoding.shape[0] != dimensions:
+            logging.warning(f"Skipping face encoding for employee {employee_id}: "
+                            f"expected {dimensions} features, got {encoding.shape[0]}")
+            continue
+
+        if count == capacity:
+            # Rows added since the count; grow rather than drop them
+            capacity = max(capacity * 2, 16)
+            ids = np.resize(ids, capacity)
+            matrix = np.resize(matrix, (capacity, dimensions))
+
+        ids[count] = employee_id
+        matrix[count] = encoding
+        count += 1
+
+    return ids[:count], matrix[:count]
+
+def _log_encoding_change(connection, employee_id, operation):
+    """Record a face encoding delta in the same transaction as the employee change"""
+    connection.execute(EmployeeEncodingChange.__table__.insert().values(
+        employee_id=employee_id,
+        operation=operation,
+        created_at=get_current_datetime(),
+        xid=current_xact_id(connection.dialect.name)
+    ))
+
+class CacheVersion(db.Model):
+    """Version counter of a process-level cache, shared by every worker process
+
+    Writers bump it in the same transaction as the rows the cache holds, so
+    a worker that sees a new version also sees the committed change.
+    """
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+
+def bump_cache_version(connection, name):
+    """Increment a shared cache version, creating it if missing"""
+    table = CacheVersion.__table__
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table)
+        connection.execute(
+            insert_stmt.values(name=name, version=1).on_conflict_do_update(
+                index_elements=[table.c.name],
+                set_={'version': table.c.version + 1}
+            )
+        )
+        return
+
+    result = connection.execute(
+        table.update().where(table.c.name == name).values(version=table.c.version + 1)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(name=name, version=1))
+
+def _count_upsert(connection, table, values, delta):
+    """Add delta to the count of the row keyed by values, creating it if missing"""
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table)
+        connection.execute(
+            insert_stmt.values(count=delta, **values).on_conflict_do_update(
+                index_elements=[table.c[key] for key in values],
+                set_={'count': table.c.count + delta}
+            )
+        )
+        return
+
+    result = connection.execute(
+        table.update()
+        .where(*(table.c[key] == value for key, value in values.items()))
+        .values(count=table.c.count + delta)
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(count=delta, **values))
+
+def _rollup_upsert(connection, values, delta):
+    """Add delta to a day's rollup row and to its bucket's all-time total"""
+    _count_upsert(connection, AttendanceDailyRollup.__table__, values, delta)
+    _count_upsert(connection, AttendanceRollupTotal.__table__, {
+        'category_id': values['category_id'], 'supervisor_id': values['supervisor_id']
+    }, delta)
+
+def adjust_attendance_rollup(connection, employee_id, attendance_date, delta):
+    """Add delta to the day's rollup row for an employee's current category and supervisor"""
+    row = connection.execute(
+        select(JobTitle.category_id, Employee.supervisor_id)
+        .select_from(Employee)
+        .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id)
+        .where(Employee.id == employee_id)
+    ).first()
+    _rollup_upsert(connection, {
+        'date': attendance_date,
+        'category_id': (row.category_id if row else None) or AttendanceDailyRollup.NONE_ID,
+        'supervisor_id': (row.supervisor_id if row else None) or AttendanceDailyRollup.NONE_ID
+    }, delta)
+
+def move_attendance_rollup(connection, *criteria, **previous):
+    """Move the rollup counts of employees matching criteria from their previous buckets to their current ones
+
+    Called after an employee's job title or supervisor, or a job title's
+    category, has been updated. ``previous`` holds the old ``category_id``
+    and/or ``supervisor_id``; a key left out did not change. Hot and
+    archived attendance are both counted.
+    """
+    category_id = func.coalesce(JobTitle.category_id, AttendanceDailyRollup.NONE_ID)
+    supervisor_id = func.coalesce(Employee.supervisor_id, AttendanceDailyRollup.NONE_ID)
+
+    for table in (Attendance.__table__, AttendanceArchive.__table__):
+        rows = connection.execute(
+            select(table.c.date, category_id, supervisor_id, func.count())
+            .select_from(table)
+            .join(Employee, table.c.employee_id == Employee.id)
+            .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id)
+            .where(*criteria)
+            .group_by(table.c.date, category_id, supervisor_id)
+        ).all()
+        for attendance_date, current_category, current_supervisor, count in rows:
+            old_category = previous.get('category_id', current_category) or AttendanceDailyRollup.NONE_ID
+            old_supervisor = previous.get('supervisor_id', current_supervisor) or AttendanceDailyRollup.NONE_ID
+            if (old_category, old_supervisor) == (current_category, current_supervisor):
+                continue
+            _rollup_upsert(connection, {
+                'date': attendance_date, 'category_id': old_category, 'supervisor_id': old_supervisor
+            }, -count)
+            _rollup_upsert(connection, {
+                'date': attendance_date, 'category_id': current_category, 'supervisor_id': current_supervisor
+            }, count)
+
+def remove_attendance_from_rollup(connection, *criteria, table=Attendance):
+    """Subtract every attendance row matching criteria from the rollup, before a bulk delete"""
+    rows = connection.execute(
+        select(table.employee_id, table.date, func.count())
+        .where(*criteria)
+        .group_by(table.employee_id, table.date)
+    ).all()
+    for employee_id, attendance_date, count in rows:
+        adjust_attendance_rollup(connection, employee_id, attendance_date, -count)
+
+def mark_attendance_day(connection, employee_id, attendance_date):
+    """Set the day's bit in the employee's monthly bitmap, creating the month if missing"""
+    table = AttendanceMonth.__table__
+    values = {'month': month_start(attendance_date), 'employee_id': employee_id}
+    bit = AttendanceMonth.day_bit(attendance_date)
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        insert_stmt = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table)
+        connection.execute(
+            insert_stmt.values(days=bit, **values).on_conflict_do_update(
+                index_elements=[table.c.month, table.c.employee_id],
+                set_={'days': table.c.days.op('|')(bit)}
+            )
+        )
+        return
+
+    result = connection.execute(
+        table.update()
+        .where(table.c.month == values['month'], table.c.employee_id == employee_id)
+        .values(days=table.c.days.op('|')(bit))
+    )
+    if result.rowcount == 0:
+        connection.execute(table.insert().values(days=bit, **values))
+
+def clear_attendance_day(connection, employee_id, attendance_date):
+    """Clear the day's bit in the employee's monthly bitmap"""
+    table = AttendanceMonth.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.month == month_start(attendance_date), table.c.employee_id == employee_id)
+        .values(days=table.c.days.op('&')(~AttendanceMonth.day_bit(attendance_date)))
+    )
+
+def log_attendance_change(connection, attendance_id, employee_id, attendance_date, operation):
+    """Record an attendance delta in the same transaction as the attendance change"""
+    employee_number = connection.execute(
+        select(Employee.employee_number).where(Employee.id == employee_id)
+    ).scalar()
+    connection.execute(AttendanceChange.__table__.insert().values(
+        attendance_id=attendance_id,
+        employee_id=employee_id,
+        employee_number=employee_number,
+        date=attendance_date,
+        operation=operation,
+        created_at=get_current_datetime(),
+        xid=current_xact_id(connection.dialect.name)
+    ))
+
+def log_attendance_deletes(connection, *criteria, table=Attendance):
+    """Record deletes for every attendance row matching criteria, before a bulk delete"""
+    rows = select(
+        table.id,
+        table.employee_id,
+        Employee.employee_number,
+        table.date,
+        literal('delete'),
+        literal(get_current_datetime()),
+        current_xact_id(connection.dialect.name)
+    ).join(Employee, table.employee_id == Employee.id).where(*criteria).order_by(table.id)
+
+    connection.execute(AttendanceChange.__table__.insert().from_select(
+        ['attendance_id', 'employee_id', 'employee_number', 'date', 'operation', 'created_at', 'xid'],
+        rows
+    ))
+
+def insert_attendance_once(connection, values):
+    """Insert an attendance row unless the employee already has one for that date
+
+    Runs as a single INSERT ... ON CONFLICT (employee_id, date) DO NOTHING
+    RETURNING id and returns the new id, or None if the day was already
+    marked. Core statements skip the mapper hooks, so the change log,
+    rollup and monthly bitmap are written here in the same transaction.
+    """
+    table = Attendance.__table__
+    dialect = connection.dialect.name
+
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (pg_insert if dialect == 'postgresql' else sqlite_insert)(table).values(**values) \
+            .on_conflict_do_nothing(index_elements=[table.c.employee_id, table.c.date]) \
+            .returning(table.c.id)
+        attendance_id = connection.execute(statement).scalar()
+    else:
+        # Other databases: let the unique constraint reject the duplicate
+        try:
+            with connection.begin_nested():
+                attendance_id = connection.execute(table.insert().values(**values).returning(table.c.id)).scalar()
+        except IntegrityError:
+            attendance_id = None
+
+    if attendance_id is not None:
+        log_attendance_change(connection, attendance_id, values['employee_id'], values['date'], 'upsert')
+        adjust_attendance_rollup(connection, values['employee_id'], values['date'], 1)
+        mark_attendance_day(connection, values['employee_id'], values['date'])
+    return attendance_id
+
+@event.listens_for(Employee, 'after_insert')
+def employee_inserted(mapper, connection, target):
+    if target.face_encoding is not None and target.is_active is not False:
+        _log_encoding_change(connection, target.id, 'upsert')
+
+@event.listens_for(Employee, 'after_update')
+def employee_updated(mapper, connection, target):
+    state = inspect(target)
+
+    old_job_title = state.attrs.job_title_id.history.deleted
+    old_supervisor = state.attrs.supervisor_id.history.deleted
+    if old_job_title or old_supervisor:
+        previous = {}
+        if old_job_title:
+            previous['category_id'] = connection.execute(
+                select(JobTitle.category_id).where(JobTitle.id == old_job_title[0])
+            ).scalar() if old_job_title[0] is not None else None
+        if old_supervisor:
+            previous['supervisor_id'] = old_supervisor[0]
+        move_attendance_rollup(connection, Employee.id == target.id, **previous)
+
+    if not (state.attrs.face_encoding.history.has_changes() or
+            state.attrs.is_active.history.has_changes()):
+        return
+
+    if target.face_encoding is not None and target.is_active:
+        _log_encoding_change(connection, target.id, 'upsert')
+    else:
+        _log_encoding_change(connection, target.id, 'delete')
+
+@event.listens_for(JobTitle, 'after_update')
+def job_title_updated(mapper, connection, target):
+    old_category = inspect(target).attrs.category_id.history.deleted
+    if old_category:
+        move_attendance_rollup(connection, Employee.job_title_id == target.id, category_id=old_category[0])
+
+@event.listens_for(Employee, 'after_delete')
+def employee_deleted(mapper, connection, target):
+    _log_encoding_change(connection, target.id, 'delete')
+
+@event.listens_for(Attendance, 'after_insert')
+def attendance_inserted(mapper, connection, target):
+    log_attendance_change(connection, target.id, target.employee_id, target.date, 'upsert')
+    adjust_attendance_rollup(connection, target.employee_id, target.date, 1)
+    mark_attendance_day(connection, target.employee_id, target.date)
+
+@event.listens_for(Attendance, 'after_update')
+def attendance_updated(mapper, connection, target):
+    state = inspect(target)
+    if not any(attr.history.has_changes() for attr in state.attrs):
+        return
+
+    log_attendance_change(connection, target.id, target.employee_id, target.date, 'upsert')
+
+    old_date = state.attrs.date.history.deleted
+    old_employee = state.attrs.employee_id.history.deleted
+    if old_date or old_employee:
+        previous_employee = old_employee[0] if old_employee else target.employee_id
+        previous_date = old_date[0] if old_date else target.date
+        adjust_attendance_rollup(connection, previous_employee, previous_date, -1)
+        adjust_attendance_rollup(connection, target.employee_id, target.date, 1)
+        clear_attendance_day(connection, previous_employee, previous_date)
+        mark_attendance_day(connection, target.employee_id, target.date)
+
+@event.listens_for(Attendance, 'after_delete')
+def attendance_deleted(mapper, connection, target):
+    log_attendance_change(connection, target.id, target.employee_id, target.date, 'delete')
+    adjust_attendance_rollup(connection, target.employee_id, target.date, -1)
+    clear_attendance_day(connection, target.employee_id, target.date)
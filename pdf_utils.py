@@ -0,0 +1,84 @@
+"""
+Paged table layout for PDF reports
+"""
+import itertools
+import os
+from tempfile import SpooledTemporaryFile
+
+from reportlab.lib import colors
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+# Rows per table; one full chunk fits an A4 page, so each table is laid out once
+PDF_TABLE_ROWS = 36
+
+# PDFs up to this size stay in memory, larger ones spill to a temporary file
+PDF_SPOOL_MAX_BYTES = int(os.environ.get('PDF_SPOOL_MAX_BYTES', 8 * 1024 * 1024))
+
+REPORT_TABLE_HEADER = ['Date', 'Time', 'Employee', 'Number', 'Job Title', 'Category', 'Supervisor']
+# Fixed column widths (points) filling the A4 frame
+REPORT_COLUMN_WIDTHS = [58, 46, 78, 50, 72, 64, 83]
+
+# Shared by every page table, so the style commands are parsed once per process
+REPORT_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 6),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 1), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.black)
+])
+
+def spooled_pdf_file():
+    """File object for doc.build, kept in memory up to PDF_SPOOL_MAX_BYTES"""
+    return SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_BYTES)
+
+def fit_text(value, max_chars):
+    """Clip a cell value so it cannot spill over a fixed-width column"""
+    text = str(value) if value is not None else 'N/A'
+    return text[:max_chars] + '...' if len(text) > max_chars else text
+
+def paged_tables(header, rows, col_widths, rows_per_table=PDF_TABLE_ROWS):
+    """Yield fixed-width tables of at most ``rows_per_table`` rows each
+
+    Fixed column widths keep every page aligned and spare reportlab from
+    measuring each cell; a table that still overflows its frame (the first
+    one, below the title) splits with the header repeated.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == rows_per_table:
+            yield Table([header] + chunk, colWidths=col_widths, repeatRows=1, style=REPORT_TABLE_STYLE)
+            chunk = []
+    if chunk:
+        yield Table([header] + chunk, colWidths=col_widths, repeatRows=1, style=REPORT_TABLE_STYLE)
+
+class StreamingDocTemplate(SimpleDocTemplate):
+    """SimpleDocTemplate whose build() lays out flowables from any iterable
+
+    The story handed to reportlab is a plain list holding at most
+    ``lookahead`` flowables; it is topped up from the iterable after each
+    flowable is handled, so the rest of the report is never held in memory
+    at once.
+    """
+
+    lookahead = 2
+
+    def build(self, flowables, **kwargs):
+        self._pending = iter(flowables)
+        self._story = []
+        self._refill()
+        super().build(self._story, **kwargs)
+
+    def handle_flowable(self, flowables):
+        super().handle_flowable(flowables)
+        # reportlab also handles its own pending page-begin actions here
+        if flowables is self._story:
+            self._refill()
+
+    def _refill(self):
+        self._story.extend(itertools.islice(self._pending, max(0, self.lookahead - len(self._story))))
@@ -1,5 +1,6 @@
 import pandas as pd
 import io
+import itertools
 import os
 from datetime import datetime, timedelta
 from reportlab.lib import colors
@@ -7,10 +8,17 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from models import Attendance, Employee, JobCategory, JobTitle, Supervisor, CompanyProfile
-from sqlalchemy import and_, or_
+from models import Attendance, Employee, JobCategory, JobTitle, Supervisor, CompanyProfile, attendance_source
+from sqlalchemy import and_, distinct, func, or_
+from sqlalchemy.orm import aliased
+from app import db
+from pdf_utils import PDF_TABLE_ROWS, StreamingDocTemplate, fit_text, paged_tables, spooled_pdf_file
 import logging
 
+PDF_TABLE_HEADER = ['Date', 'Time', 'Emp. No.', 'Employee Name', 'Job Title', 'Category']
+# Fixed column widths (points) filling the A4 frame
+PDF_COLUMN_WIDTHS = [62, 52, 62, 100, 90, 85]
+
 class ReportGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
@@ -22,46 +30,78 @@ class ReportGenerator:
             alignment=1  # Center alignment
         )
     
+    def attendance_query(self, start_date=None, end_date=None, supervisor_id=None,
+                         category_id=None, job_title_id=None):
+        """Filtered attendance joined to employee, job title and category
+
+        Returns the query and the attendance source it reads from, for
+        callers to pick columns with ``with_entities``.
+        """
+        # Read from hot and/or archived attendance depending on the range
+        attendance = attendance_source(start_date, end_date)
+        query = db.session.query(attendance).select_from(attendance) \
+            .join(Employee, attendance.employee_id == Employee.id) \
+            .join(JobTitle, Employee.job_title_id == JobTitle.id) \
+            .join(JobCategory, JobTitle.category_id == JobCategory.id)
+        
+        # Apply date filters
+        if start_date:
+            query = query.filter(attendance.date >= start_date)
+        if end_date:
+            query = query.filter(attendance.date <= end_date)
+        
+        # Supervisors always pass their own id; superusers may pick one
+        if supervisor_id:
+            query = query.filter(Employee.supervisor_id == supervisor_id)
+        
+        # Apply category filter
+        if category_id:
+            query = query.filter(JobTitle.category_id == category_id)
+        
+        # Apply job title filter
+        if job_title_id:
+            query = query.filter(Employee.job_title_id == job_title_id)
+        
+        return query, attendance
+    
+    def attendance_records(self, start_date=None, end_date=None, supervisor_id=None,
+                           category_id=None, job_title_id=None):
+        """Report rows of the filtered attendance, newest first, as a query to stream or fetch"""
+        query, attendance = self.attendance_query(start_date, end_date, supervisor_id,
+                                                  category_id, job_title_id)
+        marked_by = aliased(Supervisor)
+        return query \
+            .outerjoin(marked_by, attendance.marked_by_id == marked_by.id) \
+            .with_entities(
+                attendance.date,
+                attendance.time,
+                Employee.employee_number,
+                Employee.name,
+                JobTitle.name.label('job_title'),
+                JobCategory.name.label('category'),
+                marked_by.full_name.label('supervisor'),
+                attendance.latitude,
+                attendance.longitude
+            ) \
+            .order_by(attendance.date.desc(), attendance.time.desc())
+    
     def get_attendance_data(self, start_date=None, end_date=None, supervisor_id=None, 
                           category_id=None, job_title_id=None, user_role='superuser'):
         """Get filtered attendance data"""
         try:
-            query = Attendance.query.join(Employee).join(JobTitle).join(JobCategory)
-            
-            # Apply date filters
-            if start_date:
-                query = query.filter(Attendance.date >= start_date)
-            if end_date:
-                query = query.filter(Attendance.date <= end_date)
-            
-            # Apply role-based filters
-            if user_role != 'superuser' and supervisor_id:
-                query = query.filter(Employee.supervisor_id == supervisor_id)
-            
-            # Apply category filter
-            if category_id:
-                query = query.filter(JobTitle.category_id == category_id)
-            
-            # Apply job title filter
-            if job_title_id:
-                query = query.filter(Employee.job_title_id == job_title_id)
-            
-            # Apply supervisor filter (for superuser)
-            if user_role == 'superuser' and supervisor_id:
-                query = query.filter(Employee.supervisor_id == supervisor_id)
-            
-            attendance_records = query.order_by(Attendance.date.desc(), Attendance.time.desc()).all()
+            attendance_records = self.attendance_records(start_date, end_date, supervisor_id,
+                                                         category_id, job_title_id).all()
             
             data = []
             for record in attendance_records:
                 data.append({
                     'Date': record.date.strftime('%Y-%m-%d'),
                     'Time': record.time.strftime('%H:%M:%S'),
-                    'Employee Number': record.employee.employee_number,
-                    'Employee Name': record.employee.name,
-                    'Job Title': record.employee.job_title.name if record.employee.job_title else 'N/A',
-                    'Category': record.employee.job_title.category.name if record.employee.job_title else 'N/A',
-                    'Supervisor': record.marked_by_supervisor.full_name if record.marked_by_supervisor else 'N/A',
+                    'Employee Number': record.employee_number,
+                    'Employee Name': record.name,
+                    'Job Title': record.job_title,
+                    'Category': record.category,
+                    'Supervisor': record.supervisor or 'N/A',
                     'Latitude': record.latitude if record.latitude else 'N/A',
                     'Longitude': record.longitude if record.longitude else 'N/A'
                 })
@@ -97,17 +137,38 @@ class ReportGenerator:
     
     def generate_pdf_report(self, start_date=None, end_date=None, supervisor_id=None,
                            category_id=None, job_title_id=None, user_role='superuser'):
-        """Generate PDF report"""
+        """Generate PDF report as a rewound file object
+
+        Rows are streamed from the database into page-sized tables that
+        doc.build lays out as it reaches them.
+        """
         try:
-            data = self.get_attendance_data(start_date, end_date, supervisor_id,
-                                          category_id, job_title_id, user_role)
-            
-            if not data:
+            records = self.attendance_records(start_date, end_date, supervisor_id,
+                                              category_id, job_title_id)
+            rows_read = 0
+            
+            def rows():
+                nonlocal rows_read
+                for record in records.yield_per(PDF_TABLE_ROWS * 10):
+                    rows_read += 1
+                    yield [
+                        record.date.strftime('%Y-%m-%d'),
+                        record.time.strftime('%H:%M:%S'),
+                        record.employee_number,
+                        fit_text(record.name, 15),
+                        fit_text(record.job_title, 12),
+                        fit_text(record.category, 10)
+                    ]
+            
+            # Page-sized tables sharing one style, built as doc.build reaches them
+            tables = paged_tables(PDF_TABLE_HEADER, rows(), PDF_COLUMN_WIDTHS)
+            first_table = next(tables, None)
+            if first_table is None:
                 return None, "No attendance records found for the selected criteria"
             
-            # Create PDF buffer
-            pdf_buffer = io.BytesIO()
-            doc = SimpleDocTemplate(pdf_buffer, pagesize=A4)
+            # Spool the PDF to disk once it outgrows PDF_SPOOL_MAX_BYTES
+            pdf_file = spooled_pdf_file()
+            doc = StreamingDocTemplate(pdf_file, pagesize=A4, pageCompression=1)
             story = []
             
             # Get company profile
@@ -137,73 +198,54 @@ class ReportGenerator:
                                self.styles['Normal'])
             story.append(gen_date)
             story.append(Spacer(1, 20))
+            story.append(first_table)
             
-            # Create table data
-            table_data = [['Date', 'Time', 'Emp. No.', 'Employee Name', 'Job Title', 'Category']]
-            
-            for record in data:
-                table_data.append([
-                    record['Date'],
-                    record['Time'],
-                    record['Employee Number'],
-                    record['Employee Name'][:15] + '...' if len(record['Employee Name']) > 15 else record['Employee Name'],
-                    record['Job Title'][:12] + '...' if len(record['Job Title']) > 12 else record['Job Title'],
-                    record['Category'][:10] + '...' if len(record['Category']) > 10 else record['Category']
-                ])
-            
-            # Create table
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('FONTNAME', (0, 1), (-1, -1), 'Helvetica'),
-                ('FONTSIZE', (0, 1), (-1, -1), 8),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            
-            story.append(table)
-            
-            # Add summary
-            story.append(Spacer(1, 20))
-            summary = Paragraph(f"Total Records: {len(data)}", self.styles['Normal'])
-            story.append(summary)
+            # Add summary, once every row has been read
+            def summary():
+                yield Spacer(1, 20)
+                yield Paragraph(f"Total Records: {rows_read}", self.styles['Normal'])
             
             # Build PDF
-            doc.build(story)
-            pdf_content = pdf_buffer.getvalue()
-            pdf_buffer.close()
+            doc.build(itertools.chain(story, tables, summary()))
+            pdf_file.seek(0)
             
-            return pdf_content, None
+            return pdf_file, None
             
         except Exception as e:
             logging.error(f"Error generating PDF report: {str(e)}")
             return None, f"Error generating PDF report: {str(e)}"
     
     def get_attendance_summary(self, start_date=None, end_date=None, supervisor_id=None, user_role='superuser'):
-        """Get attendance summary statistics"""
+        """Get attendance summary statistics with one aggregate query"""
         try:
-            data = self.get_attendance_data(start_date, end_date, supervisor_id, user_role=user_role)
-            
-            if not data:
+            query, attendance = self.attendance_query(start_date, end_date, supervisor_id)
+            totals = query.with_entities(
+                func.count().label('total_records'),
+                func.count(distinct(attendance.employee_id)).label('unique_employees'),
+                func.count(distinct(JobTitle.category_id)).label('categories'),
+                func.min(attendance.date).label('first_date'),
+                func.max(attendance.date).label('last_date'),
+                func.min(attendance.time).label('first_check_in'),
+                func.max(attendance.time).label('last_check_in')
+            ).one()
+            
+            if not totals.total_records:
                 return {
                     'total_records': 0,
                     'unique_employees': 0,
                     'categories': 0,
-                    'date_range': 'No data'
+                    'date_range': 'No data',
+                    'first_check_in': None,
+                    'last_check_in': None
                 }
             
-            df = pd.DataFrame(data)
-            
             summary = {
-                'total_records': len(df),
-                'unique_employees': df['Employee Number'].nunique(),
-                'categories': df['Category'].nunique(),
-                'date_range': f"{df['Date'].min()} to {df['Date'].max()}" if len(df) > 0 else 'No data'
+                'total_records': totals.total_records,
+                'unique_employees': totals.unique_employees,
+                'categories': totals.categories,
+                'date_range': f"{totals.first_date} to {totals.last_date}",
+                'first_check_in': totals.first_check_in,
+                'last_check_in': totals.last_check_in
             }
             
             return summary
@@ -214,8 +256,74 @@ class ReportGenerator:
                 'total_records': 0,
                 'unique_employees': 0,
                 'categories': 0,
-                'date_range': 'Error'
+                'date_range': 'Error',
+                'first_check_in': None,
+                'last_check_in': None
             }
+    
+    def get_employee_summary(self, start_date=None, end_date=None, supervisor_id=None,
+                             category_id=None, job_title_id=None, user_role='superuser'):
+        """Days present and first/last check-in per employee, as a DataFrame"""
+        try:
+            query, attendance = self.attendance_query(start_date, end_date, supervisor_id,
+                                                      category_id, job_title_id)
+            rows = query.with_entities(
+                Employee.employee_number,
+                Employee.name,
+                func.count(distinct(attendance.date)),
+                func.count(),
+                func.min(attendance.time),
+                func.max(attendance.time)
+            ).group_by(Employee.id, Employee.employee_number, Employee.name) \
+             .order_by(Employee.employee_number).all()
+            
+            return summary_frame(rows, ['Employee Number', 'Employee Name', 'Days Present', 'Records',
+                                        'First Check-in', 'Last Check-in'])
+        except Exception as e:
+            logging.error(f"Error getting employee summary: {str(e)}")
+            return pd.DataFrame()
+    
+    def get_category_summary(self, start_date=None, end_date=None, supervisor_id=None,
+                             category_id=None, job_title_id=None, user_role='superuser'):
+        """Attendance records and employees present per category, as a DataFrame"""
+        try:
+            query, attendance = self.attendance_query(start_date, end_date, supervisor_id,
+                                                      category_id, job_title_id)
+            rows = query.with_entities(
+                JobCategory.name,
+                func.count(),
+                func.count(distinct(attendance.employee_id))
+            ).group_by(JobCategory.id, JobCategory.name) \
+             .order_by(JobCategory.name).all()
+            
+            return summary_frame(rows, ['Category', 'Records', 'Employees'])
+        except Exception as e:
+            logging.error(f"Error getting category summary: {str(e)}")
+            return pd.DataFrame()
+    
+    def get_daily_headcount(self, start_date=None, end_date=None, supervisor_id=None,
+                            category_id=None, job_title_id=None, user_role='superuser'):
+        """Employees present per day, as a DataFrame"""
+        try:
+            query, attendance = self.attendance_query(start_date, end_date, supervisor_id,
+                                                      category_id, job_title_id)
+            rows = query.with_entities(
+                attendance.date,
+                func.count(distinct(attendance.employee_id)),
+                func.count()
+            ).group_by(attendance.date) \
+             .order_by(attendance.date).all()
+            
+            return summary_frame(rows, ['Date', 'Headcount', 'Records'])
+        except Exception as e:
+            logging.error(f"Error getting daily headcount: {str(e)}")
+            return pd.DataFrame()
+
+def summary_frame(rows, columns):
+    """Build a DataFrame from aggregate rows through their column arrays"""
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame(dict(zip(columns, (list(values) for values in zip(*rows)))), columns=columns)
 
 # Global report generator instance
 report_generator = ReportGenerator()
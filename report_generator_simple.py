@@ -1,7 +1,9 @@
 """
 Simplified report generator without pandas dependency
 """
+import csv
 import io
+import itertools
 import os
 from datetime import datetime, timedelta
 from reportlab.lib import colors
@@ -9,10 +11,16 @@ from reportlab.lib.pagesizes import letter, A4
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
-from models import Attendance, Employee, JobCategory, JobTitle, Supervisor, CompanyProfile
+from models import Employee, JobCategory, JobTitle, Supervisor, CompanyProfile, attendance_source
 from sqlalchemy import and_, or_
+from app_cache import company_info_cache
+from pdf_utils import (PDF_TABLE_ROWS, REPORT_COLUMN_WIDTHS, REPORT_TABLE_HEADER, StreamingDocTemplate,
+                       fit_text, paged_tables, spooled_pdf_file)
 import logging
 
+# Rows per streamed CSV chunk, and per server-side cursor fetch
+CSV_CHUNK_ROWS = 500
+
 class ReportGenerator:
     def __init__(self):
         self.styles = getSampleStyleSheet()
@@ -27,28 +35,41 @@ class ReportGenerator:
     def get_attendance_data(self, start_date=None, end_date=None, supervisor_id=None, 
                           category_id=None, job_title_id=None, user_role='superuser'):
         """Get filtered attendance data"""
+        return self.attendance_data_query(start_date, end_date, supervisor_id,
+                                          category_id, job_title_id, user_role).all()
+
+    def attendance_data_query(self, start_date=None, end_date=None, supervisor_id=None,
+                              category_id=None, job_title_id=None, user_role='superuser'):
+        """Build the filtered attendance query behind every report format"""
         from app import db
         
+        # Read from hot and/or archived attendance depending on the range
+        attendance = attendance_source(start_date, end_date)
+
         # Base query
         query = db.session.query(
-            Attendance.date,
-            Attendance.time,
+            attendance.date,
+            attendance.time,
             Employee.name,
             Employee.employee_number,
             JobTitle.name.label('job_title'),
             JobCategory.name.label('category'),
             Supervisor.full_name.label('supervisor_name')
-        ).join(Employee).join(JobTitle).join(JobCategory).join(Supervisor)
-        
-        # Apply filters based on user role
-        if user_role == 'supervisor' and supervisor_id:
+        ).select_from(attendance) \
+         .join(Employee, attendance.employee_id == Employee.id) \
+         .join(JobTitle, Employee.job_title_id == JobTitle.id) \
+         .join(JobCategory, JobTitle.category_id == JobCategory.id) \
+         .join(Supervisor, Employee.supervisor_id == Supervisor.id)
+        
+        # Supervisors always pass their own id; superusers may pick one
+        if supervisor_id:
             query = query.filter(Employee.supervisor_id == supervisor_id)
         
         # Date range filter
         if start_date:
-            query = query.filter(Attendance.date >= start_date)
+            query = query.filter(attendance.date >= start_date)
         if end_date:
-            query = query.filter(Attendance.date <= end_date)
+            query = query.filter(attendance.date <= end_date)
             
         # Additional filters
         if category_id:
@@ -56,42 +77,78 @@ class ReportGenerator:
         if job_title_id:
             query = query.filter(Employee.job_title_id == job_title_id)
             
-        return query.all()
+        return query
     
     def generate_csv_report(self, start_date=None, end_date=None, supervisor_id=None,
-                           category_id=None, job_title_id=None, user_role='superuser'):
-        """Generate CSV report"""
-        data = self.get_attendance_data(start_date, end_date, supervisor_id, 
-                                      category_id, job_title_id, user_role)
-        
-        # Create CSV content
-        csv_content = "Date,Time,Employee Name,Employee Number,Job Title,Category,Supervisor\n"
-        
-        for record in data:
-            csv_content += f"{record.date},{record.time},{record.name},{record.employee_number},"
-            csv_content += f"{record.job_title},{record.category},{record.supervisor_name}\n"
-        
-        # Create in-memory file
-        output = io.StringIO()
-        output.write(csv_content)
-        output.seek(0)
-        
-        return output
+                           category_id=None, job_title_id=None, user_role='superuser', progress=None):
+        """Generate CSV report as a stream of text chunks
+
+        The header is yielded before the query runs; rows are then read from
+        a server-side cursor and flushed every CSV_CHUNK_ROWS rows, so memory
+        stays constant whatever the date range. ``progress(rows, pages)`` is
+        called after each flushed chunk.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush():
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        writer.writerow(['Date', 'Time', 'Employee Name', 'Employee Number', 'Job Title', 'Category', 'Supervisor'])
+        yield flush()
+
+        query = self.attendance_data_query(start_date, end_date, supervisor_id,
+                                           category_id, job_title_id, user_role)
+
+        rows_in_chunk = 0
+        rows_written = 0
+        for record in query.yield_per(CSV_CHUNK_ROWS):
+            writer.writerow([
+                record.date,
+                record.time,
+                record.name,
+                record.employee_number,
+                record.job_title,
+                record.category,
+                record.supervisor_name
+            ])
+            rows_in_chunk += 1
+            if rows_in_chunk == CSV_CHUNK_ROWS:
+                yield flush()
+                rows_written += rows_in_chunk
+                rows_in_chunk = 0
+                if progress:
+                    progress(rows_written, 0)
+
+        if rows_in_chunk:
+            yield flush()
+            rows_written += rows_in_chunk
+        if progress:
+            progress(rows_written, 0)
     
     def generate_pdf_report(self, start_date=None, end_date=None, supervisor_id=None,
-                           category_id=None, job_title_id=None, user_role='superuser'):
-        """Generate PDF report"""
-        data = self.get_attendance_data(start_date, end_date, supervisor_id, 
-                                      category_id, job_title_id, user_role)
-        
-        # Create in-memory file
-        buffer = io.BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=A4)
+                           category_id=None, job_title_id=None, user_role='superuser',
+                           output=None, progress=None):
+        """Generate PDF report
+
+        Rows are read from a server-side cursor into page-sized tables that
+        doc.build consumes one at a time, and the document is written to
+        ``output`` or a spooled temporary file, so large ranges render in
+        bounded memory. Returns the file, rewound for reading.
+        ``progress(rows, pages)`` is called as each page is started.
+        """
+        query = self.attendance_data_query(start_date, end_date, supervisor_id,
+                                           category_id, job_title_id, user_role)
+        
+        pdf_file = output if output is not None else spooled_pdf_file()
+        doc = StreamingDocTemplate(pdf_file, pagesize=A4, pageCompression=1)
         elements = []
         
         # Get company info
-        from app import db
-        company = db.session.query(CompanyProfile).first()
+        company = company_info_cache.get()
         company_name = company.name if company else "Company Name"
         
         # Title
@@ -105,62 +162,63 @@ class ReportGenerator:
             elements.append(Paragraph(date_info, self.styles['Normal']))
             elements.append(Spacer(1, 12))
         
-        # Create table data
-        table_data = [['Date', 'Time', 'Employee', 'Number', 'Job Title', 'Category', 'Supervisor']]
-        
-        for record in data:
-            table_data.append([
-                str(record.date),
-                str(record.time),
-                record.name,
-                record.employee_number,
-                record.job_title,
-                record.category,
-                record.supervisor_name
-            ])
+        rows_read = 0
+
+        def rows():
+            nonlocal rows_read
+            for record in query.yield_per(PDF_TABLE_ROWS * 10):
+                rows_read += 1
+                yield [
+                    str(record.date),
+                    str(record.time),
+                    fit_text(record.name, 16),
+                    fit_text(record.employee_number, 10),
+                    fit_text(record.job_title, 14),
+                    fit_text(record.category, 12),
+                    fit_text(record.supervisor_name, 14)
+                ]
+
+        def page_started(canvas, doc):
+            if progress:
+                progress(rows_read, doc.page - 1)
+
+        tables = paged_tables(REPORT_TABLE_HEADER, rows(), REPORT_COLUMN_WIDTHS)
         
-        # Create table
-        if len(table_data) > 1:
-            table = Table(table_data)
-            table.setStyle(TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ]))
-            elements.append(table)
-        else:
+        first_table = next(tables, None)
+        if first_table is None:
             elements.append(Paragraph("No attendance records found for the specified criteria.", self.styles['Normal']))
+        else:
+            elements.append(first_table)
         
         # Build PDF
-        doc.build(elements)
-        buffer.seek(0)
+        doc.build(itertools.chain(elements, tables),
+                  onFirstPage=page_started, onLaterPages=page_started)
+        pdf_file.seek(0)
+        if progress:
+            progress(rows_read, doc.page)
         
-        return buffer
+        return pdf_file
     
     def get_attendance_summary(self, start_date=None, end_date=None, supervisor_id=None, user_role='superuser'):
         """Get attendance summary statistics"""
         from app import db
         
-        # Base query for unique attendance records
-        query = db.session.query(Attendance).join(Employee)
+        # Base query for unique attendance records, hot and archived
+        attendance = attendance_source(start_date, end_date)
+        query = db.session.query(attendance).join(Employee, attendance.employee_id == Employee.id)
         
         if user_role == 'supervisor' and supervisor_id:
             query = query.filter(Employee.supervisor_id == supervisor_id)
         
         if start_date:
-            query = query.filter(Attendance.date >= start_date)
+            query = query.filter(attendance.date >= start_date)
         if end_date:
-            query = query.filter(Attendance.date <= end_date)
+            query = query.filter(attendance.date <= end_date)
         
         total_records = query.count()
         
         # Get unique employees count
-        unique_employees = query.with_entities(Attendance.employee_id).distinct().count()
+        unique_employees = query.with_entities(attendance.employee_id).distinct().count()
         
         return {
             'total_records': total_records,
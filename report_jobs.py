@@ -0,0 +1,270 @@
+"""
+Background report jobs with content-addressed artifact caching
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from sqlalchemy import func, update
+
+from app import app, db
+from models import (AttendanceChange, CompanyProfile, Employee, JobCategory, JobTitle, ReportJob, Supervisor,
+                    get_current_datetime)
+from report_generator_simple import report_generator
+
+REPORT_MIMETYPES = {'csv': 'text/csv', 'pdf': 'application/pdf'}
+
+def report_data_version(start_date=None, end_date=None):
+    """sha256 over the state of everything a report for the date range shows
+
+    Attendance is versioned by the number of change log entries dated in
+    the range: the log is append-only, so every committed insert, update or
+    delete in the range changes it, whatever order transactions commit in.
+    Employees, job titles, categories, supervisors and the company name
+    have no change log; the report columns taken from them are small, so
+    they are hashed directly.
+    """
+    changes = db.session.query(func.count(AttendanceChange.id))
+    if start_date:
+        changes = changes.filter(AttendanceChange.date >= start_date)
+    if end_date:
+        changes = changes.filter(AttendanceChange.date <= end_date)
+
+    digest = hashlib.sha256(str(changes.scalar()).encode('utf-8'))
+    for query in (
+        db.session.query(Employee.id, Employee.name, Employee.employee_number,
+                         Employee.job_title_id, Employee.supervisor_id).order_by(Employee.id),
+        db.session.query(JobTitle.id, JobTitle.name, JobTitle.category_id).order_by(JobTitle.id),
+        db.session.query(JobCategory.id, JobCategory.name).order_by(JobCategory.id),
+        db.session.query(Supervisor.id, Supervisor.full_name).order_by(Supervisor.id),
+        db.session.query(CompanyProfile.id, CompanyProfile.name).order_by(CompanyProfile.id)
+    ):
+        for row in query:
+            digest.update(repr(tuple(row)).encode('utf-8'))
+    return digest.hexdigest()
+
+def report_cache_key(report_type, start_date, end_date, supervisor_id, category_id, job_title_id, data_version):
+    """sha256 of the report parameters and the data version they were rendered at"""
+    params = [
+        report_type,
+        start_date.isoformat() if start_date else None,
+        end_date.isoformat() if end_date else None,
+        supervisor_id,
+        category_id,
+        job_title_id,
+        data_version
+    ]
+    return hashlib.sha256(json.dumps(params, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+class ReportJobQueue:
+    """Renders ReportJobs on a pool of worker threads
+
+    Threads share the web process's app and database engine, and report
+    rendering spends most of its time in database reads and reportlab, so
+    request threads stay responsive. The pool is created lazily in each
+    gunicorn worker, like the face encoding pool. Artifacts are written to
+    REPORT_CACHE_FOLDER as ``<cache_key>.<report_type>``; since the key
+    includes report_data_version(), identical requests reuse the file until
+    the data the report shows changes.
+
+    Workers touch ``heartbeat_at`` when they start a job and with each
+    progress write; queued or running jobs not heard from for
+    ``stale_after`` seconds (their worker died) are marked failed, so a
+    resubmission queues a new job instead of waiting on them.
+    """
+
+    def __init__(self, max_workers=2, progress_interval=1.0, stale_after=900):
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval
+        self.stale_after = stale_after
+        self.progress = {}  # job id -> (rows, pages) for jobs running in this process
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='report-job')
+                self._pid = os.getpid()
+            return self._executor
+
+    def artifact_path(self, job):
+        return os.path.join(app.config['REPORT_CACHE_FOLDER'], f"{job.cache_key}.{job.report_type}")
+
+    def stale_cutoff(self):
+        return get_current_datetime() - timedelta(seconds=self.stale_after)
+
+    def is_stale(self, job):
+        return job.status in ('queued', 'running') and job.heartbeat_at is not None \
+            and job.heartbeat_at < self.stale_cutoff()
+
+    def fail_stale_jobs(self):
+        """Mark queued or running jobs whose worker stopped responding as failed"""
+        ReportJob.query.filter(
+            ReportJob.status.in_(['queued', 'running']),
+            ReportJob.heartbeat_at < self.stale_cutoff(),
+            ReportJob.id.notin_(list(self.progress))
+        ).update({
+            'status': 'failed',
+            'error': 'The report worker stopped responding',
+            'finished_at': get_current_datetime()
+        }, synchronize_session=False)
+        db.session.commit()
+
+    def submit(self, user_id, report_type, start_date=None, end_date=None, supervisor_id=None,
+               category_id=None, job_title_id=None):
+        """Create a job for the report and queue it, unless a cached artifact already exists"""
+        data_version = report_data_version(start_date, end_date)
+        cache_key = report_cache_key(report_type, start_date, end_date, supervisor_id,
+                                     category_id, job_title_id, data_version)
+
+        self.fail_stale_jobs()
+
+        # The same user resubmitting a report still in progress gets the existing job
+        pending = ReportJob.query.filter(
+            ReportJob.requested_by_id == user_id,
+            ReportJob.cache_key == cache_key,
+            ReportJob.status.in_(['queued', 'running'])
+        ).first()
+        if pending:
+            return pending
+
+        job = ReportJob(
+            requested_by_id=user_id,
+            report_type=report_type,
+            start_date=start_date,
+            end_date=end_date,
+            supervisor_id=supervisor_id,
+            category_id=category_id,
+            job_title_id=job_title_id,
+            data_version=data_version,
+            cache_key=cache_key
+        )
+
+        if os.path.exists(self.artifact_path(job)):
+            job.status = 'done'
+            job.rows_processed, job.pages_rendered = self._cached_counts(cache_key)
+            job.finished_at = get_current_datetime()
+
+        db.session.add(job)
+        db.session.commit()
+
+        if job.status == 'queued':
+            self._get_executor().submit(self._run, job.id)
+        return job
+
+    def _run(self, job_id):
+        with app.app_context():
+            job = db.session.get(ReportJob, job_id)
+            job.status = 'running'
+            job.heartbeat_at = get_current_datetime()
+            db.session.commit()
+
+            path = self.artifact_path(job)
+            temp_path = f"{path}.{job_id}.tmp"
+            try:
+                # Another job may have rendered the same key meanwhile
+                if os.path.exists(path):
+                    rows, pages = self._cached_counts(job.cache_key)
+                else:
+                    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+                    self._render(job, temp_path)
+                    os.replace(temp_path, path)
+                    rows, pages = self.progress.get(job_id, (0, 0))
+
+                job.status = 'done'
+                job.rows_processed = rows
+                job.pages_rendered = pages
+            except Exception as e:
+                logging.error(f"Error running report job {job_id}: {str(e)}")
+                db.session.rollback()
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                job = db.session.get(ReportJob, job_id)
+                job.status = 'failed'
+                job.error = str(e)
+            finally:
+                self.progress.pop(job_id, None)
+
+            job.finished_at = get_current_datetime()
+            db.session.commit()
+
+    def _cached_counts(self, cache_key):
+        """Row and page counts of the job that rendered a cached artifact"""
+        rendered = ReportJob.query.filter_by(cache_key=cache_key, status='done') \
+            .order_by(ReportJob.id.desc()).first()
+        return (rendered.rows_processed, rendered.pages_rendered) if rendered else (0, 0)
+
+    def _render(self, job, path):
+        params = (job.start_date, job.end_date, job.supervisor_id, job.category_id, job.job_title_id)
+        progress = self._progress_reporter(job.id)
+
+        if job.report_type == 'csv':
+            with open(path, 'w', newline='', encoding='utf-8') as report_file:
+                for chunk in report_generator.generate_csv_report(*params, progress=progress):
+                    report_file.write(chunk)
+        else:
+            with open(path, 'wb') as report_file:
+                report_generator.generate_pdf_report(*params, output=report_file, progress=progress)
+
+    def _progress_reporter(self, job_id):
+        """Progress callback recording counts in memory and, every progress_interval, on the job row
+
+        The job row is what status requests served by other worker processes
+        see, and each write is also the job's heartbeat.
+        """
+        last_write = time.monotonic()
+
+        def report(rows, pages):
+            nonlocal last_write
+            self.progress[job_id] = (rows, pages)
+            # SQLite cannot write while the report's read is open; its progress stays in memory
+            if db.engine.dialect.name == 'sqlite' or time.monotonic() - last_write < self.progress_interval:
+                return
+            last_write = time.monotonic()
+
+            # Own connection, so the report query's open cursor is left alone
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        update(ReportJob.__table__)
+                        .where(ReportJob.__table__.c.id == job_id)
+                        .values(rows_processed=rows, pages_rendered=pages, heartbeat_at=get_current_datetime())
+                    )
+            except Exception as e:
+                logging.warning(f"Could not record progress of report job {job_id}: {str(e)}")
+
+        return report
+
+    def describe(self, job):
+        """JSON-ready status of a job, with live progress when it runs in this process"""
+        rows, pages = self.progress.get(job.id, (job.rows_processed, job.pages_rendered))
+        # A job running here is alive even when SQLite kept its heartbeat from being written
+        stale = job.id not in self.progress and self.is_stale(job)
+        return {
+            'id': job.id,
+            'status': 'failed' if stale else job.status,
+            'report_type': job.report_type,
+            'rows_processed': rows,
+            'pages_rendered': pages,
+            'error': 'The report worker stopped responding' if stale else job.error,
+            'created_at': job.created_at.isoformat() if job.created_at else None,
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+# Global report job queue
+report_jobs = ReportJobQueue(max_workers=int(os.environ.get('REPORT_WORKERS', 2)),
+                             stale_after=int(os.environ.get('REPORT_JOB_STALE_SECONDS', 900)))
@@ -1,6 +1,7 @@
 import os
 from datetime import datetime, date, timedelta
-from flask import render_template, request, redirect, url_for, flash, send_file, jsonify, send_from_directory
+from flask import (render_template, request, redirect, url_for, flash, send_file, jsonify, send_from_directory,
+                   Response, stream_with_context)
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash
@@ -12,9 +13,16 @@ from auth import auth_bp, role_required, superuser_required
 from api import api_bp
 
 from models import (User, CompanyProfile, JobCategory, JobTitle, Supervisor, 
-                   Employee, Attendance, supervisor_categories)
-from face_utils_working import face_processor
+                   Employee, Attendance, supervisor_categories, log_attendance_deletes, insert_attendance_once,
+                   remove_attendance_from_rollup, AttendanceDailyRollup, AttendanceArchive, AttendanceMonth, ReportJob,
+                   bump_cache_version)
+from face_utils_working import face_processor, face_gallery
+from frame_utils import DecodedFrame
+from encoding_service import encoding_service
+from liveness import liveness_sessions
+from app_cache import company_info_cache, marked_today
 from report_generator_simple import report_generator
+from report_jobs import REPORT_MIMETYPES, report_jobs
 import logging
 import io
 
@@ -29,6 +37,24 @@ ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def get_face_frame(data_field, file_field='face_image'):
+    """Read a captured face frame from a binary file part, falling back to a data-URL field"""
+    upload = request.files.get(file_field)
+    if upload:
+        image_bytes = upload.read()
+        if image_bytes:
+            return DecodedFrame(image_bytes)
+
+    image_data = request.form.get(data_field)
+    if image_data:
+        return DecodedFrame.from_data_url(image_data)
+
+    return None
+
+def has_face_frame(data_field, file_field='face_image'):
+    """Whether a face frame was submitted, without reading or decoding it"""
+    return bool(request.files.get(file_field) or request.form.get(data_field))
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
@@ -45,7 +71,7 @@ def dashboard():
             total_employees = Employee.query.filter_by(is_active=True).count()
             total_supervisors = Supervisor.query.count()
             total_categories = JobCategory.query.count()
-            today_attendance = Attendance.query.filter_by(date=date.today()).count()
+            today_attendance = AttendanceDailyRollup.total(date.today())
 
             # Recent attendance records
             recent_attendance = Attendance.query.join(Employee).order_by(
@@ -62,41 +88,29 @@ def dashboard():
             }
 
         else:  # supervisor
-            supervisor = current_user.supervisor_profile
-            if not supervisor:
+            supervisor_id = current_user.supervisor_id
+            if supervisor_id is None:
                 flash('Supervisor profile not found. Please contact administrator.', 'error')
                 return redirect(url_for('auth.logout'))
 
             # Get all employees accessible to this supervisor
-            allowed_category_ids = [cat.id for cat in supervisor.allowed_categories]
-
-            my_employees = Employee.query.join(JobTitle).join(JobCategory).filter(
-                and_(
-                    Employee.is_active == True,
-                    or_(
-                        Employee.supervisor_id == supervisor.id,  # Directly assigned employees
-                        JobCategory.id.in_(allowed_category_ids)  # Employees in allowed categories
-                    )
-                )
+            scope = current_user.scope
+
+            my_employees = Employee.query.filter(
+                Employee.id.in_(scope.employee_ids),
+                Employee.is_active == True
             ).count()
 
             # Today's attendance for accessible employees
-            today_attendance = Attendance.query.join(Employee).join(JobTitle).join(JobCategory).filter(
-                and_(
-                    Attendance.date == date.today(),
-                    or_(
-                        Employee.supervisor_id == supervisor.id,
-                        JobCategory.id.in_(allowed_category_ids)
-                    )
-                )
-            ).count()
+            today_attendance = AttendanceDailyRollup.total(
+                date.today(),
+                supervisor_id=supervisor_id,
+                category_ids=scope.category_ids
+            )
 
             # Recent attendance for accessible employees
-            recent_attendance = Attendance.query.join(Employee).join(JobTitle).join(JobCategory).filter(
-                or_(
-                    Employee.supervisor_id == supervisor.id,
-                    JobCategory.id.in_(allowed_category_ids)
-                )
+            recent_attendance = Attendance.query.filter(
+                Attendance.employee_id.in_(scope.employee_ids)
             ).order_by(desc(Attendance.datetime)).limit(10).all()
 
             context = {
@@ -161,8 +175,8 @@ def job_titles(category_id):
 
     # Check access permissions
     if current_user.role != 'superuser':
-        supervisor = current_user.supervisor_profile
-        if not supervisor or category not in supervisor.allowed_categories:
+        supervisor_id = current_user.supervisor_id
+        if supervisor_id is None or not current_user.scope.can_access_category(category.id):
             flash('Access denied.', 'error')
             return redirect(url_for('categories'))
 
@@ -176,8 +190,8 @@ def add_job_title(category_id):
 
     # Check permissions
     if current_user.role != 'superuser':
-        supervisor = current_user.supervisor_profile
-        if not supervisor or category not in supervisor.allowed_categories:
+        supervisor_id = current_user.supervisor_id
+        if supervisor_id is None or not current_user.scope.can_access_category(category.id):
             flash('Access denied.', 'error')
             return redirect(url_for('categories'))
 
@@ -220,20 +234,13 @@ def employees():
                              categories=categories,
                              supervisors=supervisors)
     else:
-        supervisor = current_user.supervisor_profile
-        if supervisor:
+        supervisor_id = current_user.supervisor_id
+        if supervisor_id is not None:
             # Get all employees whose job categories are assigned to this supervisor
             # OR employees directly assigned to this supervisor
-            allowed_category_ids = [cat.id for cat in supervisor.allowed_categories]
-
-            employees = Employee.query.join(JobTitle).join(JobCategory).filter(
-                and_(
-                    Employee.is_active == True,
-                    or_(
-                        Employee.supervisor_id == supervisor.id,  # Directly assigned employees
-                        JobCategory.id.in_(allowed_category_ids)  # Employees in allowed categories
-                    )
-                )
+            employees = Employee.query.filter(
+                Employee.id.in_(current_user.scope.employee_ids),
+                Employee.is_active == True
             ).order_by(Employee.name).all()
         else:
             employees = []
@@ -252,10 +259,10 @@ def register_employee():
             address = request.form.get('address', '').strip()
             contact_number = request.form.get('contact_number', '').strip()
             email = request.form.get('email', '').strip()
-            face_image_data = request.form.get('face_image_data')
+            face_frame = get_face_frame('face_image_data')
 
             # Validation
-            if not all([employee_number, name, job_title_id, face_image_data]):
+            if not all([employee_number, name, job_title_id, face_frame]):
                 flash('All required fields must be filled and face must be captured.', 'error')
                 return redirect(url_for('register_employee'))
 
@@ -266,7 +273,7 @@ def register_employee():
                 return redirect(url_for('register_employee'))
 
             # Extract face encoding
-            face_encoding = face_processor.extract_face_encoding(face_image_data)
+            face_encoding = encoding_service.extract_face_encoding(face_frame, current_user.id)
             if face_encoding is None:
                 flash('Face registration failed: No face detected in image', 'error')
                 return redirect(url_for('register_employee'))
@@ -317,23 +324,16 @@ def mark_attendance():
         flash('Only supervisors can mark attendance.', 'error')
         return redirect(url_for('dashboard'))
 
-    supervisor = current_user.supervisor_profile
-    if not supervisor:
+    supervisor_id = current_user.supervisor_id
+    if supervisor_id is None:
         flash('Supervisor profile not found.', 'error')
         return redirect(url_for('dashboard'))
 
     # Get all employees whose job categories are assigned to this supervisor
     # OR employees directly assigned to this supervisor
-    allowed_category_ids = [cat.id for cat in supervisor.allowed_categories]
-
-    employees = Employee.query.join(JobTitle).join(JobCategory).filter(
-        and_(
-            Employee.is_active == True,
-            or_(
-                Employee.supervisor_id == supervisor.id,  # Directly assigned employees
-                JobCategory.id.in_(allowed_category_ids)  # Employees in allowed categories
-            )
-        )
+    employees = Employee.query.filter(
+        Employee.id.in_(current_user.scope.employee_ids),
+        Employee.is_active == True
     ).all()
 
     if not employees:
@@ -342,6 +342,34 @@ def mark_attendance():
 
     return render_template('attendance_mark.html', employees=employees)
 
+def record_attendance(employee, supervisor_id, latitude, longitude):
+    """Insert today's attendance for an employee; returns False if already marked"""
+    today = date.today()
+    now = datetime.now()
+    attendance_id = insert_attendance_once(db.session.connection(), {
+        'employee_id': employee.id,
+        'date': today,
+        'time': now.time(),
+        'datetime': now,
+        'latitude': float(latitude) if latitude else None,
+        'longitude': float(longitude) if longitude else None,
+        'marked_by_id': supervisor_id
+    })
+    db.session.commit()
+    marked_today.mark(employee.id, today)
+    return attendance_id is not None
+
+def already_marked_response(employee):
+    today_attendance = Attendance.query.filter_by(
+        employee_id=employee.id, date=date.today()
+    ).first()
+    marked_at = f' at {today_attendance.time.strftime("%H:%M")}' if today_attendance else ''
+    return jsonify({
+        'success': False,
+        'employee_id': employee.id,
+        'message': f'Attendance already marked for {employee.name} today{marked_at}'
+    })
+
 @app.route('/attendance/process', methods=['POST'])
 @login_required
 def process_attendance():
@@ -349,54 +377,48 @@ def process_attendance():
         if current_user.role != 'supervisor':
             return jsonify({'success': False, 'message': 'Access denied'})
 
-        supervisor = current_user.supervisor_profile
-        if not supervisor:
+        supervisor_id = current_user.supervisor_id
+        if supervisor_id is None:
             return jsonify({'success': False, 'message': 'Supervisor profile not found'})
 
         # Get form data
         employee_id = request.form.get('employee_id')
-        face_image_data = request.form.get('face_image_data')
         latitude = request.form.get('latitude')
         longitude = request.form.get('longitude')
         blink_detected = request.form.get('blink_detected', 'false').lower() == 'true'
 
-        if not all([employee_id, face_image_data]):
+        if not employee_id or not has_face_frame('face_image_data'):
             return jsonify({'success': False, 'message': 'Missing required data'})
 
-        # Get employee - check if supervisor has access to this employee
+        # Check if supervisor has access to this employee
+        if not current_user.scope.can_access(int(employee_id)):
+            return jsonify({'success': False, 'message': 'Access denied to this employee'})
+
         employee = Employee.query.get(int(employee_id))
 
         if not employee or not employee.is_active:
             return jsonify({'success': False, 'message': 'Employee not found'})
 
-        # Check if supervisor has access to this employee
-        allowed_category_ids = [cat.id for cat in supervisor.allowed_categories]
-        has_access = (
-            employee.supervisor_id == supervisor.id or  # Directly assigned
-            (employee.job_title and employee.job_title.category_id in allowed_category_ids)  # In allowed category
-        )
-
-        if not has_access:
-            return jsonify({'success': False, 'message': 'Access denied to this employee'})
-
-        # Check if attendance already marked today
-        today_attendance = Attendance.query.filter_by(
-            employee_id=employee.id, date=date.today()
-        ).first()
+        # Reject repeat attempts before the frame is decoded
+        if marked_today.is_marked(employee.id, date.today()):
+            return already_marked_response(employee)
 
-        if today_attendance:
-            return jsonify({
-                'success': False, 
-                'message': f'Attendance already marked for {employee.name} today at {today_attendance.time.strftime("%H:%M")}'
-            })
+        face_frame = get_face_frame('face_image_data')
+        if not face_frame:
+            return jsonify({'success': False, 'message': 'Missing required data'})
 
         # Get stored face encoding
         known_encoding = employee.get_face_encoding()
         if known_encoding is None:
             return jsonify({'success': False, 'message': 'No face data found for this employee'})
 
-        # Process face recognition with anti-spoofing
-        result = face_processor.process_attendance_frame(face_image_data, known_encoding, blink_detected)
+        # A blink reported for any earlier frame of this capture stream still counts
+        stream_key = (current_user.id, employee.id)
+        blink_detected = liveness_sessions.get(stream_key).record_frame(blink_detected)
+
+        # Process face recognition with anti-spoofing; encoding runs in the process pool
+        current_encoding = encoding_service.extract_face_encoding(face_frame, current_user.id)
+        result = face_processor.process_attendance_encoding(current_encoding, known_encoding, blink_detected)
 
         # Log security alerts
         if result.get('security_alert'):
@@ -420,22 +442,12 @@ def process_attendance():
                 'security_alert': 'Anti-spoofing verification required'
             })
 
-        # Create attendance record
-        attendance = Attendance(
-            employee_id=employee.id,
-            date=date.today(),
-            time=datetime.now().time(),
-            datetime=datetime.now(),
-            latitude=float(latitude) if latitude else None,
-            longitude=float(longitude) if longitude else None,
-            marked_by_id=supervisor.id
-        )
-
-        db.session.add(attendance)
-        db.session.commit()
+        # Create attendance record; a concurrent double-tap loses the conflict
+        if not record_attendance(employee, supervisor_id, latitude, longitude):
+            return already_marked_response(employee)
 
-        # Reset blink detection for next use
-        face_processor.reset_blink_detection()
+        # Reset blink detection for this capture stream
+        liveness_sessions.reset(stream_key)
 
         return jsonify({
             'success': True, 
@@ -448,6 +460,109 @@ def process_attendance():
         logging.error(f"Error processing attendance: {str(e)}")
         return jsonify({'success': False, 'message': 'Error processing attendance'})
 
+@app.route('/attendance/identify', methods=['POST'])
+@login_required
+def identify_attendance():
+    """Identify the employee in a captured frame and mark attendance (1:N)"""
+    try:
+        if current_user.role != 'supervisor':
+            return jsonify({'success': False, 'message': 'Access denied'})
+
+        supervisor_id = current_user.supervisor_id
+        if supervisor_id is None:
+            return jsonify({'success': False, 'message': 'Supervisor profile not found'})
+
+        # Get form data
+        face_frame = get_face_frame('face_image_data')
+        latitude = request.form.get('latitude')
+        longitude = request.form.get('longitude')
+        blink_detected = request.form.get('blink_detected', 'false').lower() == 'true'
+
+        if not face_frame:
+            return jsonify({'success': False, 'message': 'Missing required data'})
+
+        # The employee is not known yet, so the stream is the supervisor's identification capture
+        stream_key = (current_user.id, None)
+        blink_detected = liveness_sessions.get(stream_key).record_frame(blink_detected)
+
+        probe_encoding = encoding_service.extract_face_encoding(face_frame, current_user.id)
+        if probe_encoding is None:
+            return jsonify({
+                'success': False,
+                'message': 'No face detected in image. Please ensure your face is clearly visible.'
+            })
+
+        # Only employees this supervisor has access to are candidates; the
+        # gallery holds active employees only
+        face_gallery.sync()
+        candidates = face_gallery.identify(
+            probe_encoding, top_k=3, candidate_ids=current_user.scope.employee_ids
+        )
+
+        if not candidates:
+            return jsonify({'success': False, 'message': 'No registered faces available for identification'})
+
+        # Gallery scores use the same scale as the 1:1 matcher
+        best = candidates[0]
+        face_match = best['score'] > face_processor.match_tolerance
+
+        # Two employees scoring almost alike is a coin toss; ask for another capture
+        if face_match and len(candidates) > 1 and \
+                best['score'] - candidates[1]['score'] < face_processor.identify_margin:
+            return jsonify({
+                'success': False,
+                'message': 'Face matches more than one employee. Please capture again facing the camera.',
+                'retry': True,
+                'candidates': candidates
+            })
+
+        # The employee may have been removed since the gallery synced
+        employee = db.session.get(Employee, best['employee_id'])
+        if employee is None or not employee.is_active:
+            return jsonify({
+                'success': False,
+                'message': 'Matched employee is no longer registered. Please capture again.',
+                'retry': True
+            })
+
+        result = face_processor.attendance_result(face_match, blink_detected)
+
+        if result.get('security_alert'):
+            logging.warning(f"Security Alert during identification (best match {employee.name}): "
+                            f"{result['security_alert']}")
+
+        if not result['success']:
+            response = {
+                'success': False,
+                'message': result['message'],
+                'confidence': result.get('confidence', 0.0),
+                'candidates': candidates
+            }
+            if result.get('security_alert'):
+                response['security_alert'] = result['security_alert']
+            return jsonify(response)
+
+        # Create attendance record unless the employee is already marked today
+        if marked_today.is_marked(employee.id, date.today()) or \
+                not record_attendance(employee, supervisor_id, latitude, longitude):
+            return already_marked_response(employee)
+
+        # Reset blink detection for this capture stream
+        liveness_sessions.reset(stream_key)
+
+        return jsonify({
+            'success': True,
+            'employee_id': employee.id,
+            'message': f'Attendance marked successfully for {employee.name}',
+            'confidence': f'{result["confidence"]:.2f}',
+            'candidates': candidates
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error identifying employee for attendance: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error processing attendance'})
+
 @app.route('/reports')
 @login_required
 def reports():
@@ -462,64 +577,60 @@ def reports():
 
     return render_template('reports.html', categories=categories, supervisors=supervisors)
 
-@app.route('/reports/generate', methods=['POST'])
-@login_required
-def generate_report():
-    try:
-        # Get form data
-        report_type = request.form.get('report_type', 'csv')
-        start_date_str = request.form.get('start_date')
-        end_date_str = request.form.get('end_date')
-        supervisor_id = request.form.get('supervisor_id')
-        category_id = request.form.get('category_id')
-        job_title_id = request.form.get('job_title_id')
+def report_filters_from_form():
+    """Parse the report form into (report_type, start_date, end_date, supervisor_id, category_id, job_title_id)"""
+    report_type = request.form.get('report_type', 'csv')
+    start_date_str = request.form.get('start_date')
+    end_date_str = request.form.get('end_date')
+    supervisor_id = request.form.get('supervisor_id')
+    category_id = request.form.get('category_id')
+    job_title_id = request.form.get('job_title_id')
 
-        # Parse dates
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else None
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else None
+    # Parse dates
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date() if start_date_str else None
+    end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date() if end_date_str else None
 
-        # Convert empty strings to None
-        supervisor_id = int(supervisor_id) if supervisor_id else None
-        category_id = int(category_id) if category_id else None
-        job_title_id = int(job_title_id) if job_title_id else None
+    # Convert empty strings to None
+    supervisor_id = int(supervisor_id) if supervisor_id else None
+    category_id = int(category_id) if category_id else None
+    job_title_id = int(job_title_id) if job_title_id else None
 
-        # For supervisors, override supervisor_id with their own ID
-        if current_user.role == 'supervisor':
-            supervisor_id = current_user.supervisor_profile.id if current_user.supervisor_profile else None
+    # For supervisors, override supervisor_id with their own ID
+    if current_user.role == 'supervisor':
+        supervisor_id = current_user.supervisor_id
 
-        if report_type == 'csv':
-            content, error = report_generator.generate_csv_report(
-                start_date, end_date, supervisor_id, category_id, job_title_id, current_user.role
-            )
+    return report_type, start_date, end_date, supervisor_id, category_id, job_title_id
 
-            if error:
-                flash(error, 'error')
-                return redirect(url_for('reports'))
+@app.route('/reports/generate', methods=['POST'])
+@login_required
+def generate_report():
+    try:
+        report_type, start_date, end_date, supervisor_id, category_id, job_title_id = report_filters_from_form()
 
+        if report_type == 'csv':
             # Create filename
             filename = f"attendance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
 
-            return send_file(
-                io.BytesIO(content),
-                as_attachment=True,
-                download_name=filename,
-                mimetype='text/csv'
+            # Stream rows as they are read instead of building the file in memory
+            chunks = report_generator.generate_csv_report(
+                start_date, end_date, supervisor_id, category_id, job_title_id, current_user.role
+            )
+            return Response(
+                stream_with_context(chunks),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={filename}'}
             )
 
         elif report_type == 'pdf':
-            content, error = report_generator.generate_pdf_report(
+            pdf_file = report_generator.generate_pdf_report(
                 start_date, end_date, supervisor_id, category_id, job_title_id, current_user.role
             )
 
-            if error:
-                flash(error, 'error')
-                return redirect(url_for('reports'))
-
             # Create filename
             filename = f"attendance_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
 
             return send_file(
-                io.BytesIO(content),
+                pdf_file,
                 as_attachment=True,
                 download_name=filename,
                 mimetype='application/pdf'
@@ -534,6 +645,64 @@ def generate_report():
         flash('Error generating report.', 'error')
         return redirect(url_for('reports'))
 
+@app.route('/reports/jobs', methods=['POST'])
+@login_required
+def submit_report_job():
+    try:
+        report_type, start_date, end_date, supervisor_id, category_id, job_title_id = report_filters_from_form()
+        if report_type not in REPORT_MIMETYPES:
+            return jsonify({'success': False, 'message': 'Invalid report type'})
+
+        job = report_jobs.submit(current_user.id, report_type, start_date, end_date,
+                                 supervisor_id, category_id, job_title_id)
+        return jsonify({'success': True, 'job': report_job_status(job)}), 202
+
+    except Exception as e:
+        db.session.rollback()
+        logging.error(f"Error submitting report job: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error submitting report'})
+
+def get_report_job(job_id):
+    """The job if the current user may see it, else None"""
+    job = db.session.get(ReportJob, job_id)
+    if job is None or (job.requested_by_id != current_user.id and current_user.role != 'superuser'):
+        return None
+    return job
+
+def report_job_status(job):
+    status = report_jobs.describe(job)
+    status['download_url'] = url_for('download_report_job', job_id=job.id) if job.status == 'done' else None
+    return status
+
+@app.route('/reports/jobs/<int:job_id>')
+@login_required
+def report_job(job_id):
+    job = get_report_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Report job not found'}), 404
+    return jsonify({'success': True, 'job': report_job_status(job)})
+
+@app.route('/reports/jobs/<int:job_id>/download')
+@login_required
+def download_report_job(job_id):
+    job = get_report_job(job_id)
+    if job is None or job.status != 'done':
+        flash('Report not found or not ready yet.', 'error')
+        return redirect(url_for('reports'))
+
+    path = report_jobs.artifact_path(job)
+    if not os.path.exists(path):
+        flash('This report has expired. Please generate it again.', 'error')
+        return redirect(url_for('reports'))
+
+    filename = f"attendance_report_{job.created_at.strftime('%Y%m%d_%H%M%S')}.{job.report_type}"
+    return send_file(
+        os.path.abspath(path),
+        as_attachment=True,
+        download_name=filename,
+        mimetype=REPORT_MIMETYPES[job.report_type]
+    )
+
 @app.route('/admin')
 @superuser_required
 def admin_panel():
@@ -543,6 +712,7 @@ def admin_panel():
         company = CompanyProfile()
         db.session.add(company)
         db.session.commit()
+        company_info_cache.invalidate()
 
     # Get supervisors
     supervisors = Supervisor.query.order_by(Supervisor.full_name).all()
@@ -584,6 +754,7 @@ def update_company_profile():
                 company.logo_filename = filename
 
         db.session.commit()
+        company_info_cache.invalidate()
         flash('Company profile updated successfully.', 'success')
 
     except Exception as e:
@@ -802,14 +973,14 @@ def admin_add_employee():
         contact_number = request.form.get('contact_number', '').strip()
         email = request.form.get('email', '').strip()
         supervisor_id = request.form.get('supervisor_id')
-        face_data = request.form.get('face_data')
+        face_frame = get_face_frame('face_data')
 
         # Validation
         if not all([employee_number, name, job_title_id, contact_number]):
             flash('Employee number, name, job title, and contact number are required.', 'error')
             return redirect(url_for('employees'))
 
-        if not face_data:
+        if not face_frame:
             flash('Face capture is required for employee registration.', 'error')
             return redirect(url_for('employees'))
 
@@ -822,28 +993,14 @@ def admin_add_employee():
         # Process face encoding and save face image
         face_encoding = None
         face_image_filename = None
-        if face_data:
+        if face_frame:
             try:
-                from face_utils_working import face_processor
-                import base64
-                from datetime import datetime
-                
                 # Extract face encoding
-                face_encoding = face_processor.extract_face_encoding(face_data)
-                if not face_encoding:
+                face_encoding = encoding_service.extract_face_encoding(face_frame, current_user.id)
+                if face_encoding is None:
                     flash('Failed to process face data. Please ensure face is clearly visible and try capturing again.', 'error')
                     return redirect(url_for('employees'))
                 
-                # Save the captured face image
-                if ',' in face_data:
-                    # Remove data URL prefix
-                    image_data = face_data.split(',')[1]
-                else:
-                    image_data = face_data
-                
-                # Decode base64 image
-                image_bytes = base64.b64decode(image_data)
-                
                 # Generate unique filename
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 safe_name = "".join(c for c in name if c.isalnum() or c in (' ', '-', '_')).rstrip()
@@ -853,7 +1010,7 @@ def admin_add_employee():
                 # Save to uploads directory
                 upload_path = os.path.join('uploads', face_image_filename)
                 with open(upload_path, 'wb') as f:
-                    f.write(image_bytes)
+                    f.write(face_frame.data)
                 
                 logging.info(f"Successfully processed face encoding and saved face image for employee: {name}")
                 
@@ -875,7 +1032,7 @@ def admin_add_employee():
         )
 
         # Set face encoding
-        if face_encoding:
+        if face_encoding is not None:
             employee.set_face_encoding(face_encoding)
 
         db.session.add(employee)
@@ -956,12 +1113,21 @@ def admin_delete_employee():
         employee = Employee.query.get_or_404(int(employee_id))
         employee_name = employee.name
 
-        # Delete attendance records first
-        Attendance.query.filter_by(employee_id=employee.id).delete()
+        # Delete hot and archived attendance records first, logging them for
+        # the sync change feed and removing them from the rollup
+        connection = db.session.connection()
+        for table in (Attendance, AttendanceArchive):
+            log_attendance_deletes(connection, table.employee_id == employee.id, table=table)
+            remove_attendance_from_rollup(connection, table.employee_id == employee.id, table=table)
+            table.query.filter_by(employee_id=employee.id).delete()
+        AttendanceMonth.query.filter_by(employee_id=employee.id).delete()
+        # Other workers' today bitmaps may hold the employee's bit
+        bump_cache_version(connection, 'marked_today')
 
         # Delete employee
         db.session.delete(employee)
         db.session.commit()
+        marked_today.invalidate()
 
         flash(f'Employee "{employee_name}" deleted successfully.', 'success')
 
@@ -991,5 +1157,5 @@ def uploaded_file(filename):
 
 @app.context_processor
 def inject_company_info():
-    company = CompanyProfile.query.first()
+    company = company_info_cache.get()
     return dict(company=company, current_year=datetime.now().year)
\ No newline at end of file
@@ -1,11 +1,12 @@
 class FaceCapture {
-    constructor(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId) {
+    constructor(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId, fileInputId) {
         this.video = document.getElementById(videoId);
         this.canvas = document.getElementById(canvasId);
         this.status = document.getElementById(statusId);
         this.captureButton = document.getElementById(captureButtonId);
         this.hiddenInput = document.getElementById(hiddenInputId);
         this.submitButton = document.getElementById(submitButtonId);
+        this.fileInput = fileInputId ? document.getElementById(fileInputId) : null;
         
         this.stream = null;
         this.faceDetected = false;
@@ -82,34 +83,46 @@ class FaceCapture {
             const ctx = this.canvas.getContext('2d');
             ctx.drawImage(this.video, 0, 0);
             
-            // Get image data as base64
-            const imageData = this.canvas.toDataURL('image/jpeg', 0.8);
-            
-            // Store in hidden input
-            this.hiddenInput.value = imageData;
-            
-            // Update UI
-            this.faceCaptured = true;
-            this.updateStatus('Face captured successfully!', 'success');
-            this.captureButton.innerHTML = '<i class="fas fa-check me-2"></i>Face Captured';
-            this.captureButton.disabled = true;
-            this.captureButton.classList.remove('btn-success');
-            this.captureButton.classList.add('btn-outline-success');
-            
-            // Enable submit button
-            if (this.submitButton) {
-                this.submitButton.disabled = false;
+            if (this.fileInput && typeof DataTransfer !== 'undefined') {
+                // Attach the frame as a binary JPEG file part
+                this.canvas.toBlob(blob => {
+                    const transfer = new DataTransfer();
+                    transfer.items.add(new File([blob], 'face.jpg', { type: 'image/jpeg' }));
+                    this.fileInput.files = transfer.files;
+                    this.hiddenInput.value = '';
+                    this.onFaceCaptured(URL.createObjectURL(blob));
+                }, 'image/jpeg', 0.8);
+            } else {
+                // Fall back to a base64 data URL in the hidden input
+                const imageData = this.canvas.toDataURL('image/jpeg', 0.8);
+                this.hiddenInput.value = imageData;
+                this.onFaceCaptured(imageData);
             }
             
-            // Show captured image preview (optional)
-            this.showPreview(imageData);
-            
         } catch (error) {
             console.error('Error capturing face:', error);
             this.updateStatus('Error capturing face. Please try again.', 'danger');
         }
     }
     
+    onFaceCaptured(previewSrc) {
+        // Update UI
+        this.faceCaptured = true;
+        this.updateStatus('Face captured successfully!', 'success');
+        this.captureButton.innerHTML = '<i class="fas fa-check me-2"></i>Face Captured';
+        this.captureButton.disabled = true;
+        this.captureButton.classList.remove('btn-success');
+        this.captureButton.classList.add('btn-outline-success');
+        
+        // Enable submit button
+        if (this.submitButton) {
+            this.submitButton.disabled = false;
+        }
+        
+        // Show captured image preview (optional)
+        this.showPreview(previewSrc);
+    }
+    
     showPreview(imageData) {
         // Create a small preview image
         const preview = document.createElement('img');
@@ -163,6 +176,9 @@ class FaceCapture {
         this.faceCaptured = false;
         this.faceDetected = false;
         this.hiddenInput.value = '';
+        if (this.fileInput) {
+            this.fileInput.value = '';
+        }
         
         if (this.submitButton) {
             this.submitButton.disabled = true;
@@ -186,8 +202,8 @@ class FaceCapture {
 
 // Anti-spoofing Face Capture with blink detection
 class AntiSpoofFaceCapture extends FaceCapture {
-    constructor(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId) {
-        super(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId);
+    constructor(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId, fileInputId) {
+        super(videoId, canvasId, statusId, captureButtonId, hiddenInputId, submitButtonId, fileInputId);
         
         this.blinkDetected = false;
         this.blinkThreshold = 0.25;
@@ -0,0 +1,143 @@
+"""
+Cached supervisor access scopes
+"""
+import os
+import threading
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session, object_session
+
+from app import db
+from app_cache import SharedVersion
+from frame_utils import TTLCache
+from models import Employee, JobCategory, JobTitle, Supervisor, bump_cache_version, supervisor_categories
+
+class SupervisorScope:
+    """The employees and categories one supervisor can access
+
+    Employees are accessible when directly assigned to the supervisor or
+    when their job title is in one of the supervisor's categories; inactive
+    employees are included, so list queries still filter on is_active.
+    """
+
+    __slots__ = ('supervisor_id', 'employee_ids', 'category_ids', 'version')
+
+    def __init__(self, supervisor_id, employee_ids, category_ids, version):
+        self.supervisor_id = supervisor_id
+        self.employee_ids = frozenset(employee_ids)
+        self.category_ids = frozenset(category_ids)
+        self.version = version
+
+    def can_access(self, employee_id):
+        return employee_id in self.employee_ids
+
+    def can_access_category(self, category_id):
+        return category_id in self.category_ids
+
+    @classmethod
+    def load(cls, supervisor_id, version):
+        category_ids = db.session.execute(
+            select(supervisor_categories.c.category_id)
+            .where(supervisor_categories.c.supervisor_id == supervisor_id)
+        ).scalars().all()
+
+        employee_ids = db.session.execute(
+            select(Employee.id)
+            .outerjoin(JobTitle, Employee.job_title_id == JobTitle.id)
+            .where(or_(
+                Employee.supervisor_id == supervisor_id,
+                JobTitle.category_id.in_(category_ids)
+            ))
+        ).scalars().all()
+
+        return cls(supervisor_id, employee_ids, category_ids, version)
+
+class SupervisorScopeCache:
+    """Memoized SupervisorScopes, keyed by supervisor id
+
+    Committed changes to employee assignments, job title categories or
+    supervisor categories bump the version, which stales every cached
+    scope in this process. The same transaction bumps the shared
+    ``supervisor_scopes`` cache version, which other worker processes check
+    at most every ``sync_interval`` seconds, so granted or revoked access
+    reaches them without waiting for the ``ttl``.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30, sync_interval=1.0):
+        self.scopes = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.version = 0
+        self.shared_version = SharedVersion('supervisor_scopes', sync_interval)
+        self._lock = threading.Lock()
+
+    def get(self, supervisor):
+        """Return the scope for a Supervisor or supervisor id"""
+        if self.shared_version.changed():
+            self.invalidate()
+
+        supervisor_id = getattr(supervisor, 'id', supervisor)
+        with self._lock:
+            scope = self.scopes.get(supervisor_id)
+            version = self.version
+        if scope is not None and scope.version == version:
+            return scope
+
+        scope = SupervisorScope.load(supervisor_id, version)
+        with self._lock:
+            self.scopes.set(supervisor_id, scope)
+        return scope
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self.scopes.clear()
+
+# Global supervisor scope cache
+supervisor_scopes = SupervisorScopeCache(ttl=int(os.environ.get('SUPERVISOR_SCOPE_TTL', 30)),
+                                         sync_interval=float(os.environ.get('CACHE_SYNC_INTERVAL', 1)))
+
+def _mark_scope_change(target):
+    session = object_session(target)
+    if session is not None:
+        session.info['supervisor_scope_changed'] = True
+        session.info['supervisor_scope_unshared'] = True
+
+@event.listens_for(Employee, 'after_insert')
+@event.listens_for(Employee, 'after_delete')
+@event.listens_for(JobTitle, 'after_delete')
+@event.listens_for(JobCategory, 'after_delete')
+def scope_row_changed(mapper, connection, target):
+    _mark_scope_change(target)
+
+@event.listens_for(Employee, 'after_update')
+def employee_assignment_changed(mapper, connection, target):
+    state = inspect(target)
+    if (state.attrs.supervisor_id.history.has_changes() or
+            state.attrs.job_title_id.history.has_changes()):
+        _mark_scope_change(target)
+
+@event.listens_for(JobTitle, 'after_update')
+def job_title_category_changed(mapper, connection, target):
+    if inspect(target).attrs.category_id.history.has_changes():
+        _mark_scope_change(target)
+
+@event.listens_for(Supervisor.allowed_categories, 'append')
+@event.listens_for(Supervisor.allowed_categories, 'remove')
+def supervisor_categories_changed(target, value, initiator):
+    _mark_scope_change(target)
+
+# Bumped after the flush that wrote the change, in its transaction; collection events have no connection
+@event.listens_for(Session, 'after_flush')
+def share_scope_changes(session, flush_context):
+    if session.info.pop('supervisor_scope_unshared', False):
+        bump_cache_version(session.connection(), 'supervisor_scopes')
+
+# Invalidate only after commit, so a concurrent reload cannot cache the old rows
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_scopes(session):
+    if session.info.pop('supervisor_scope_changed', False):
+        supervisor_scopes.invalidate()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_scope_changes(session):
+    session.info.pop('supervisor_scope_changed', None)
+    session.info.pop('supervisor_scope_unshared', None)
@@ -0,0 +1,70 @@
+"""
+Test setup: the app runs against a throwaway SQLite database unless
+TEST_DATABASE_URL points at another one (e.g. PostgreSQL)
+"""
+import os
+import sys
+import tempfile
+from datetime import datetime, time
+
+import pytest
+
+_database_dir = tempfile.mkdtemp(prefix='attendance-tests-')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL', f"sqlite:///{os.path.join(_database_dir, 'test.db')}")
+os.environ.setdefault('FACE_ENCODING_WORKERS', '0')
+os.environ.setdefault('REPORT_CACHE_FOLDER', os.path.join(_database_dir, 'report_cache'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402,F401  registers routes, API and commands
+from app import app as flask_app, db  # noqa: E402
+from models import Attendance, Employee, JobCategory, JobTitle, Supervisor, User  # noqa: E402
+
+@pytest.fixture
+def app():
+    """App context over freshly created tables"""
+    with flask_app.app_context():
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def make_employee(app):
+    """Create an employee (with a job title and supervisor) and return its id"""
+    created = []
+
+    def make(number=None, encoding=None):
+        if not created:
+            user = User(username='supervisor', email='supervisor@example.com', password_hash='-',
+                        role='supervisor', full_name='Supervisor')
+            db.session.add(user)
+            db.session.flush()
+            category = JobCategory(name='Category', created_by_id=user.id)
+            supervisor = Supervisor(user_id=user.id, full_name='Supervisor')
+            db.session.add_all([category, supervisor])
+            db.session.flush()
+            job_title = JobTitle(name='Job Title', category_id=category.id)
+            db.session.add(job_title)
+            db.session.flush()
+            created.append((job_title.id, supervisor.id))
+
+        job_title_id, supervisor_id = created[0]
+        employee = Employee(employee_number=number or f"E{len(created)}", name='Employee',
+                            job_title_id=job_title_id, supervisor_id=supervisor_id)
+        employee.set_face_encoding(encoding)
+        db.session.add(employee)
+        db.session.commit()
+        created.append(employee.id)
+        return employee.id
+
+    return make
+
+def attendance(employee_id, day):
+    """Unsaved Attendance row for an employee and day"""
+    return Attendance(employee_id=employee_id, date=day, time=time(9, 0),
+                      datetime=datetime.combine(day, time(9, 0)))
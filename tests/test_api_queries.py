@@ -0,0 +1,74 @@
+"""
+The attendance APIs issue the same number of queries whatever the row count, and page correctly
+"""
+import json
+from contextlib import contextmanager
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from conftest import attendance
+
+DAY = date(2024, 5, 6)
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+def seed_attendance(make_employee, first, last):
+    for i in range(first, last):
+        db.session.add(attendance(make_employee(f"E{i}"), DAY))
+    db.session.commit()
+
+def queries_for(client, request):
+    method, url, body = request
+    db.session.remove()
+    with count_queries() as statements:
+        response = client.post(url, json=body) if method == 'POST' else client.get(url)
+        response.get_data()  # drain streamed responses inside the count
+    assert response.status_code == 200
+    return len(statements)
+
+REQUESTS = [
+    ('GET', f'/api/attendance/daily?date={DAY}', None),
+    ('GET', f'/api/attendance/range?start_date={DAY}&end_date={DAY}', None),
+    ('GET', f'/api/attendance/range?start_date={DAY}&end_date={DAY}&limit=100', None),
+    ('GET', f'/api/attendance/range?start_date={DAY}&end_date={DAY}&format=ndjson', None),
+    ('POST', '/api/sync-to-dotnet', {'date': DAY.isoformat()}),
+    ('POST', '/api/sync-to-dotnet', {'since': 0}),
+]
+
+@pytest.mark.parametrize('request_spec', REQUESTS, ids=[url for _, url, _ in REQUESTS])
+def test_query_count_does_not_grow_with_rows(app, client, make_employee, request_spec):
+    seed_attendance(make_employee, 0, 2)
+    few = queries_for(client, request_spec)
+
+    seed_attendance(make_employee, 2, 40)
+    many = queries_for(client, request_spec)
+
+    assert many == few
+
+def test_ndjson_pages_follow_the_cursor(app, client, make_employee):
+    seed_attendance(make_employee, 0, 5)
+    url = f'/api/attendance/range?start_date={DAY}&end_date={DAY}&format=ndjson&limit=3'
+
+    first = [json.loads(line) for line in client.get(url).get_data(as_text=True).splitlines()]
+    assert len(first) == 4 and set(first[-1]) == {'next_cursor'}
+
+    second = [json.loads(line) for line in
+              client.get(f"{url}&after={first[-1]['next_cursor']}").get_data(as_text=True).splitlines()]
+    assert len(second) == 2 and all('next_cursor' not in row for row in second)
+
+    ids = [row['id'] for row in first[:-1] + second]
+    assert len(set(ids)) == 5
@@ -0,0 +1,59 @@
+"""
+Identity and attendance cache invalidation across worker processes
+"""
+from datetime import date
+
+from werkzeug.security import generate_password_hash
+
+from app import db
+from app_cache import MarkedTodayBitmap, UserCache
+from conftest import attendance
+from models import User
+
+def make_user(role='superuser'):
+    user = User(username='admin', email='admin@example.com', password_hash='-',
+                role=role, full_name='Admin')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+def test_other_worker_sees_role_and_active_changes(app):
+    user_id = make_user()
+    # A second cache stands in for another worker: this process's commit hooks never touch it
+    other_worker = UserCache(sync_interval=0)
+    assert other_worker.get(user_id).role == 'superuser'
+
+    db.session.get(User, user_id).role = 'supervisor'
+    db.session.commit()
+    assert other_worker.get(user_id).role == 'supervisor'
+
+    db.session.get(User, user_id).is_active = False
+    db.session.commit()
+    assert not other_worker.get(user_id).is_active
+
+def test_cached_user_is_reused_until_the_version_moves(app):
+    user_id = make_user()
+    other_worker = UserCache(sync_interval=0)
+    first = other_worker.get(user_id)
+    assert other_worker.get(user_id) is first
+
+    other_worker.shared_version.interval = 3600
+    db.session.get(User, user_id).full_name = 'Renamed'
+    db.session.commit()
+    # Within the sync interval the cached identity is still served
+    assert other_worker.get(user_id) is first
+
+def test_other_worker_forgets_a_deleted_employees_bit(app, make_employee):
+    employee_id = make_employee()
+    db.session.add(attendance(employee_id, date.today()))
+    db.session.add(User(username='admin', email='admin@example.com', role='superuser', full_name='Admin',
+                        password_hash=generate_password_hash('secret')))
+    db.session.commit()
+    other_worker = MarkedTodayBitmap(sync_interval=0)
+    assert other_worker.is_marked(employee_id, date.today())
+
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'secret'})
+    client.post('/admin/employees/delete', data={'employee_id': employee_id})
+    # On SQLite the id can be reused by the next employee created
+    assert not other_worker.is_marked(employee_id, date.today())
@@ -0,0 +1,108 @@
+"""
+Change log watermarks under concurrent writers
+"""
+from datetime import date
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app import db
+from conftest import attendance
+from face_utils_working import FaceGallery
+from models import AttendanceChange, Employee
+
+def concurrent_writers():
+    """SQLite serializes writers, so a second one cannot commit while the first is open"""
+    return db.engine.dialect.name != 'sqlite'
+
+def poll(watermark):
+    changes, next_watermark, _ = AttendanceChange.changes_since(watermark)
+    delivered = [change.attendance_id for change in changes]
+    db.session.remove()  # each poll is its own request
+    return delivered, next_watermark
+
+def test_changes_committed_out_of_order_are_not_skipped(app, make_employee):
+    first_employee, second_employee = make_employee('E1'), make_employee('E2')
+    watermark = AttendanceChange.latest_watermark()
+    db.session.remove()
+
+    first, second = Session(db.engine), Session(db.engine)
+    try:
+        # The first writer logs its change, then stays open
+        first_row = attendance(first_employee, date(2024, 5, 1))
+        first.add(first_row)
+        first.flush()
+
+        second_row = attendance(second_employee, date(2024, 5, 1))
+        if concurrent_writers():
+            # ...while the second logs a later change and commits
+            second.add(second_row)
+            second.commit()
+
+        delivered, watermark = poll(watermark)
+        assert first_row.id not in delivered
+
+        first.commit()
+        if not concurrent_writers():
+            second.add(second_row)
+            second.commit()
+
+        more, watermark = poll(watermark)
+        delivered += more
+        assert sorted(delivered) == sorted([first_row.id, second_row.id])
+
+        # Nothing is delivered twice
+        assert poll(watermark)[0] == []
+    finally:
+        first.close()
+        second.close()
+
+def test_sync_pages_resume_from_next_watermark(app, client, make_employee):
+    employee_ids = [make_employee(f"E{i}") for i in range(5)]
+    for employee_id in employee_ids:
+        db.session.add(attendance(employee_id, date(2024, 5, 2)))
+        db.session.commit()
+
+    watermark, seen = 0, []
+    while True:
+        page = client.post('/api/sync-to-dotnet', json={'since': watermark, 'limit': 2}).get_json()
+        assert page['success']
+        seen += [record['attendance_id'] for record in page['data']]
+        watermark = page['next_watermark']
+        if not page['has_more']:
+            break
+
+    assert len(seen) == len(set(seen)) == 5
+
+def test_gallery_sync_picks_up_late_commits(app, make_employee):
+    encoding = np.ones(128, dtype=np.float32)
+    gallery = FaceGallery()
+    gallery.load_from_database()
+    db.session.remove()
+
+    first, second = Session(db.engine), Session(db.engine)
+    try:
+        first_employee = Employee(employee_number='E1', name='First')
+        first_employee.set_face_encoding(encoding)
+        first.add(first_employee)
+        first.flush()
+
+        second_employee = Employee(employee_number='E2', name='Second')
+        second_employee.set_face_encoding(encoding)
+        if concurrent_writers():
+            second.add(second_employee)
+            second.commit()
+
+        gallery.sync()
+        db.session.remove()
+
+        first.commit()
+        if not concurrent_writers():
+            second.add(second_employee)
+            second.commit()
+
+        gallery.sync()
+        assert sorted(gallery.ids.tolist()) == sorted([first_employee.id, second_employee.id])
+    finally:
+        first.close()
+        second.close()
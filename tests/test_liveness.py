@@ -0,0 +1,24 @@
+"""
+Per-stream liveness state
+"""
+from liveness import LivenessRegistry
+
+def test_streams_keep_their_own_blink_state():
+    registry = LivenessRegistry()
+    first = (1, 10)
+    second = (2, 10)
+
+    assert registry.get(first).record_frame(True)
+    assert not registry.get(second).record_frame(False)
+    # A blink earlier in the stream still counts for its later frames
+    assert registry.get(first).record_frame(False)
+
+    registry.reset(first)
+    assert not registry.get(first).record_frame(False)
+
+def test_registry_is_bounded():
+    registry = LivenessRegistry(maxsize=2)
+    for employee_id in range(5):
+        registry.get((1, employee_id)).record_frame(True)
+    assert len(registry.sessions) == 2
+    assert not registry.get((1, 0)).blink_detected
@@ -0,0 +1,50 @@
+"""
+Streamed PDF report layout
+"""
+import io
+from datetime import date, timedelta
+
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate
+
+from app import db
+from conftest import attendance
+from pdf_utils import REPORT_COLUMN_WIDTHS, REPORT_TABLE_HEADER, StreamingDocTemplate, paged_tables
+from report_generator import ReportGenerator
+
+def synthetic_rows(count):
+    return ([f"2024-05-{i % 28 + 1:02d}", '09:00:00', f"Employee {i}", f"E{i}", 'Title', 'Category', 'Supervisor']
+            for i in range(count))
+
+class RecordingDocTemplate(StreamingDocTemplate):
+    """Records the longest story reportlab was handed"""
+    longest_story = 0
+
+    def handle_flowable(self, flowables):
+        self.longest_story = max(self.longest_story, len(flowables))
+        super().handle_flowable(flowables)
+
+def test_streamed_build_matches_a_full_story_in_bounded_memory():
+    full = SimpleDocTemplate(io.BytesIO(), pagesize=A4)
+    full.build(list(paged_tables(REPORT_TABLE_HEADER, synthetic_rows(1000), REPORT_COLUMN_WIDTHS)))
+
+    streamed = RecordingDocTemplate(io.BytesIO(), pagesize=A4)
+    streamed.build(paged_tables(REPORT_TABLE_HEADER, synthetic_rows(1000), REPORT_COLUMN_WIDTHS))
+
+    assert streamed.page == full.page > 20
+    # The lookahead, plus the remainder of a table split across pages
+    assert streamed.longest_story <= StreamingDocTemplate.lookahead + 1
+
+def test_pandas_generator_streams_every_row(app, make_employee):
+    employee_ids = [make_employee(f"E{i}") for i in range(3)]
+    start = date(2024, 1, 1)
+    for day in range(40):
+        for employee_id in employee_ids:
+            db.session.add(attendance(employee_id, start + timedelta(days=day)))
+    db.session.commit()
+
+    pdf_file, error = ReportGenerator().generate_pdf_report(start, start + timedelta(days=39))
+    assert error is None and pdf_file.read(5) == b'%PDF-'
+
+    pdf_file, error = ReportGenerator().generate_pdf_report(date(2020, 1, 1), date(2020, 1, 31))
+    assert pdf_file is None and error.startswith('No attendance records')
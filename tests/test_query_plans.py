@@ -0,0 +1,43 @@
+"""
+The hot attendance queries stay on an index
+"""
+from datetime import date, timedelta
+
+import pytest
+from sqlalchemy import select
+
+from app import db
+from commands import hot_queries, sequential_scans, sqlite_full_scan
+from conftest import attendance
+from models import Attendance
+
+@pytest.fixture
+def seeded(app, make_employee):
+    employee_ids = [make_employee(f"E{i}") for i in range(20)]
+    today = date.today()
+    for day in range(30):
+        for employee_id in employee_ids:
+            db.session.add(attendance(employee_id, today - timedelta(days=day)))
+    db.session.commit()
+    # Planner statistics, so the plans are those of a populated database
+    db.session.execute(db.text('ANALYZE'))
+    return app
+
+@pytest.mark.parametrize('name', list(hot_queries()))
+def test_hot_query_has_no_full_scan(seeded, name):
+    assert sequential_scans(hot_queries()[name]) == []
+
+@pytest.mark.parametrize('detail, table_name', [
+    ('SCAN attendance', 'attendance'),
+    ('SCAN TABLE attendance', 'attendance'),
+    ('SCAN attendance USING INDEX ix_attendance_date', None),
+    ('SCAN TABLE attendance USING COVERING INDEX ix_attendance_datetime', None),
+    ('SEARCH attendance USING INDEX ix_attendance_date (date=?)', None),
+    ('SCAN CONSTANT ROW', None),
+    ('SCAN (subquery-1)', None),
+])
+def test_sqlite_plan_details(app, detail, table_name):
+    assert sqlite_full_scan(detail) == table_name
+
+def test_unindexed_filter_is_reported(seeded):
+    assert sequential_scans(select(Attendance.id).where(Attendance.latitude > 1)) == ['attendance']
@@ -0,0 +1,40 @@
+"""
+Report job cache keys and stale job handling
+"""
+from datetime import date, timedelta
+
+from app import db
+from conftest import attendance
+from models import Employee, ReportJob, get_current_datetime
+from report_jobs import report_data_version, report_jobs
+
+def test_data_version_follows_attendance_in_range_and_names(app, make_employee):
+    employee_id = make_employee()
+    may = (date(2024, 5, 1), date(2024, 5, 31))
+    version = report_data_version(*may)
+
+    db.session.add(attendance(employee_id, date(2024, 6, 1)))
+    db.session.commit()
+    assert report_data_version(*may) == version
+
+    db.session.add(attendance(employee_id, date(2024, 5, 2)))
+    db.session.commit()
+    assert report_data_version(*may) != version
+    version = report_data_version(*may)
+
+    db.session.get(Employee, employee_id).name = 'Renamed'
+    db.session.commit()
+    assert report_data_version(*may) != version
+
+def test_stale_jobs_are_failed_and_not_reused(app, make_employee):
+    user_id = db.session.get(Employee, make_employee()).supervisor.user_id
+    stale = ReportJob(requested_by_id=user_id, report_type='csv', data_version='-', cache_key='-',
+                      status='running',
+                      heartbeat_at=get_current_datetime() - timedelta(seconds=report_jobs.stale_after + 1))
+    db.session.add(stale)
+    db.session.commit()
+    assert report_jobs.describe(stale)['status'] == 'failed'
+
+    report_jobs.fail_stale_jobs()
+    db.session.refresh(stale)
+    assert stale.status == 'failed' and stale.finished_at is not None
@@ -0,0 +1,83 @@
+"""
+The attendance rollup kept by the model hooks matches a rebuild
+"""
+from datetime import date
+
+from werkzeug.security import generate_password_hash
+
+from app import db
+from conftest import attendance
+from models import (Attendance, AttendanceDailyRollup, AttendanceRollupTotal, Employee, JobCategory, JobTitle,
+                    Supervisor, User)
+
+def rollup_rows():
+    """Non-empty day and total rows, in a comparable form"""
+    days = {(row.date, row.category_id, row.supervisor_id): row.count
+            for row in AttendanceDailyRollup.query if row.count}
+    totals = {(row.category_id, row.supervisor_id): row.count
+              for row in AttendanceRollupTotal.query if row.count}
+    return days, totals
+
+def assert_matches_rebuild(app):
+    db.session.expire_all()
+    maintained = rollup_rows()
+    result = app.test_cli_runner().invoke(args=['rebuild-attendance-rollup'])
+    assert result.exit_code == 0, result.output
+    db.session.expire_all()
+    assert maintained == rollup_rows()
+    assert all(count > 0 for rows in maintained for count in rows.values())
+
+def test_rollup_follows_inserts_moves_reassignments_and_deletes(app, make_employee):
+    employee_id = make_employee('E1')
+    other_id = make_employee('E2')
+    user = User.query.one()
+    other_category = JobCategory(name='Other', created_by_id=user.id)
+    db.session.add(other_category)
+    db.session.flush()
+    other_user = User(username='other', email='other@example.com', password_hash='-',
+                      role='supervisor', full_name='Other Supervisor')
+    db.session.add(other_user)
+    db.session.flush()
+    other_title = JobTitle(name='Other Title', category_id=other_category.id)
+    other_supervisor = Supervisor(user_id=other_user.id, full_name='Other Supervisor')
+    db.session.add_all([other_title, other_supervisor])
+    db.session.add_all([attendance(employee_id, date(2024, 5, day)) for day in (1, 2, 3)])
+    db.session.add(attendance(other_id, date(2024, 5, 1)))
+    db.session.commit()
+    assert_matches_rebuild(app)
+
+    # Each change below is made on objects expired by the previous commit
+    record = Attendance.query.filter_by(employee_id=employee_id, date=date(2024, 5, 3)).one()
+    db.session.commit()
+    record.date = date(2024, 6, 3)
+    db.session.commit()
+    assert_matches_rebuild(app)
+
+    employee = db.session.get(Employee, employee_id)
+    db.session.commit()
+    employee.job_title_id = other_title.id
+    db.session.commit()
+    assert_matches_rebuild(app)
+
+    employee.supervisor_id = other_supervisor.id
+    db.session.commit()
+    assert_matches_rebuild(app)
+
+    job_title = db.session.get(JobTitle, db.session.get(Employee, other_id).job_title_id)
+    db.session.commit()
+    job_title.category_id = other_category.id
+    db.session.commit()
+    assert_matches_rebuild(app)
+
+    assert AttendanceDailyRollup.total() == 4
+    assert AttendanceDailyRollup.total(date(2024, 5, 1)) == 2
+
+    db.session.add(User(username='admin', email='admin@example.com', role='superuser', full_name='Admin',
+                        password_hash=generate_password_hash('secret')))
+    db.session.commit()
+    client = app.test_client()
+    client.post('/auth/login', data={'username': 'admin', 'password': 'secret'})
+    client.post('/admin/employees/delete', data={'employee_id': employee_id})
+    assert db.session.get(Employee, employee_id) is None
+    assert_matches_rebuild(app)
+    assert AttendanceDailyRollup.total() == 1
@@ -0,0 +1,28 @@
+"""
+Supervisor scope invalidation across worker processes
+"""
+from app import db
+from models import Employee, JobCategory, Supervisor
+from supervisor_scope import SupervisorScopeCache
+
+def test_other_worker_sees_revoked_access(app, make_employee):
+    employee_id = make_employee()
+    supervisor = Supervisor.query.one()
+    category = JobCategory.query.one()
+    supervisor.allowed_categories.append(category)
+    db.session.commit()
+
+    # A second cache stands in for another worker: this process's commit hooks never touch it
+    other_worker = SupervisorScopeCache(sync_interval=0)
+    scope = other_worker.get(supervisor.id)
+    assert scope.can_access(employee_id) and scope.can_access_category(category.id)
+
+    supervisor.allowed_categories.remove(category)
+    db.session.commit()
+    scope = other_worker.get(supervisor.id)
+    assert not scope.can_access_category(category.id)
+    assert scope.can_access(employee_id)  # still assigned directly
+
+    db.session.get(Employee, employee_id).supervisor_id = None
+    db.session.commit()
+    assert not other_worker.get(supervisor.id).can_access(employee_id)